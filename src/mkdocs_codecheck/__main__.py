@@ -2,19 +2,69 @@
 Check code samples in a directory tree.
 
 % mkdocs-codecheck ~/mySite/code-samples
+
+Merge the results of a run split into shards:
+
+% mkdocs-codecheck merge shard-*.ndjson
+
+Benchmark the checker itself (see benchmark.py):
+
+% mkdocs-codecheck benchmark --baseline bench.json
+
+Keep a tree indexed and check its samples on request (see server.py):
+
+% mkdocs-codecheck serve --recurse ~/mySite/code-samples &
+% mkdocs-codecheck-client ~/mySite/code-samples/hello.py
 """
 
+import typing as T
 import argparse
 import logging
 import time
-from dotenv import load_dotenv
+import sys
+import re
+import os
+from dotenv import load_dotenv, dotenv_values
 from pathlib import Path
 
 from .base import process_code
+from .results import ConsoleSink, NDJSONSink, JUnitSink, merge_results, print_summary
+from .timing import Timings
+from .cache import ResultCache, file_digest
+from .envsetup import EnvironmentStore, DEFAULT_INSTALL_TIMEOUT
+from .capture import Capturer, DEFAULT_LIMIT
+from .engine import Engine, DEFAULT_TIMEOUTS
+from .ratelimit import RuntimeScheduler, RetryPolicy, DEFAULT_PATTERNS, DEFAULT_RETRIES, DEFAULT_DELAY, DEFAULT_MAX_DELAY
+from .gitdiff import GitError
 from . import handlers
+from . import pywarm
+from . import sandbox
+from .shard import parse_shard, load_shard_durations
+from .pipeline import load_history
+from . import watch
 
-def main():
-    p = argparse.ArgumentParser(description="Check code files within a directory or tree.")
+def merge( argv: list ):
+    p = argparse.ArgumentParser(prog="mkdocs-codecheck merge",
+                                description="Combine the --ndjson result files of the shards of a run into one summary.")
+    p.add_argument(
+        "files",
+        help="The NDJSON result files to merge",
+        nargs="+")
+    P = p.parse_args(argv)
+    try:
+        state = merge_results( P.files )
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}')
+        raise SystemExit(22)
+    print_summary( '.', state.summary )
+    if state.failed:
+        print("Errors were discovered in your code samples. Exiting with an error.")
+        raise SystemExit(22)
+
+def add_check_arguments( p: argparse.ArgumentParser ):
+    """
+    Add the arguments of a check, shared by the command line and `serve`.
+    """
     p.add_argument(
         "path",
         help="Path to code samples directory")
@@ -35,22 +85,308 @@ def main():
         action="store_true")
     p.add_argument(
         "--languages",
-        help="The languages to process. A comma delimitted list of any of java, python, php, ruby, javascript, and c#.")
+        help="The languages to process. A comma delimitted list of any of java, python, php, ruby, javascript, and c#, or of languages added by plugins. Default: every language.")
+    p.add_argument(
+        "--skip-missing-toolchains",
+        help="Skip the code samples of languages whose toolchain is not installed, instead of reporting them as errors.",
+        action="store_true")
     p.add_argument(
         "--dotenv",
         help="The path to a .env file that contains environment variables to pull into the current execution context")
-    P = p.parse_args()
+    p.add_argument(
+        "-j", "--jobs",
+        help="The number of code samples to check concurrently. Use 0 for one job per CPU.",
+        type=int,
+        default=1)
+    p.add_argument(
+        "--cache-dir",
+        help="The directory in which to cache passing results (default: ~/.cache/mkdocs-codecheck)")
+    p.add_argument(
+        "--no-cache",
+        help="Check every code sample, ignoring and not updating the result cache.",
+        action="store_true")
+    p.add_argument(
+        "--cache-max-size",
+        help="Evict the least recently used cache entries once the cache exceeds this many megabytes.",
+        type=float,
+        default=64)
+    p.add_argument(
+        "--cache-max-age",
+        help="Evict cache entries that have not been used in this many days.",
+        type=float,
+        default=30)
+    p.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help="Only check files that were changed, added or are untracked since the given git ref.")
+    p.add_argument(
+        "--expand-dependencies",
+        help="With --changed-since, also check every file in the directory of a changed file.",
+        action="store_true")
+    p.add_argument(
+        "--docs-dir",
+        help="Also syntax check the fenced code blocks, and the include directives, of the Markdown pages in this directory.")
+    p.add_argument(
+        "--include-base",
+        help="With --docs-dir, the directory include directives are relative to, like mdx_include's base_path (default: the current directory).")
+    p.add_argument(
+        "--shard",
+        metavar="K/N",
+        help="Only check the K-th of N shards of the code samples, e.g. 2/8 on the second of eight CI nodes.")
+    p.add_argument(
+        "--shard-timings",
+        metavar="FILE",
+        help="With --shard, balance the shards using the durations in this --timings report of a previous run. May be repeated.",
+        action="append")
+    p.add_argument(
+        "--syntax-first",
+        help="Check the syntax of every code sample before running any, then run those that failed last time, and the slowest, first.",
+        action="store_true")
+    p.add_argument(
+        "--syntax-jobs",
+        help="With --syntax-first, the number of syntax checks to run concurrently (default: two per CPU).",
+        type=int)
+    p.add_argument(
+        "--history",
+        metavar="FILE",
+        help="With --syntax-first, the --timings report of a previous run to prioritize code samples by (default: the --timings file, if it exists). May be repeated.",
+        action="append")
+    p.add_argument(
+        "--fail-fast",
+        help="Stop at the first code sample that fails. Implies --syntax-first.",
+        action="store_true")
+    p.add_argument(
+        "--max-failures",
+        metavar="N",
+        help="Stop once N code samples have failed. Implies --syntax-first.",
+        type=int)
+    p.add_argument(
+        "--watch",
+        help="Keep running, and re-check the code samples that change until interrupted.",
+        action="store_true")
+    p.add_argument(
+        "--watch-interval",
+        metavar="SECONDS",
+        help="With --watch, how often to look for changes where inotify is not available.",
+        type=float,
+        default=0.5)
+    p.add_argument(
+        "--debounce",
+        metavar="SECONDS",
+        help="With --watch, wait until files have not changed for this long before re-checking them.",
+        type=float,
+        default=0.2)
+    p.add_argument(
+        "--batch-syntax",
+        help="Syntax check many files per toolchain invocation instead of starting one process per file.",
+        action="store_true")
+    p.add_argument(
+        "--batch-size",
+        help="The maximum number of files in each batch syntax check.",
+        type=int,
+        default=handlers.BATCH_SIZE)
+    p.add_argument(
+        "--python-syntax-processes",
+        help="With --batch-syntax, spread Python syntax checks of large batches across this many processes.",
+        type=int,
+        default=1)
+    p.add_argument(
+        "--warm-python",
+        help="Run Python samples in a pool of pre-warmed interpreters that fork a fresh child per sample.",
+        action="store_true")
+    p.add_argument(
+        "--warm-modules",
+        help="With --warm-python, a comma delimited list of modules each warm interpreter imports up front.")
+    p.add_argument(
+        "--warm-interpreter",
+        help="With --warm-python, the Python interpreter to warm up (default: the one running mkdocs-codecheck).")
+    p.add_argument(
+        "--timings",
+        metavar="FILE",
+        help="Write a JSON report of the time spent on each phase, language and code sample to FILE.")
+    p.add_argument(
+        "--profile",
+        help="Print the time spent on each phase and language, and the slowest code samples.",
+        action="store_true")
+    p.add_argument(
+        "--profile-top",
+        help="The number of slowest code samples listed by --profile.",
+        type=int,
+        default=10)
+    p.add_argument(
+        "--ndjson",
+        metavar="FILE",
+        help="Stream one JSON record per checked file to FILE as results complete ('-' for stdout).")
+    p.add_argument(
+        "--junit",
+        metavar="FILE",
+        help="Write a JUnit XML report of the results to FILE.")
+    p.add_argument(
+        "--output-limit",
+        metavar="BYTES",
+        help="Keep at most this many bytes of the head and tail of each code sample's stdout and stderr.",
+        type=int,
+        default=DEFAULT_LIMIT)
+    p.add_argument(
+        "--spill-dir",
+        help="Write the complete stdout and stderr of every code sample to log files in this directory.")
+    p.add_argument(
+        "--timeout",
+        metavar="SECONDS",
+        help=f"Stop running a code sample after this many seconds (default: {DEFAULT_TIMEOUTS['runtime']:g}).",
+        type=float,
+        default=DEFAULT_TIMEOUTS['runtime'])
+    p.add_argument(
+        "--syntax-timeout",
+        metavar="SECONDS",
+        help=f"Stop checking the syntax of a code sample after this many seconds (default: {DEFAULT_TIMEOUTS['syntax']:g}).",
+        type=float,
+        default=DEFAULT_TIMEOUTS['syntax'])
+    p.add_argument(
+        "--language-timeout",
+        metavar="LANG=SECONDS",
+        help="Stop running code samples of a language after this many seconds, e.g. csharp=300. May be repeated.",
+        action="append")
+    p.add_argument(
+        "--install-deps",
+        help="Install the dependencies of the package.json, composer.json, Gemfile or requirements.txt nearest to each code sample before running it.",
+        action="store_true")
+    p.add_argument(
+        "--env-dir",
+        help="With --install-deps, the directory installed dependencies are kept in (default: ~/.cache/mkdocs-codecheck/envs).")
+    p.add_argument(
+        "--install-timeout",
+        help=f"With --install-deps, stop a command that installs dependencies after this many seconds (default: {DEFAULT_INSTALL_TIMEOUT:g}).",
+        type=float,
+        default=DEFAULT_INSTALL_TIMEOUT)
+    p.add_argument(
+        "--sandbox",
+        help="Run each code sample in a temporary working directory, with only the allowed environment variables and the --dotenv values, and report its peak memory and CPU time.",
+        action="store_true")
+    p.add_argument(
+        "--memory-limit",
+        metavar="MB",
+        help="Limit the memory of each code sample to this many megabytes. Implies --sandbox.",
+        type=float)
+    p.add_argument(
+        "--cpu-limit",
+        metavar="SECONDS",
+        help="Limit each code sample to this many seconds of CPU time. Implies --sandbox.",
+        type=int)
+    p.add_argument(
+        "--max-open-files",
+        help="Limit the number of files each code sample may have open. Implies --sandbox.",
+        type=int)
+    p.add_argument(
+        "--max-processes",
+        help="Limit the number of processes of the current user while a code sample runs. Implies --sandbox.",
+        type=int)
+    p.add_argument(
+        "--env-allow",
+        metavar="PATTERN",
+        help="With --sandbox, also pass environment variables whose name matches PATTERN (e.g. 'RC_*') to code samples. May be repeated.",
+        action="append")
+    p.add_argument(
+        "--rate-limit",
+        metavar="PER_SECOND",
+        help="Start at most this many code samples per second (on average), for samples that call a rate-limited API.",
+        type=float)
+    p.add_argument(
+        "--rate-burst",
+        help="With --rate-limit, how many code samples may start at once before the rate applies.",
+        type=int,
+        default=1)
+    p.add_argument(
+        "--host-concurrency",
+        help="Run at most this many code samples that talk to the same host at once.",
+        type=int)
+    p.add_argument(
+        "--retries",
+        help=f"Retry a code sample that failed because it was rate limited up to this many times (default: {DEFAULT_RETRIES}, no retries).",
+        type=int,
+        default=DEFAULT_RETRIES)
+    p.add_argument(
+        "--retry-pattern",
+        metavar="REGEX",
+        help="A regular expression that, found in the output of a failed code sample, means it was rate limited. May be repeated; replaces the default patterns.",
+        action="append")
+    p.add_argument(
+        "--retry-exit-code",
+        metavar="CODE",
+        help="An exit code that means a code sample was rate limited. May be repeated.",
+        type=int,
+        action="append")
+    p.add_argument(
+        "--retry-delay",
+        metavar="SECONDS",
+        help=f"The base of the exponential backoff between retries (default: {DEFAULT_DELAY:g}).",
+        type=float,
+        default=DEFAULT_DELAY)
+    p.add_argument(
+        "--retry-max-delay",
+        metavar="SECONDS",
+        help=f"The longest wait between retries (default: {DEFAULT_MAX_DELAY:g}).",
+        type=float,
+        default=DEFAULT_MAX_DELAY)
 
+def check_options( P: argparse.Namespace ) -> dict:
+    """
+    Set up what a check needs from the parsed arguments P, returning the
+    options of process_code(). Exits with an error if they are invalid.
+    """
     if P.verbose:
         logging.basicConfig(level=logging.INFO)
 
+    if P.watch:
+        # a watch session never finishes, so there is no report to write
+        for option in ('ndjson', 'junit', 'timings', 'profile', 'shard', 'shard_timings', 'changed_since',
+                       'expand_dependencies', 'fail_fast', 'max_failures', 'syntax_first', 'syntax_jobs', 'history'):
+            if getattr(P, option):
+                print(f'Error: --{option.replace("_", "-")} cannot be used with --watch')
+                raise SystemExit(22)
+
     if P.dotenv:
         dotenv_path = Path( P.dotenv )
         load_dotenv(dotenv_path=dotenv_path)
-        
-    tic = time.monotonic()
-    langs = []
+
+    shard = durations = None
+    if P.shard:
+        try:
+            shard = parse_shard( P.shard )
+            durations = load_shard_durations( P.shard_timings or [] )
+        except (OSError, ValueError) as e:
+            print(f'Error: {e}')
+            raise SystemExit(22)
+
+    max_failures = 1 if P.fail_fast else P.max_failures
+    syntax_first = P.syntax_first or bool(max_failures)
+    history = None
+    if syntax_first:
+        history_files = P.history or ([ P.timings ] if P.timings and Path(P.timings).is_file() else [])
+        try:
+            history = load_history( history_files )
+        except (OSError, ValueError) as e:
+            print(f'Error: cannot read the history of a previous run: {e}')
+            raise SystemExit(22)
+
+    environments = EnvironmentStore( P.env_dir, timeout=P.install_timeout ) if P.install_deps else None
+
+    cache = None
+    if not P.no_cache:
+        cache = ResultCache(
+            P.cache_dir,
+            env_digest=file_digest(P.dotenv),
+            max_size=int(P.cache_max_size * 1024 * 1024),
+            max_age=int(P.cache_max_age * 24 * 60 * 60),
+            environments=environments
+        )
+
+    handlers.PythonCodeHandler.syntax_processes = P.python_syntax_processes
+
+    # None checks every language
+    langs: T.Optional[T.List[str]] = None
     if P.languages != None:
+        langs = []
         for l in P.languages.split(','):
             l = l.strip()
             try:
@@ -60,21 +396,208 @@ def main():
             except handlers.UnknownLanguage as e:
                 print(f'Error: unknown language "{l}"')
                 raise SystemExit(22)
-            langs.append(l)
-    bad = process_code(
-        P.path,
+            langs.append( handlers.canonical_language( l ) )
+    timings = None
+    if P.timings or P.profile:
+        timings = Timings( P.path if Path(P.path).is_dir() else Path(P.path).parent )
+
+    box = None
+    if P.sandbox or P.memory_limit or P.cpu_limit or P.max_open_files or P.max_processes:
+        if P.warm_python:
+            print('Error: --warm-python cannot be combined with --sandbox or resource limits')
+            raise SystemExit(22)
+        if not sandbox.available() and (P.memory_limit or P.cpu_limit or P.max_open_files or P.max_processes):
+            print('Warning: resource limits are not supported on this platform and will not be applied')
+        box = sandbox.Sandbox(
+            memory=int(P.memory_limit * 1024 * 1024) if P.memory_limit else None,
+            cpu=P.cpu_limit,
+            files=P.max_open_files,
+            processes=P.max_processes,
+            env_allow=list(sandbox.DEFAULT_ENV_ALLOWLIST) + (P.env_allow or []),
+            extra_env=dotenv_values(P.dotenv) if P.dotenv else None
+        )
+
+    warm_pool = None
+    if P.warm_python:
+        if P.install_deps:
+            # warm interpreters cannot switch to the virtual environment of a sample
+            print('Error: --warm-python cannot be combined with --install-deps')
+            raise SystemExit(22)
+        if not pywarm.available():
+            print('Error: --warm-python is not supported on this platform')
+            raise SystemExit(22)
+        warm_pool = pywarm.WarmPool(
+            size=P.jobs if P.jobs > 0 else (os.cpu_count() or 1),
+            modules=(P.warm_modules or '').split(','),
+            python=P.warm_interpreter
+        )
+
+    capturer = Capturer( limit=P.output_limit, spill_dir=P.spill_dir )
+
+    language_timeouts = {}
+    for lt in P.language_timeout or []:
+        l, _, seconds = lt.partition('=')
+        try:
+            language_timeouts[l.strip()] = float(seconds)
+        except ValueError:
+            print(f'Error: invalid --language-timeout "{lt}", expected LANG=SECONDS')
+            raise SystemExit(22)
+    try:
+        policy = RetryPolicy(
+            patterns=P.retry_pattern or DEFAULT_PATTERNS,
+            exit_codes=P.retry_exit_code or (),
+            retries=P.retries,
+            delay=P.retry_delay,
+            max_delay=P.retry_max_delay
+        )
+    except re.error as e:
+        print(f'Error: invalid --retry-pattern: {e}')
+        raise SystemExit(22)
+    scheduler = None
+    if P.rate_limit or P.host_concurrency or P.retries > 0:
+        scheduler = RuntimeScheduler(
+            rate=P.rate_limit,
+            burst=P.rate_burst,
+            per_host=P.host_concurrency,
+            policy=policy
+        )
+    engine = Engine(
+        capturer=capturer,
+        concurrency=P.jobs if P.jobs > 0 else (os.cpu_count() or 1),
+        timeouts={ 'runtime': P.timeout, 'syntax': P.syntax_timeout },
+        language_timeouts=language_timeouts,
+        scheduler=scheduler,
+        sandbox=box
+    )
+
+    return dict(
         recurse=P.recurse,
         exclude=P.exclude,
         syntax_only=P.syntax_only,
-        languages=langs
+        languages=langs,
+        jobs=P.jobs,
+        cache=cache,
+        changed_since=P.changed_since,
+        expand_dependencies=P.expand_dependencies,
+        docs_dir=P.docs_dir,
+        include_base=P.include_base,
+        shard=shard,
+        shard_durations=durations,
+        syntax_first=syntax_first,
+        syntax_jobs=P.syntax_jobs,
+        history=history,
+        max_failures=max_failures,
+        skip_missing_toolchains=P.skip_missing_toolchains,
+        environments=environments,
+        batch_syntax=P.batch_syntax,
+        batch_size=P.batch_size,
+        warm_pool=warm_pool,
+        capturer=capturer,
+        engine=engine,
+        timings=timings
     )
 
-    print(f"\n{time.monotonic() - tic:0.3} seconds to check code samples")
+def serve( argv: list ):
+    p = argparse.ArgumentParser(prog="mkdocs-codecheck serve",
+                                description="Keep the code samples under a path indexed, and check them on request from mkdocs-codecheck-client.")
+    add_check_arguments( p )
+    p.add_argument(
+        "--socket",
+        help="The Unix socket to listen on (default: one per user and path, in $XDG_RUNTIME_DIR or the temporary directory)")
+    P = p.parse_args(argv)
+    from . import server
+    if not server.available():
+        print('Error: serve is not supported on this platform')
+        raise SystemExit(22)
+    for option in ('watch', 'shard', 'changed_since', 'timings', 'profile', 'ndjson', 'junit'):
+        if getattr(P, option):
+            print(f'Error: --{option.replace("_", "-")} cannot be used with serve')
+            raise SystemExit(22)
+    options = check_options( P )
+    try:
+        server.serve( P.path, socket_path=P.socket, interval=P.watch_interval, debounce=P.debounce, **options )
+    except OSError as e:
+        print(f'Error: {e}')
+        raise SystemExit(22)
+    finally:
+        if options['warm_pool'] is not None:
+            options['warm_pool'].close()
+
+def main():
+    if sys.argv[1:2] == ['merge']:
+        return merge( sys.argv[2:] )
+    if sys.argv[1:2] == ['serve']:
+        return serve( sys.argv[2:] )
+    if sys.argv[1:2] == ['client']:
+        from . import client
+        return client.main( sys.argv[2:] )
+    if sys.argv[1:2] == ['benchmark']:
+        from . import benchmark
+        return benchmark.main( sys.argv[2:] )
+    p = argparse.ArgumentParser(description="Check code files within a directory or tree.")
+    add_check_arguments( p )
+    P = p.parse_args()
+
+    tic = time.monotonic()
+    options = check_options( P )
+
+    if P.watch:
+        try:
+            bad = watch.watch(
+                P.path,
+                recurse=P.recurse,
+                interval=P.watch_interval,
+                debounce=P.debounce,
+                docs_dir=P.docs_dir,
+                include_base=P.include_base,
+                syntax_only=P.syntax_only,
+                languages=options['languages'],
+                jobs=P.jobs,
+                cache=options['cache'],
+                batch_syntax=P.batch_syntax,
+                batch_size=P.batch_size,
+                warm_pool=options['warm_pool'],
+                capturer=options['capturer'],
+                engine=options['engine'],
+                environments=options['environments'],
+                skip_missing_toolchains=P.skip_missing_toolchains
+            )
+        finally:
+            if options['warm_pool'] is not None:
+                options['warm_pool'].close()
+        if bad:
+            raise SystemExit(22)
+        return
+
+    # with --ndjson -, stdout only carries the records
+    out = sys.stderr if P.ndjson == '-' else sys.stdout
+    sinks = [ ConsoleSink( file=out ) ]
+    if P.ndjson:
+        sinks.append( NDJSONSink( P.ndjson ) )
+    if P.junit:
+        sinks.append( JUnitSink( P.junit ) )
+
+    try:
+        bad = process_code( P.path, sinks=sinks, **options )
+    except GitError as e:
+        print(f'Error: {e}', file=out)
+        raise SystemExit(22)
+    finally:
+        if options['warm_pool'] is not None:
+            options['warm_pool'].close()
+
+    if P.profile:
+        print(file=out)
+        options['timings'].print_profile( P.profile_top, file=out )
+    if P.timings:
+        options['timings'].write( P.timings )
+
+    print(f"\n{time.monotonic() - tic:0.3} seconds to check code samples", file=out)
 
     if bad:
         # using 22 following cURL
         # https://everything.curl.dev/usingcurl/returns
-        print("Errors were discovered in your code samples. Exiting with an error.")
+        print("Errors were discovered in your code samples. Exiting with an error.", file=out)
         raise SystemExit(22)
 
 
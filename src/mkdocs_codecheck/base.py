@@ -1,76 +1,36 @@
 from __future__ import annotations
 from pathlib import Path
 import typing as T
+import asyncio
 import logging
 import re
 import os
 from operator import itemgetter
-import py_compile
-import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from . import handlers
 from . import dotignore
+from . import gitdiff
+from .cache import ResultCache
+from .envsetup import EnvironmentStore, SetupError
+from .capture import Capturer, problem_output
+from .engine import Engine, run_sync, run_in_thread
+from .timing import Timings, span, timed_iter
+from .results import RunState, ResultSink, ConsoleSink, FAILURES, sample_label
+# these used to live here; kept importable from base for existing callers
+from .results import bcolors, STATUS_LABELS, print_summary, relative_path  # noqa: F401
+from . import mdblocks
+from . import shard as sharding
+from .samples import Sample, SampleLike
+from . import pipeline
 
-class bcolors:
-    HEADER    = '\033[95m'
-    OKBLUE    = '\033[94m'
-    OKGREEN   = '\033[92m'
-    WARNING   = '\033[93m'
-    FAIL      = '\033[91m'
-    BOLD      = '\033[1m'
-    UNDERLINE = '\033[4m'
-    ENDC      = '\033[0m'
+# the file with the .gitignore-style rules for the files not to check
+IGNORE_FILE = '.codecheck-ignore'
 
 # http://www.useragentstring.com
 USER_AGENT = "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:64.0) Gecko/20100101 Firefox/64.0"
-SUMMARY = {
-    'total': 0,
-    'passed': 0,
-    'checked': 0,
-    'checked_syntax': 0,
-    'checked_runtime': 0,
-    'errors': 0,
-    'errors_syntax': 0,
-    'errors_runtime': 0,
-    'skipped': 0,
-    'problems': {},
-    'failure': False
-    }
 
-STATUS_LABELS = {
-    'passed':     '✓',
-    'permission': '✖',
-    'syntax':     '✖',
-    'skipped':    '/',
-    'error':      '⚠'
-}
-
-def print_summary( root_path ):
-    SUMMARY["passed_syntax"] = SUMMARY["checked_syntax"] - SUMMARY["errors_syntax"]
-    print(f'SUMMARY')
-    print(f'  Total files: {SUMMARY["total"]}')
-    print(f'SYNTAX CHECKS')
-    print(f'    Files: {SUMMARY["checked_syntax"]}')
-    print(f'   Passed: {SUMMARY["passed_syntax"]}')
-    print(f' Failures: {SUMMARY["errors_syntax"]}')
-    print(f'RUNTIME TESTS')
-    print(f'    Files: {SUMMARY["checked_runtime"]}')
-    print(f'   Passed: {SUMMARY["passed"]}')
-    print(f' Failures: {SUMMARY["errors_runtime"]}')
-
-    for file_path in SUMMARY['problems']:
-        problem = SUMMARY['problems'][file_path]
-        rel_file_path = relative_path( root_path, file_path )
-        p_msg = problem['msg']
-        p_type = problem['type']
-        print(f'\n{bcolors.OKBLUE}{rel_file_path}{bcolors.ENDC}')
-        print(f'[{STATUS_LABELS[p_type]}] {p_msg}')
-
-def relative_path( root_path, file_path ) -> str:
-    cur_dir_name = str( root_path ).rpartition('/')[2]
-    rfp = './' + cur_dir_name + str(file_path).replace( str(root_path), '' )
-    return rfp
-        
 #def ignore_file( fn ) -> bool:
 #    # TODO - switch to an .ignore-file file mechanism
 #    e = r'^(__init__.py|.*\~|\..*)$'
@@ -81,88 +41,372 @@ def relative_path( root_path, file_path ) -> str:
 #    logging.debug(f'Ignore {fn.name}? No.')
 #    return False
 
-def append_problem(fn, msg, t):
-    #logging.info( fn )
-    SUMMARY['problems'][fn["fn"]] = { 'msg': msg, 'type': t }    
+def check_file( f, n: int = 0, languages: T.List[str] = None, syntax_only: bool = False,
+                cache: ResultCache = None, syntax_results: dict = None,
+                warm_pool = None, capturer: Capturer = None, engine: Engine = None,
+                environments: EnvironmentStore = None, skip_missing_toolchains: bool = False ) -> dict:
+    """
+    Synchronous version of check_file_async().
+    """
+    return run_sync( check_file_async( f, n, languages=languages, syntax_only=syntax_only, cache=cache,
+                                       syntax_results=syntax_results, warm_pool=warm_pool,
+                                       capturer=capturer, engine=engine, environments=environments,
+                                       skip_missing_toolchains=skip_missing_toolchains ) )
 
-def process_code(
+async def check_file_async( f, n: int = 0, languages: T.List[str] = None, syntax_only: bool = False,
+                            cache: ResultCache = None, syntax_results: dict = None,
+                            warm_pool = None, capturer: Capturer = None, engine: Engine = None,
+                            environments: EnvironmentStore = None, skip_missing_toolchains: bool = False ) -> dict:
+    """
+    Check a single code sample and return an outcome record. This does not
+    touch any shared state, so many samples can be checked at once on one
+    event loop; the outcome is folded into the run's summary by
+    RunState.record(). If a cache is given, samples
+    with a cached passing result are not checked again. syntax_results holds
+    the results of check_syntax_batches() for samples already checked, and
+    warm_pool is a pywarm.WarmPool for handlers that can use one. The
+    handler's commands run on engine (by default, one built around
+    capturer), which applies timeouts and bounds their output. If
+    environments is given, the dependencies of the sample's manifest are
+    installed (see envsetup) while its syntax is checked, and it runs
+    against them. The time spent in each stage is recorded in the
+    outcome's 'timings'. A sample whose toolchain is not installed is an
+    error, unless skip_missing_toolchains is True or languages was given,
+    in which case it is skipped.
+    """
+    full_path = f["fn"].name
+    spans: T.Dict[str, float] = {}
+    outcome = { 'f': f, 'status': None, 'msg': None, 'language': None, 'timings': spans,
+                'checked_syntax': False, 'checked_runtime': False, 'retries': 0, 'usage': None }
+    logging.debug(f'{n}. Processing {full_path}')
+    if 'problem' in f:
+        # an include directive in a Markdown page that cannot be resolved
+        outcome['status'] = 'error'
+        outcome['msg'] = f['problem']
+        return outcome
+    if f.get('syntax_only'):
+        syntax_only = True
+    setup = None
+    try:
+        with span( spans, 'handler' ):
+            handler = handlers.find_handler( f )
+        if engine is None:
+            engine = Engine( capturer=capturer ) if capturer is not None else handler.engine
+        outcome['language'] = handler.language
+        logging.debug(f'  {n}. {full_path} is type {handler.language}')
+        skip = (languages != None and str(handler.language) not in languages)
+        logging.debug(f'  {n}. Skip this file? {skip} (is {handler.language} in {languages})')
+        if skip:
+            logging.debug(f'  {n}. Skipping language for {handler.language}')
+            outcome['status'] = 'ignored'
+            return outcome
+        # the toolchain is probed the first time one of its samples is seen
+        if not await run_in_thread( handler.is_enabled ):
+            # otherwise a machine without the toolchain would pass without checking anything
+            if skip_missing_toolchains or languages != None:
+                logging.debug(f'  {n}. No {handler.language} toolchain found, skipping {full_path}')
+                outcome['status'] = 'skipped'
+            else:
+                logging.debug(f'  {n}. No {handler.language} toolchain found for {full_path}')
+                outcome['status'] = 'error'
+            outcome['msg'] = f'No {handler.language} toolchain found.'
+            return outcome
+        if cache is not None:
+            key = await run_in_thread( cache.key, handler, f )
+            if cache.lookup( key, syntax_only=syntax_only ):
+                logging.debug(f'  {n}. Cached result found for {full_path}')
+                outcome['status'] = 'cached'
+                return outcome
+        if environments is not None and not syntax_only:
+            # install the sample's dependencies while its syntax is checked
+            setup = asyncio.ensure_future( run_in_thread( environments.prepare, handler, f ) )
+        logging.info(f'  {n}. Checking syntax for {full_path}')
+        outcome['checked_syntax'] = True
+        if syntax_results is not None and f["fn"] in syntax_results:
+            if syntax_results[f["fn"]]:
+                raise handlers.SyntaxError( syntax_results[f["fn"]] )
+        else:
+            logging.info(f'Checking {handler.language} syntax: {full_path}')
+            with span( spans, 'syntax' ):
+                await handler.check_syntax_async( f, engine )
+        if syntax_only:
+            outcome['status'] = 'syntax_passed'
+            if cache is not None:
+                cache.store( key, runtime=False )
+            return outcome
+        environment = None
+        if setup is not None:
+            with span( spans, 'setup' ):
+                environment = await setup
+        logging.debug(f'  {n}. Executing {full_path}')
+        outcome['checked_runtime'] = True
+        with span( spans, 'runtime' ):
+            result, retries, rate_limited = await engine.check_runtime( handler, f, environment=environment,
+                                                                          warm_pool=warm_pool )
+        outcome['retries'] = retries
+        # the peak RSS and CPU time of the sample, when it ran in a sandbox
+        outcome['usage'] = getattr( result, 'usage', None )
+        if result is None:
+            # the handler has nothing to run for this sample
+            outcome['checked_runtime'] = False
+            outcome['status'] = 'syntax_passed'
+        elif result.returncode != 0:
+            outcome['status'] = 'error'
+            outcome['msg'] = problem_output( result )
+            if rate_limited:
+                outcome['msg'] = f'Still rate limited after {retries} retries:\n{outcome["msg"]}'
+        else:
+            # a sample that only passed once the API let it through is flaky
+            outcome['status'] = 'flaky' if retries else 'passed'
+            if retries:
+                outcome['msg'] = f'Passed after {retries} rate limited attempt(s).'
+            if cache is not None:
+                cache.store( key, runtime=True )
+    except handlers.NoCodeHandler as e:
+        logging.debug(f'  {n}. No handler found for: {full_path}')
+        outcome['status'] = 'skipped'
+    except handlers.SyntaxError as e:
+        logging.debug(f'  {n}. There is a syntax problem with the file.')
+        outcome['status'] = 'syntax'
+        outcome['msg'] = f'Syntax error: {e}'
+    except handlers.PermissionsError as e:
+        logging.debug(f'  {n}. The file is not executable.')
+        outcome['status'] = 'permission'
+        outcome['msg'] = 'Not executable.'
+    except handlers.TimedOutError as e:
+        logging.debug(f'  {n}. Process took too long to run.')
+        outcome['status'] = 'error'
+        outcome['msg'] = str(e) or 'Timed out.'
+    except handlers.RuntimeError as e:
+        logging.debug(f'  {n}. The script ({full_path}) exited with an error status code')
+        outcome['status'] = 'error'
+        outcome['msg'] = f'Error executing script: {e}'
+    except SetupError as e:
+        logging.debug(f'  {n}. The dependencies of {full_path} could not be installed')
+        outcome['status'] = 'error'
+        outcome['msg'] = str(e)
+    finally:
+        if setup is not None:
+            if not setup.done():
+                # the sample failed before it needed its dependencies
+                setup.cancel()
+            elif not setup.cancelled():
+                setup.exception()
+    if outcome['msg'] and 'label' in f:
+        # report problems in code blocks against the page they are in
+        outcome['msg'] = outcome['msg'].replace( str(f['fn']), f['label'] )
+    return outcome
+
+def ordered_map( func, items: T.Iterable, jobs: int = 1 ) -> T.Iterator:
+    """
+    Like map(), but runs func across a pool of `jobs` worker threads. Results
+    are yielded in the order of `items`, no matter which worker finishes
+    first. Only a bounded window of items is in flight at once, so `items`
+    may be a lazy generator.
+    """
+    if jobs <= 1:
+        for item in items:
+            yield func( item )
+        return
+    window = jobs * 2
+    with ThreadPoolExecutor( max_workers=jobs ) as pool:
+        pending: T.Deque[Future] = deque()
+        for item in items:
+            pending.append( pool.submit( func, item ) )
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def check_syntax_batches( code_files: list, languages: T.List[str] = None, cache: ResultCache = None,
+                          jobs: int = 1, batch_size: int = handlers.BATCH_SIZE,
+                          timings: Timings = None ) -> dict:
+    """
+    Syntax check code_files in batches, one batch per handler invocation (see
+    CodeHandler.check_syntax_batch), spreading the batches across `jobs`
+    workers. Returns a dict mapping each checked file to an error message or
+    None. Files with a cached result are not checked.
+    """
+    groups: T.Dict[handlers.CodeHandler, list] = {}
+    for f in code_files:
+        try:
+            handler = handlers.find_handler( f )
+        except handlers.NoCodeHandler:
+            continue
+        if languages != None and str(handler.language) not in languages:
+            continue
+        if not handler.is_enabled():
+            continue
+        if cache is not None and cache.lookup( cache.key( handler, f ), syntax_only=True ):
+            continue
+        groups.setdefault( handler, [] ).append( f )
+    batches = [ (handler, files[i:i + batch_size])
+                for handler, files in groups.items()
+                for i in range(0, len(files), batch_size) ]
+    results = {}
+    def check( batch ):
+        handler, files = batch
+        logging.info(f'Checking syntax of {len(files)} file(s) with {type(handler).__name__}')
+        spans = {}
+        with span( spans, 'syntax' ):
+            batch_results = handler.check_syntax_batch( files )
+        return batch, batch_results, spans['syntax']
+    for (handler, files), batch_results, seconds in ordered_map( check, batches, jobs=jobs ):
+        results.update( batch_results )
+        if timings is not None:
+            timings.add_batch( [ f['fn'] for f in files ], handler.language, 'syntax', seconds )
+    return results
+
+def iter_results(
         path: Path,
         recurse: bool = False,
-        exclude: [str] = None,
+        exclude: T.List[str] = None,
         syntax_only: bool = False,
-        languages: [str] = None
-) -> bool:
-    bad = False
-    code_files = find_code_samples( path, recurse=recurse, exclude=exclude )
-    root_path = None
+        languages: T.List[str] = None,
+        jobs: int = 1,
+        cache: ResultCache = None,
+        changed_since: str = None,
+        expand_dependencies: bool = False,
+        docs_dir: Path = None,
+        include_base: Path = None,
+        batch_syntax: bool = False,
+        batch_size: int = handlers.BATCH_SIZE,
+        warm_pool = None,
+        capturer: Capturer = None,
+        engine: Engine = None,
+        timings: Timings = None,
+        state: RunState = None,
+        environments: EnvironmentStore = None,
+        samples: T.Iterable[SampleLike] = None,
+        shard: tuple = None,
+        shard_durations: T.Dict[str, float] = None,
+        syntax_first: bool = False,
+        syntax_jobs: int = None,
+        history: pipeline.History = None,
+        max_failures: int = None,
+        skip_missing_toolchains: bool = False
+) -> T.Generator[dict, None, None]:
+    """
+    Check the code samples under path, yielding the outcome of each file
+    (see check_file_async) in discovery order as soon as it is available.
+    Files skipped because of `languages` are not yielded. If state is given,
+    each outcome is recorded in it before it is yielded. Up to `jobs`
+    samples are checked at once on engine's event loop. If samples is
+    given, those samples (see find_code_samples) are checked instead of the
+    ones under path. If shard is (K, N), only the K-th of N shards of the
+    samples is checked, balanced by shard_durations if given (see
+    shard.partition).
 
-    logging.debug(f'Processing languages: {languages}')
-    for f in code_files:
-        full_path = f["fn"].name
-        root_path = f["path"]
-        SUMMARY['total'] += 1
-        logging.debug(f'{SUMMARY["total"]}. Processing {full_path}')
-        # This should not be necessary as the dotignore file should be used instead
-        #ignore = ignore_file( f["fn"] )
-        #logging.debug(f'  {SUMMARY["total"]}. Exclude? {ignore}')
-        #if ignore:
-        #    continue
+    If syntax_first is True, the syntax of every sample is checked first,
+    up to syntax_jobs at once (by default, two per CPU), and the samples
+    are then run in the order of pipeline.prioritize(), using history if
+    given. If max_failures is given, checking stops once that many samples
+    have failed, and state's summary is marked as stopped. With either,
+    outcomes are yielded as they complete rather than in discovery order.
+    If skip_missing_toolchains is True, samples whose toolchain is not
+    installed are skipped rather than reported as errors.
+    """
+    code_files: T.Iterable[SampleLike]
+    if samples is not None:
+        code_files = iter( samples )
+    else:
+        code_files = find_code_samples( path, recurse=recurse, exclude=exclude,
+                                        changed_since=changed_since,
+                                        expand_dependencies=expand_dependencies,
+                                        docs_dir=docs_dir, include_base=include_base )
+    if not jobs or jobs < 1:
+        jobs = os.cpu_count() or 1
+    if engine is None:
+        engine = Engine( capturer=capturer, concurrency=jobs )
+    if timings is not None:
+        code_files = timed_iter( code_files, timings, 'discovery' )
+    if shard is not None:
+        # every shard must see every sample to agree on the split
+        root_path = Path(path).resolve().expanduser()
+        code_files = sharding.shard_samples( code_files, shard, shard_durations,
+                                             root=root_path if root_path.is_dir() else root_path.parent )
+        logging.debug(f'Shard {shard[0]}/{shard[1]}: {len(code_files)} sample(s)')
 
-        try:
-            handler = handlers.find_handler( f )
-            logging.debug(f'  {SUMMARY["total"]}. {full_path} is type {handler.language}')
-            skip = (languages != None and str(handler.language) not in languages)
-            logging.debug(f'  {SUMMARY["total"]}. Skip this file? {skip} (is {handler.language} in {languages})')
-            if skip:
-                logging.debug(f'  {SUMMARY["total"]}. Skipping language for {handler.language}')
-                continue
-            else:
-                logging.info(f'  {SUMMARY["total"]}. Checking syntax for {full_path}')  
-                SUMMARY['checked_syntax'] += 1
-                logging.info(f'Checking {handler.language} syntax: {full_path}')
-                handler.check_syntax()
-                if not syntax_only: 
-                    logging.debug(f'  {SUMMARY["total"]}. Executing {full_path}')
-                    SUMMARY['checked_runtime'] += 1
-                    result = handler.check_runtime()
-                    if result.returncode > 0:
-                        #logging.info( f'handler.check_runtime() FAILED for {full_path}' )
-                        #logging.info( f'   stderr: {result.stderr}' )
-                        #logging.info( f'   stdout: {result.stdout}' )
-                        #if re.search( r'429 Client Error', result.stderr ):
-                        #    logging.info( f'Rate limit error possibly detected.' )
-                        append_problem( f, result.stderr, "error" )
-                        SUMMARY['errors'] += 1
-                        SUMMARY['errors_runtime'] += 1
-                    else:
-                        #logging.info( f'handler.check_runtime() succeeded. stdout: {result.stdout}' )
-                        SUMMARY['passed'] += 1
-        except handlers.NoCodeHandler as e:
-            logging.debug(f'  {SUMMARY["total"]}. No handler found for: {f["fn"].name}')
-            SUMMARY['skipped'] += 1
-        except handlers.SyntaxError as e:
-            logging.debug(f'  {SUMMARY["total"]}. There is a syntax problem with the file.')
-            append_problem( f, f'Syntax error: {e}', 'syntax' )
-            SUMMARY['errors_syntax'] += 1
-        except handlers.PermissionsError as e:
-            logging.debug(f'  {SUMMARY["total"]}. The file is not executable.')
-            append_problem( f, "Not executable.", "permission" )
-            SUMMARY['errors'] += 1
-            SUMMARY['errors_runtime'] += 1
-        except handlers.TimedOutError as e:
-            logging.debug(f'  {SUMMARY["total"]}. Process took too long to run.')
-            append_problem( f, 'Timed out.', 'error' )
-            SUMMARY['errors'] += 1
-            SUMMARY['errors_runtime'] += 1
-        except handlers.RuntimeError as e:
-            logging.debug(f'  {SUMMARY["total"]}. The script ({full_path}) exited with an error status code')
-            append_problem( f, f'Error executing script: {e}', 'error' )
-            SUMMARY['errors'] += 1
-            SUMMARY['errors_runtime'] += 1
-            
-    if SUMMARY['errors'] > 0: bad = True
-    print_summary( root_path )
-    return bad
+    syntax_results = None
+    if batch_syntax or syntax_first:
+        # batching needs every file up front, so discovery no longer streams
+        files = list( code_files )
+        if batch_syntax:
+            syntax_results = check_syntax_batches( files, languages=languages, cache=cache,
+                                                   jobs=jobs, batch_size=batch_size, timings=timings )
+        else:
+            if not syntax_jobs or syntax_jobs < 1:
+                syntax_jobs = max( jobs, 2 * (os.cpu_count() or 1) )
+            syntax_results = pipeline.check_syntax_first( files, languages=languages, cache=cache,
+                                                          engine=engine, jobs=syntax_jobs, timings=timings )
+        if syntax_first:
+            root_path = Path(path).resolve().expanduser()
+            files = pipeline.prioritize( files, syntax_results, history,
+                                         root=root_path if root_path.is_dir() else root_path.parent )
+            logging.debug(f'Syntax checked {len(syntax_results)} sample(s) first, '
+                          f'{sum(1 for e in syntax_results.values() if e)} failed')
+        code_files = files
+
+    logging.debug(f'Processing languages: {languages} with {jobs} job(s)')
+    async def check( item ):
+        n, f = item
+        return await check_file_async( f, n, languages=languages, syntax_only=syntax_only, cache=cache,
+                                       syntax_results=syntax_results, warm_pool=warm_pool, engine=engine,
+                                       environments=environments, skip_missing_toolchains=skip_missing_toolchains )
+    failures = 0
+    outcomes = engine.map( check, enumerate(code_files, start=1), ordered=not (syntax_first or max_failures) )
+    for outcome in outcomes:
+        if state is not None:
+            state.record( outcome )
+        if outcome['status'] == 'ignored':
+            continue
+        if timings is not None and outcome['language'] is not None:
+            timings.add_sample( sample_label( outcome['f'] ), outcome['language'], outcome['status'], outcome['timings'],
+                                outcome.get('usage') )
+        yield outcome
+        if outcome['status'] in FAILURES:
+            failures += 1
+            if max_failures and failures >= max_failures:
+                logging.info(f'Stopping after {failures} failure(s)')
+                # cancels the checks that are still running
+                outcomes.close()
+                if state is not None:
+                    state.stop()
+                break
+    if timings is not None:
+        timings.finish()
+    if cache is not None:
+        cache.evict()
+
+def process_code(
+        path: Path,
+        recurse: bool = False,
+        exclude: T.List[str] = None,
+        syntax_only: bool = False,
+        languages: T.List[str] = None,
+        sinks: T.List[ResultSink] = None,
+        state: RunState = None,
+        **options
+) -> bool:
+    """
+    Check the code samples under path, reporting each result to sinks (by
+    default, a ConsoleSink that prints the summary at the end). Accepts the
+    same options as iter_results(). Returns True if any sample failed.
+    """
+    root_path = Path(path).resolve().expanduser()
+    if state is None:
+        state = RunState( root_path )
+    if sinks is None:
+        sinks = [ ConsoleSink() ]
+    for sink in sinks:
+        sink.start( state )
+    for outcome in iter_results( path, recurse=recurse, exclude=exclude, syntax_only=syntax_only,
+                                 languages=languages, state=state, **options ):
+        for sink in sinks:
+            sink.result( outcome, state )
+    for sink in sinks:
+        sink.finish( state )
+    return state.failed
 
 def exclude_file( link, exclude ) -> bool:
     for e in exclude:
@@ -171,19 +415,34 @@ def exclude_file( link, exclude ) -> bool:
             return True
     return False
 
-def find_code_samples( path: Path, recurse: bool, exclude: [] = None
-                  ) -> tuple[ T.Iterable, T.Iterable ]:
+def find_code_samples( path: Path, recurse: bool, exclude: T.List[str] = None,
+                       changed_since: str = None, expand_dependencies: bool = False,
+                       docs_dir: Path = None, include_base: Path = None,
+                       ignore: dotignore.dotignore = None
+                  ) -> T.Iterator[SampleLike]:
+    """
+    Yield the code samples under path as they are discovered, so that
+    checking can start while the tree is still being walked. If
+    changed_since is a git ref, only the files changed since that ref (see
+    gitdiff.changed_files) are yielded. If docs_dir is given, the code
+    blocks of the Markdown pages under it follow (see
+    mdblocks.find_markdown_samples), with include directives resolved
+    against include_base. ignore holds the ignore rules to apply; by
+    default they are read from IGNORE_FILE. Files are yielded as compact
+    samples.Sample records, which share their root and the directory they
+    are in.
+    """
     path = Path(path).resolve().expanduser()  # must have .resolve()
-    # these look for local and relative links only
-    # markdown regex to extract links from [Link label](link url)
-    code_samples = []
-    di = dotignore.dotignore('.codecheck-ignore')
-    for fn in di.get_files(path, recurse):
-        #full_path = os.path.join( path, fn.name )
-        if os.path.isfile( fn ):
-            #logging.debug(f'{fn} is a file')
-            code_samples.append( {
-                'fn': fn,
-                'path': path } )
-    return code_samples
-                
+    di = ignore if ignore is not None else dotignore.dotignore( IGNORE_FILE )
+    if changed_since:
+        files = di.filter_files( gitdiff.changed_files( path, changed_since, recurse=recurse,
+                                                        expand_dependencies=expand_dependencies ),
+                                 root=path if path.is_dir() else path.parent )
+        for fn in files:
+            yield Sample.from_path( fn, path )
+    else:
+        # walk_files only yields regular files, no need to stat them again
+        for directory, name in di.walk_files(path, recurse):
+            yield Sample( directory, name, path )
+    if docs_dir:
+        yield from mdblocks.find_markdown_samples( docs_dir, base_path=include_base )
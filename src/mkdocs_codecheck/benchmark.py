@@ -0,0 +1,342 @@
+"""
+Benchmarks of mkdocs-codecheck itself.
+
+A synthetic tree of code samples of a configurable size and shape is
+generated, and the stages that do not depend on a toolchain are timed:
+walking the tree with the ignore rules, discovering samples, dispatching
+them to handlers, and a syntax-only run of process_code. The toolchains
+are replaced by stubs that accept every file, so the numbers measure the
+checker rather than php or javac, and the benchmark runs offline.
+
+% mkdocs-codecheck benchmark --files 5000 --output bench.json
+% mkdocs-codecheck benchmark --files 5000 --baseline bench.json
+
+Results are written as JSON and can be compared against a stored baseline;
+the comparison fails if a benchmark got slower than the tolerance allows.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import typing as T
+import statistics
+import platform
+import tempfile
+import argparse
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+from . import dotignore
+from . import handlers
+from .base import find_code_samples, process_code, IGNORE_FILE
+from .build import BUILDS
+from .engine import Engine
+
+REPORT_VERSION = 1
+DEFAULT_LANGUAGES = ('python', 'javascript', 'ruby', 'php', 'java')
+
+# a minimal sample per language: (file name pattern, contents)
+SAMPLES = {
+    'python':     ( 'sample_{n}.py', 'import sys\n\ndef main():\n    print("sample {n}")\n    return 0\n\nsys.exit(main())\n' ),
+    'javascript': ( 'sample_{n}.js', 'function main() {{\n  console.log("sample {n}");\n}}\nmain();\n' ),
+    'ruby':       ( 'sample_{n}.rb', 'def main\n  puts "sample {n}"\nend\nmain\n' ),
+    'php':        ( 'sample_{n}.php', '<?php\nfunction main() {{\n  echo "sample {n}\\n";\n}}\nmain();\n' ),
+    'java':       ( 'Sample{n}.java', 'public class Sample{n} {{\n  public static void main(String[] args) {{\n'
+                                      '    System.out.println("sample {n}");\n  }}\n}}\n' ),
+    'csharp':     ( 'project_{n}/Program.cs', 'System.Console.WriteLine("sample {n}");\n' ),
+}
+
+# the commands the handlers run, replaced by STUB_SCRIPT
+STUB_COMMANDS = ( 'php', 'node', 'ruby', 'javac', 'java', 'dotnet' )
+
+# Accepts every file: batch syntax scripts (-e/-r) get a clean report for
+# each path on stdin, anything else succeeds silently. -S skips site
+# imports, so the stubs start about as fast as the real toolchains.
+STUB_SCRIPT = '''#!{python} -S
+import json, sys
+if '-e' in sys.argv or '-r' in sys.argv:
+    print(json.dumps({{ p: None for p in json.load(sys.stdin) }}))
+elif '-v' in sys.argv or '--version' in sys.argv:
+    print('stub 1.0')
+'''
+
+def generate_tree( root: Path, files: int = 2000, depth: int = 4, fanout: int = 4,
+                   languages: T.Iterable[str] = DEFAULT_LANGUAGES, ignore_rules: int = 200,
+                   ignored_dirs: int = 20, seed: int = 0 ) -> dict:
+    """
+    Write a tree of code samples under root: `files` samples of the given
+    languages spread over directories nested `depth` levels deep with
+    `fanout` subdirectories each, a .codecheck-ignore with about
+    `ignore_rules` rules, and `ignored_dirs` node_modules directories that
+    the rules exclude. The same arguments always produce the same tree.
+    Returns a description of what was generated.
+    """
+    root = Path(root)
+    rnd = random.Random( seed )
+    languages = list( languages )
+    for language in languages:
+        if language not in SAMPLES:
+            raise ValueError(f'no synthetic samples for "{language}"')
+    dirs = [ root ]
+    level = [ root ]
+    for d in range( depth ):
+        level = [ parent / f'd{d}_{i}' for parent in level for i in range( fanout ) ]
+        dirs.extend( level )
+    for directory in dirs:
+        directory.mkdir( parents=True, exist_ok=True )
+    for n in range( files ):
+        language = languages[ n % len(languages) ]
+        name, body = SAMPLES[language]
+        fn = rnd.choice( dirs ) / name.format( n=n )
+        fn.parent.mkdir( parents=True, exist_ok=True )
+        fn.write_text( body.format( n=n ) )
+        if language == 'csharp':
+            (fn.parent / f'{fn.parent.name}.csproj').write_text(
+                '<Project Sdk="Microsoft.NET.Sdk">\n  <PropertyGroup>\n    <OutputType>Exe</OutputType>\n'
+                '  </PropertyGroup>\n</Project>\n' )
+    # dependencies the ignore rules keep out of the walk
+    for i in range( ignored_dirs ):
+        modules = rnd.choice( dirs ) / 'node_modules' / f'pkg{i}'
+        modules.mkdir( parents=True, exist_ok=True )
+        for j in range( 10 ):
+            (modules / f'index{j}.js').write_text( 'module.exports = {};\n' )
+    rules = [ '# generated by mkdocs-codecheck benchmark', 'node_modules/', '__pycache__/', '*.pyc', '/.bin/' ]
+    kinds = ( 'build-{i}/', '*.tmp{i}', 'd0_0/**/draft_{i}.py', '/generated_{i}', '[ab]ackup_{i}?.rb', '!keep_{i}.php' )
+    while len(rules) < ignore_rules:
+        i = len(rules)
+        rules.append( kinds[ i % len(kinds) ].format( i=i ) )
+    (root / IGNORE_FILE).write_text( '\n'.join( rules ) + '\n' )
+    return { 'files': files, 'depth': depth, 'fanout': fanout, 'directories': len(dirs),
+             'languages': languages, 'ignore_rules': len(rules), 'ignored_dirs': ignored_dirs, 'seed': seed }
+
+def install_stubs( bin_dir: Path ) -> Path:
+    """
+    Write a stub for every toolchain command into bin_dir.
+    """
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir( parents=True, exist_ok=True )
+    for name in STUB_COMMANDS:
+        stub = bin_dir / name
+        stub.write_text( STUB_SCRIPT.format( python=sys.executable ) )
+        stub.chmod( 0o755 )
+    return bin_dir
+
+@contextmanager
+def stub_toolchains( bin_dir: Path ):
+    """
+    Put the stubs in bin_dir first on the PATH, and forget the toolchains
+    probed before, for the duration of the with block.
+    """
+    path = os.environ.get('PATH', '')
+    os.environ['PATH'] = f'{bin_dir}{os.pathsep}{path}'
+    with handlers._PROBES_LOCK:
+        handlers._PROBES.clear()
+    try:
+        yield
+    finally:
+        os.environ['PATH'] = path
+        with handlers._PROBES_LOCK:
+            handlers._PROBES.clear()
+
+@contextmanager
+def cwd( path: Path ):
+    # the ignore file is read from the current directory
+    previous = os.getcwd()
+    os.chdir( path )
+    try:
+        yield
+    finally:
+        os.chdir( previous )
+
+def measure( func, repeat: int ) -> dict:
+    """
+    Time func() repeat times. func returns the number of items it processed.
+    """
+    times = []
+    items = 0
+    for _ in range( repeat ):
+        tic = time.perf_counter()
+        items = func()
+        times.append( time.perf_counter() - tic )
+    return { 'min': min(times), 'median': statistics.median(times), 'max': max(times),
+             'repeat': repeat, 'items': items }
+
+def run_benchmarks( root: Path, repeat: int = 5, jobs: int = 0 ) -> dict:
+    """
+    Run every benchmark over the tree at root, which must have been made by
+    generate_tree() and contain the stubs in <root>/.bin.
+    """
+    root = Path(root).resolve()
+    ignore_file = root / IGNORE_FILE
+    jobs = jobs or os.cpu_count() or 1
+    results = {}
+
+    def walk():
+        return sum( 1 for _ in dotignore.dotignore( str(ignore_file) ).get_files( root, recurse=True ) )
+    results['get_files'] = measure( walk, repeat )
+
+    def discover():
+        return sum( 1 for _ in find_code_samples( root, recurse=True, ignore=dotignore.dotignore( str(ignore_file) ) ) )
+    results['find_code_samples'] = measure( discover, repeat )
+
+    samples = list( find_code_samples( root, recurse=True, ignore=dotignore.dotignore( str(ignore_file) ) ) )
+    def dispatch():
+        for f in samples:
+            try:
+                handlers.find_handler( f )
+            except handlers.NoCodeHandler:
+                pass
+        return len(samples)
+    results['find_handler'] = measure( dispatch, repeat )
+
+    def check( batch_syntax: bool ):
+        def run():
+            # builds are kept for the life of the process; start each run cold
+            BUILDS.close()
+            process_code( root, recurse=True, syntax_only=True, jobs=jobs, batch_syntax=batch_syntax,
+                          engine=Engine( concurrency=jobs ), sinks=[] )
+            return len(samples)
+        return run
+    with stub_toolchains( root / '.bin' ), cwd( root ):
+        results['process_code_syntax_only'] = measure( check( False ), repeat )
+        results['process_code_batch_syntax'] = measure( check( True ), repeat )
+    return results
+
+def report( tree: dict, results: dict, jobs: int ) -> dict:
+    return {
+        'version': REPORT_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'jobs': jobs,
+        'tree': tree,
+        'results': results
+    }
+
+def compare( current: dict, baseline: dict, tolerance: float = 0.25 ) -> T.List[tuple]:
+    """
+    Compare the median times of two reports. Returns (name, baseline,
+    current, change, regressed) for every benchmark in both, where change is
+    the relative difference and regressed is whether it exceeds tolerance.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get( name )
+        if old is None:
+            continue
+        change = (result['median'] - old['median']) / old['median'] if old['median'] else 0.0
+        rows.append( ( name, old['median'], result['median'], change, change > tolerance ) )
+    return rows
+
+def print_results( results: dict ):
+    print('BENCHMARKS')
+    for name, result in results.items():
+        print(f'  {name:<26} {result["median"]:9.4f}s median {result["min"]:9.4f}s min  {result["items"]:>7} items')
+
+def print_comparison( rows: T.List[tuple], tolerance: float ):
+    print(f'COMPARED TO BASELINE (tolerance {tolerance:.0%})')
+    for name, old, new, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f'  {name:<26} {old:9.4f}s -> {new:9.4f}s {change:+8.1%}{flag}')
+
+def main( argv: T.List[str] = None ):
+    p = argparse.ArgumentParser(prog="mkdocs-codecheck benchmark",
+                                description="Time discovery, ignore matching, dispatch and syntax checking over a synthetic tree of code samples.")
+    p.add_argument(
+        "--files",
+        help="The number of code samples to generate.",
+        type=int,
+        default=2000)
+    p.add_argument(
+        "--depth",
+        help="How deep to nest directories.",
+        type=int,
+        default=4)
+    p.add_argument(
+        "--fanout",
+        help="The number of subdirectories of each directory.",
+        type=int,
+        default=4)
+    p.add_argument(
+        "--ignore-rules",
+        help="The number of rules in the generated .codecheck-ignore.",
+        type=int,
+        default=200)
+    p.add_argument(
+        "--languages",
+        help=f"A comma delimited list of the languages to generate samples for, of {', '.join(SAMPLES)}.",
+        default=','.join(DEFAULT_LANGUAGES))
+    p.add_argument(
+        "--seed",
+        help="The seed the tree is generated from.",
+        type=int,
+        default=0)
+    p.add_argument(
+        "--repeat",
+        help="The number of times to run each benchmark.",
+        type=int,
+        default=3)
+    p.add_argument(
+        "-j", "--jobs",
+        help="The number of code samples process_code checks concurrently. Use 0 for one job per CPU.",
+        type=int,
+        default=0)
+    p.add_argument(
+        "--tree",
+        help="Generate the tree in this directory and keep it, instead of in a temporary directory.")
+    p.add_argument(
+        "--output",
+        metavar="FILE",
+        help="Write the JSON report to FILE ('-' for stdout).")
+    p.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="Compare the results with this JSON report, and fail if a benchmark got slower than --tolerance allows.")
+    p.add_argument(
+        "--tolerance",
+        help="The relative slowdown of a median time that counts as a regression.",
+        type=float,
+        default=0.25)
+    P = p.parse_args(argv)
+
+    baseline = None
+    if P.baseline:
+        try:
+            with open(P.baseline) as fh:
+                baseline = json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f'Error: cannot read the baseline: {e}')
+            raise SystemExit(22)
+
+    root = Path(P.tree) if P.tree else Path( tempfile.mkdtemp(prefix='codecheck-bench-') )
+    try:
+        try:
+            tree = generate_tree( root, files=P.files, depth=P.depth, fanout=P.fanout,
+                                  languages=[ l.strip() for l in P.languages.split(',') ],
+                                  ignore_rules=P.ignore_rules, seed=P.seed )
+        except ValueError as e:
+            print(f'Error: {e}')
+            raise SystemExit(22)
+        install_stubs( root / '.bin' )
+        results = run_benchmarks( root, repeat=P.repeat, jobs=P.jobs )
+    finally:
+        if not P.tree:
+            shutil.rmtree( root, ignore_errors=True )
+
+    data = report( tree, results, P.jobs or os.cpu_count() or 1 )
+    if P.output == '-':
+        print( json.dumps( data, indent=2 ) )
+    else:
+        print_results( results )
+        if P.output:
+            with open(P.output, 'w') as fh:
+                json.dump( data, fh, indent=2 )
+    if baseline is not None:
+        if baseline.get('tree') != tree:
+            print('Warning: the baseline was measured on a different tree')
+        rows = compare( data, baseline, P.tolerance )
+        print_comparison( rows, P.tolerance )
+        if any( row[4] for row in rows ):
+            raise SystemExit(1)
@@ -0,0 +1,255 @@
+"""
+The shared build stage of compiled languages.
+
+Java samples are compiled once per directory, and C# samples once per
+project, into a temporary output directory. The syntax check is the build,
+and the runtime check runs the artifact it produced, so no sample is
+compiled twice and nothing is written next to the sources. Builds are
+keyed by their directory and a digest of their inputs, so an edited sample
+is rebuilt by the next run of a long-lived process, and the output
+directory of the build it replaces is removed once nothing runs from it.
+"""
+from pathlib import Path
+import typing as T
+import concurrent.futures
+import contextlib
+import threading
+import tempfile
+import asyncio
+import logging
+import atexit
+import shutil
+import os
+
+class Build:
+    """
+    The outcome of compiling one group of sources into out_dir.
+    """
+    def __init__( self, returncode: int, output: str, out_dir: Path ):
+        self.returncode = returncode
+        self.output = output
+        self.out_dir = out_dir
+        # the number of samples running from out_dir; see BuildStore.using()
+        self.users = 0
+        # set once a newer build replaced this one
+        self.retired = False
+        # set once out_dir was removed
+        self.removed = False
+
+    @property
+    def ok( self ) -> bool:
+        return self.returncode == 0
+
+def inputs_digest( paths: T.Iterable[Path] ) -> tuple:
+    """
+    A cheap fingerprint of the inputs of a build: their names, sizes and
+    modification times.
+    """
+    digest = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        digest.append( (str(p), st.st_size, st.st_mtime_ns) )
+    return tuple(digest)
+
+class BuildAbandoned(Exception):
+    """The build another caller was waiting for was cancelled."""
+    pass
+
+class BuildStore:
+    """
+    The builds of a process. Each (key, digest) is built at most once, and
+    concurrent requests for the same build, from any thread or event loop,
+    wait for the first. A build whose inputs changed replaces the previous
+    one, whose output directory is removed as soon as no sample runs from
+    it (see using()).
+    """
+    def __init__( self, root: Path = None ):
+        self._root = Path(root) if root else None
+        # key -> (digest, Build)
+        self.builds: T.Dict[T.Any, T.Tuple[tuple, Build]] = {}
+        # (key, digest) -> concurrent.futures.Future of the build in progress
+        self.pending: T.Dict[tuple, concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def root( self ) -> Path:
+        with self.lock:
+            if self._root is None:
+                self._root = Path( tempfile.mkdtemp(prefix='codecheck-build-') )
+            return self._root
+
+    def out_dir( self ) -> Path:
+        return Path( tempfile.mkdtemp(dir=self.root) )
+
+    def get( self, key, digest ) -> T.Optional[Build]:
+        with self.lock:
+            entry = self.builds.get( key )
+        if entry is not None and entry[0] == digest:
+            return entry[1]
+        return None
+
+    def put( self, key, digest, build: Build ) -> Build:
+        with self.lock:
+            old = self.builds.get( key )
+            self.builds[key] = ( digest, build )
+            if old is not None and old[1] is not build:
+                old[1].retired = True
+                old = old if old[1].users == 0 else None
+        if old is not None:
+            self.remove( old[1] )
+        return build
+
+    def remove( self, build: Build ):
+        with self.lock:
+            if build.removed:
+                return
+            build.removed = True
+        logging.debug(f'Removing {build.out_dir}')
+        shutil.rmtree( build.out_dir, ignore_errors=True )
+
+    def hold( self, build: Build ) -> bool:
+        """
+        Keep the output directory of build until release() is called.
+        Returns False if it was already removed.
+        """
+        with self.lock:
+            if build.removed:
+                return False
+            build.users += 1
+            return True
+
+    def release( self, build: Build ):
+        with self.lock:
+            build.users -= 1
+            done = build.retired and build.users == 0
+        if done:
+            self.remove( build )
+
+    @contextlib.asynccontextmanager
+    async def using( self, make: T.Callable[[], T.Awaitable[Build]] ):
+        """
+        Await make() for a build and hold it for the duration of the block,
+        for running a sample from its output directory.
+        """
+        build = await make()
+        while not self.hold( build ):
+            # replaced and removed in the meantime, by a check that saw the
+            # sample change
+            build = await make()
+        try:
+            yield build
+        finally:
+            self.release( build )
+
+    def claim( self, key, digest ) -> T.Tuple[T.Optional[Build], concurrent.futures.Future, bool]:
+        """
+        Return the build of (key, digest) if there is one. Otherwise return
+        the future of the build, and whether the caller is the one to build
+        it, in which case it must finish() it.
+        """
+        with self.lock:
+            entry = self.builds.get( key )
+            if entry is not None and entry[0] == digest:
+                return entry[1], None, False
+            future = self.pending.get( (key, digest) )
+            if future is not None:
+                return None, future, False
+            future = self.pending[ (key, digest) ] = concurrent.futures.Future()
+            return None, future, True
+
+    def finish( self, key, digest, future: concurrent.futures.Future, build: Build = None,
+                error: BaseException = None ):
+        """
+        Record the outcome of a build claimed with claim(), and wake up the
+        callers waiting for it.
+        """
+        if build is not None:
+            self.put( key, digest, build )
+        with self.lock:
+            if self.pending.get( (key, digest) ) is future:
+                del self.pending[ (key, digest) ]
+        if build is not None:
+            future.set_result( build )
+        else:
+            future.set_exception( error )
+
+    async def build( self, key, digest, compile ) -> Build:
+        """
+        Return the build of key, awaiting compile(out_dir) -> (returncode,
+        output) to produce it if there is no build of the same inputs yet.
+        """
+        while True:
+            build, future, owner = self.claim( key, digest )
+            if build is not None:
+                return build
+            if not owner:
+                waiting = asyncio.wrap_future( future )
+                # retrieved even if this caller is cancelled, so it is not logged
+                waiting.add_done_callback( lambda f: f.cancelled() or f.exception() )
+                try:
+                    return await asyncio.shield( waiting )
+                except BuildAbandoned:
+                    # the first caller was cancelled, build it ourselves
+                    continue
+            out_dir = None
+            try:
+                out_dir = self.out_dir()
+                logging.debug(f'Building {key} into {out_dir}')
+                returncode, output = await compile( out_dir )
+            except asyncio.CancelledError:
+                self.abandon( out_dir )
+                self.finish( key, digest, future, error=BuildAbandoned(key) )
+                raise
+            except BaseException as e:
+                self.abandon( out_dir )
+                self.finish( key, digest, future, error=e )
+                raise
+            build = Build( returncode, output, out_dir )
+            self.finish( key, digest, future, build=build )
+            return build
+
+    def build_sync( self, key, digest, compile ) -> Build:
+        """
+        Like build(), for a compile(out_dir) -> (returncode, output) that is
+        an ordinary function.
+        """
+        while True:
+            build, future, owner = self.claim( key, digest )
+            if build is not None:
+                return build
+            if not owner:
+                try:
+                    return future.result()
+                except BuildAbandoned:
+                    continue
+            out_dir = None
+            try:
+                out_dir = self.out_dir()
+                logging.debug(f'Building {key} into {out_dir}')
+                returncode, output = compile( out_dir )
+            except BaseException as e:
+                self.abandon( out_dir )
+                self.finish( key, digest, future, error=e )
+                raise
+            build = Build( returncode, output, out_dir )
+            self.finish( key, digest, future, build=build )
+            return build
+
+    def abandon( self, out_dir: T.Optional[Path] ):
+        # the output of a build that did not finish is never used
+        if out_dir is not None:
+            shutil.rmtree( out_dir, ignore_errors=True )
+
+    def close( self ):
+        with self.lock:
+            root, self._root = self._root, None
+            self.builds.clear()
+        if root is not None:
+            shutil.rmtree( root, ignore_errors=True )
+
+# the builds of this process, removed when it exits
+BUILDS = BuildStore()
+atexit.register( BUILDS.close )
@@ -0,0 +1,143 @@
+"""
+A persistent, content-addressed cache of passing check results.
+
+Each entry is keyed on the contents of the sample, the handler language,
+the toolchain version and a digest of the --dotenv environment, and with
+--install-deps on the manifest and lockfile the sample runs against, so
+that a sample is only re-checked when something that could change its
+result has changed.
+"""
+from pathlib import Path
+import typing as T
+import hashlib
+import logging
+import json
+import os
+import time
+
+# bump to invalidate every existing cache entry
+CACHE_FORMAT = 1
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024    # bytes
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60    # seconds
+
+def default_cache_dir() -> Path:
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'mkdocs-codecheck'
+
+def file_digest( path ) -> str:
+    """
+    Return the sha256 hex digest of a file's contents, or an empty string if
+    there is no such file.
+    """
+    if path is None:
+        return ''
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 16), b''):
+                h.update(chunk)
+    except OSError:
+        return ''
+    return h.hexdigest()
+
+class ResultCache:
+
+    def __init__( self, cache_dir: Path = None, env_digest: str = '',
+                  max_size: int = DEFAULT_MAX_SIZE, max_age: int = DEFAULT_MAX_AGE,
+                  evict_interval: float = None, environments = None ):
+        self.cache_dir = Path(cache_dir or default_cache_dir()).expanduser()
+        self.env_digest = env_digest
+        self.max_size = max_size
+        self.max_age = max_age
+        # long-running processes evict at most once per evict_interval seconds
+        self.evict_interval = evict_interval
+        self.evicted: T.Optional[float] = None
+        # an envsetup.EnvironmentStore, when dependencies are installed
+        self.environments = environments
+
+    def key( self, handler, f ) -> str:
+        h = hashlib.sha256()
+        h.update(f'{CACHE_FORMAT}\0{handler.language}\0{handler.toolchain_version()}\0{self.env_digest}'.encode())
+        if self.environments is not None:
+            h.update(f'\0{self.environments.manifest_digest( handler, f )}'.encode())
+        for p in handler.inputs( f ):
+            h.update(b'\0')
+            h.update(file_digest(p).encode())
+        return h.hexdigest()
+
+    def _entry( self, key: str ) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.json'
+
+    def lookup( self, key: str, syntax_only: bool = False ) -> bool:
+        """
+        Return True if a passing result is cached for key. A passing runtime
+        check also satisfies a syntax-only lookup.
+        """
+        entry = self._entry(key)
+        try:
+            with open(entry) as fh:
+                record = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if not (syntax_only or record.get('runtime')):
+            return False
+        try:
+            # keep recently used entries from being evicted
+            os.utime(entry)
+        except OSError:
+            pass
+        return True
+
+    def store( self, key: str, runtime: bool ):
+        entry = self._entry(key)
+        record = { 'syntax': True, 'runtime': runtime, 'time': time.time() }
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            tmp = entry.with_suffix(f'.{os.getpid()}.{id(record)}.tmp')
+            with open(tmp, 'w') as fh:
+                json.dump(record, fh)
+            os.replace(tmp, entry)
+        except OSError as e:
+            logging.debug(f'Could not write cache entry {entry}: {e}')
+
+    def evict( self ) -> int:
+        """
+        Remove entries older than max_age, then the least recently used
+        entries until the cache is no larger than max_size. Returns the
+        number of entries removed.
+        """
+        if self.evict_interval is not None and self.evicted is not None:
+            if time.monotonic() - self.evicted < self.evict_interval:
+                return 0
+        self.evicted = time.monotonic()
+        if not self.cache_dir.is_dir():
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for entry in self.cache_dir.glob('*/*.json'):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if self.max_age is not None and now - st.st_mtime > self.max_age:
+                removed += self._remove(entry)
+            else:
+                entries.append( (st.st_mtime, st.st_size, entry) )
+        total = sum(size for _, size, _ in entries)
+        if self.max_size is not None and total > self.max_size:
+            entries.sort()
+            for _, size, entry in entries:
+                if total <= self.max_size:
+                    break
+                removed += self._remove(entry)
+                total -= size
+        logging.debug(f'Evicted {removed} cache entries from {self.cache_dir}')
+        return removed
+
+    def _remove( self, entry: Path ) -> int:
+        try:
+            entry.unlink()
+            return 1
+        except OSError:
+            return 0
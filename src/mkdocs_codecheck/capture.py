@@ -0,0 +1,192 @@
+"""
+Bounded capture of the output of the processes handlers start.
+
+A chatty sample must neither exhaust memory nor flood the terminal, so
+output is streamed through a ring buffer that keeps only the head and the
+tail of each stream up to a byte cap, and is only decoded once, after the
+process exits. The complete output can optionally be spilled to a log file
+per sample.
+"""
+from pathlib import Path
+import subprocess
+import asyncio
+import signal
+import re
+import os
+
+DEFAULT_LIMIT = 64 * 1024    # bytes kept per stream
+CHUNK_SIZE = 64 * 1024
+
+class RingBuffer:
+    """
+    Keeps the first and last limit/2 bytes written to it.
+    """
+    def __init__( self, limit: int = DEFAULT_LIMIT ):
+        self.limit = limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write( self, data: bytes ):
+        self.total += len(data)
+        half = self.limit // 2
+        room = half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data[-(self.limit - half):]
+            excess = len(self.tail) - (self.limit - half)
+            if excess > 0:
+                del self.tail[:excess]
+
+    @property
+    def omitted( self ) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def getvalue( self ) -> str:
+        if self.omitted:
+            return (self.head.decode('utf-8', 'replace')
+                    + f'\n... [{self.omitted} bytes omitted] ...\n'
+                    + self.tail.decode('utf-8', 'replace'))
+        return (self.head + self.tail).decode('utf-8', 'replace')
+
+class CapturedProcess( subprocess.CompletedProcess ):
+    """
+    A CompletedProcess whose stdout and stderr hold at most the captured
+    head and tail of each stream. stdout_log and stderr_log name the files
+    the complete output was spilled to, if any.
+    """
+    def __init__( self, args, returncode, stdout, stderr, stdout_log = None, stderr_log = None,
+                  truncated: bool = False ):
+        super().__init__( args, returncode, stdout, stderr )
+        self.stdout_log = stdout_log
+        self.stderr_log = stderr_log
+        self.truncated = truncated
+
+def log_name( name: str ) -> str:
+    """
+    Turn a sample's relative path into a flat, safe log file name.
+    """
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(name).strip('/'))
+
+class Capturer:
+    """
+    Runs commands with bounded output capture. limit is the number of bytes
+    kept per stream; if spill_dir is set, the complete output of each
+    command is also written to <spill_dir>/<name>.<stage>.{stdout,stderr}.log
+    """
+    def __init__( self, limit: int = DEFAULT_LIMIT, spill_dir: Path = None ):
+        self.limit = limit
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def log_paths( self, name: str, stage: str ) -> tuple:
+        if self.spill_dir is None or name is None:
+            return None, None
+        base = self.spill_dir / f'{log_name(name)}.{stage}'
+        return Path(f'{base}.stdout.log'), Path(f'{base}.stderr.log')
+
+    def run( self, argv: list, name: str = None, stage: str = 'run', timeout: float = None,
+             cwd = None, env: dict = None ) -> CapturedProcess:
+        """
+        Run argv like subprocess.run(argv, stdout=PIPE, stderr=PIPE). See
+        run_async().
+        """
+        return asyncio.run( self.run_async( argv, name=name, stage=stage, timeout=timeout, cwd=cwd, env=env ) )
+
+    async def run_async( self, argv: list, name: str = None, stage: str = 'run', timeout: float = None,
+                         cwd = None, env: dict = None ) -> CapturedProcess:
+        """
+        Run argv as an asyncio subprocess in a new process group. On timeout,
+        or if the caller is cancelled, the whole group is killed; a timeout
+        raises subprocess.TimeoutExpired with the output captured so far.
+        """
+        argv = [ str(a) for a in argv ]
+        logs = self.log_paths( name, stage )
+        buffers = ( RingBuffer(self.limit), RingBuffer(self.limit) )
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        proc = await asyncio.create_subprocess_exec(*argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                                    stderr=subprocess.PIPE, cwd=cwd, env=env,
+                                                    start_new_session=(os.name == 'posix'))
+        readers = [ asyncio.ensure_future( pump(stream, buf, log) )
+                    for stream, buf, log in zip((proc.stdout, proc.stderr), buffers, logs) ]
+        def remaining():
+            return None if deadline is None else max(0, deadline - loop.time())
+        try:
+            returncode = await asyncio.wait_for( proc.wait(), remaining() )
+            # a background child can keep the pipes open after the sample exits
+            await asyncio.wait_for( asyncio.gather(*readers), remaining() )
+        except asyncio.TimeoutError:
+            await self._kill( proc, readers )
+            raise subprocess.TimeoutExpired(argv, timeout, output=buffers[0].getvalue(),
+                                            stderr=buffers[1].getvalue())
+        except BaseException:
+            await asyncio.shield( self._kill( proc, readers ) )
+            raise
+        return CapturedProcess(argv, returncode, buffers[0].getvalue(), buffers[1].getvalue(),
+                               stdout_log=logs[0], stderr_log=logs[1],
+                               truncated=bool(buffers[0].omitted or buffers[1].omitted))
+
+    async def _kill( self, proc, readers: list ):
+        kill_group( proc )
+        try:
+            await asyncio.wait_for( asyncio.gather(*readers), 1 )
+        except asyncio.TimeoutError:
+            for r in readers:
+                r.cancel()
+        await proc.wait()
+
+async def pump( stream, buf: RingBuffer, log: Path = None ):
+    """
+    Copy a stream into a ring buffer, and into a log file if given.
+    """
+    fh = open(log, 'wb') if log is not None else None
+    try:
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buf.write(chunk)
+            if fh is not None:
+                fh.write(chunk)
+    finally:
+        if fh is not None:
+            fh.close()
+
+def kill_group( proc ):
+    """
+    Kill a process started with start_new_session, and everything it started.
+    """
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
+
+def exit_description( returncode: int ) -> str:
+    if returncode < 0:
+        try:
+            return f'Killed by {signal.Signals(-returncode).name}.'
+        except ValueError:
+            return f'Killed by signal {-returncode}.'
+    return f'Exited with status {returncode}.'
+
+def problem_output( result: subprocess.CompletedProcess ) -> str:
+    """
+    The output to report for a failed command: stderr, or stdout if the
+    command wrote nothing to stderr (php reports errors on stdout), with a
+    pointer to the complete log if it was spilled. A command that wrote
+    nothing is described by how it exited, e.g. killed by a resource limit.
+    """
+    text = result.stderr or result.stdout or ''
+    if not text.strip():
+        text = exit_description( result.returncode )
+    log = getattr(result, 'stderr_log' if result.stderr else 'stdout_log', None)
+    if log is not None:
+        text = f'{text.rstrip()}\n(complete output: {log})'
+    return text
@@ -0,0 +1,143 @@
+"""
+A thin client of the check daemon (see server.py).
+
+% mkdocs-codecheck-client code-samples/hello.py
+
+It only imports the standard library and results.py, so a check that the
+daemon answers from its warm state costs little more than starting
+Python. The daemon is found by its socket: the default socket of the path
+being checked or of one of its parent directories, or the one given with
+--socket.
+"""
+from pathlib import Path
+import typing as T
+import argparse
+import tempfile
+import hashlib
+import socket
+import json
+import sys
+import os
+
+# exit codes besides 22, which means code samples failed
+NO_DAEMON = 2
+
+class DaemonError(Exception):
+    """The daemon could not be reached, or did not understand a request."""
+    pass
+
+def default_socket( path ) -> Path:
+    """
+    The socket a daemon serving path listens on by default: one per user
+    and directory, in $XDG_RUNTIME_DIR or the temporary directory.
+    """
+    root = Path(path).expanduser().resolve()
+    digest = hashlib.sha256( str(root).encode() ).hexdigest()[:16]
+    user = os.getuid() if hasattr(os, 'getuid') else os.getlogin()
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return Path(base) / f'mkdocs-codecheck-{user}-{digest}.sock'
+
+def find_socket( paths: T.Iterable ) -> T.Optional[Path]:
+    """
+    The default socket of the first of paths, or of its closest parent, that
+    a daemon is serving.
+    """
+    for path in paths:
+        path = Path(path).expanduser().resolve()
+        for directory in [ path ] + list( path.parents ):
+            candidate = default_socket( directory )
+            if candidate.exists():
+                return candidate
+    return None
+
+def request( socket_path: Path, message: dict, timeout: float = None ) -> T.Iterator[dict]:
+    """
+    Send message to the daemon listening on socket_path and yield each
+    record of its reply, up to the last one (a 'summary', 'pong', 'bye' or
+    'error' record). Raises DaemonError if it cannot be reached.
+    """
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    sock.settimeout( timeout )
+    try:
+        sock.connect( str(socket_path) )
+    except OSError as e:
+        sock.close()
+        raise DaemonError(f'cannot connect to {socket_path}: {e.strerror or e}')
+    with sock, sock.makefile('rb') as reply:
+        sock.sendall( (json.dumps(message) + '\n').encode() )
+        for line in reply:
+            record = json.loads( line )
+            yield record
+            if record.get('type') in ('summary', 'pong', 'bye', 'error'):
+                return
+    raise DaemonError('the daemon closed the connection before it replied')
+
+def main( argv: T.List[str] = None ):
+    p = argparse.ArgumentParser(prog="mkdocs-codecheck-client",
+                                description="Check code samples with a running `mkdocs-codecheck serve` daemon.")
+    p.add_argument(
+        "paths",
+        help="The code samples, Markdown pages or directories to check (default: the current directory)",
+        nargs="*")
+    p.add_argument(
+        "--socket",
+        help="The socket of the daemon (default: the one serving the paths, or a parent directory of them)")
+    p.add_argument(
+        "--syntax-only",
+        help="Check syntax of code only. Do not execute the script.",
+        action="store_true")
+    p.add_argument(
+        "--ndjson",
+        help="Print the JSON records the daemon replies with instead of a summary.",
+        action="store_true")
+    p.add_argument(
+        "--ping",
+        help="Only check that the daemon is running.",
+        action="store_true")
+    p.add_argument(
+        "--shutdown",
+        help="Stop the daemon.",
+        action="store_true")
+    P = p.parse_args(argv)
+
+    paths = [ str(Path(path).expanduser().resolve()) for path in P.paths or [ '.' ] ]
+    socket_path = Path(P.socket) if P.socket else find_socket( paths )
+    if socket_path is None:
+        print(f'Error: no mkdocs-codecheck daemon is serving {P.paths[0] if P.paths else "."}; '
+              f'start one with `mkdocs-codecheck serve`', file=sys.stderr)
+        raise SystemExit(NO_DAEMON)
+    message: T.Dict[str, T.Any]
+    if P.ping:
+        message = { 'command': 'ping' }
+    elif P.shutdown:
+        message = { 'command': 'shutdown' }
+    else:
+        message = { 'command': 'check', 'paths': paths }
+        if P.syntax_only:
+            # otherwise the daemon's own --syntax-only applies
+            message['syntax_only'] = True
+
+    record = {}
+    try:
+        for record in request( socket_path, message ):
+            if P.ndjson or record['type'] in ('pong', 'bye'):
+                print( json.dumps(record), flush=True )
+    except DaemonError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        raise SystemExit(NO_DAEMON)
+    if record.get('type') == 'error':
+        if not P.ndjson:
+            print(f'Error: {record["message"]}', file=sys.stderr)
+        raise SystemExit(NO_DAEMON)
+    if record.get('type') != 'summary':
+        return
+    if not P.ndjson:
+        from .results import print_summary
+        print_summary( record['root'], record )
+    if record['failure']:
+        if not P.ndjson:
+            print("Errors were discovered in your code samples. Exiting with an error.")
+        raise SystemExit(22)
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,333 @@
 from pathlib import Path
 import typing as T
 import logging
+import os
 import re
 
-logging.basicConfig(level=logging.INFO)
+GLOB_CHARS = re.compile(r'[*?\[\\]')
+
+def translate_glob( pat: str ) -> str:
+    """
+    Translate a .gitignore glob into a regular expression that must match a
+    whole '/'-separated path. '*' and '?' do not match '/', while '**/',
+    '/**/' and a trailing '/**' match any number of directories.
+    """
+    i, n = 0, len(pat)
+    out = []
+    while i < n:
+        c = pat[i]
+        if c == '*':
+            if pat.startswith('**', i) and (i == 0 or pat[i-1] == '/'):
+                if i + 2 == n:
+                    out.append('.*')
+                    i += 2
+                    continue
+                if pat[i+2] == '/':
+                    out.append('(?:.*/)?')
+                    i += 3
+                    continue
+            while i < n and pat[i] == '*':
+                i += 1
+            out.append('[^/]*')
+            continue
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < n and pat[j] in '!^':
+                j += 1
+            if j < n and pat[j] == ']':
+                j += 1
+            while j < n and pat[j] != ']':
+                j += 1
+            if j >= n:
+                out.append(re.escape(c))
+            else:
+                body = pat[i+1:j].replace('\\', '\\\\')
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pat[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+class IgnoreRule:
+    """
+    A single line of a .gitignore-style file.
+    """
+    __slots__ = ('pattern', 'negate', 'dir_only', 'anchored', 'literal', 'suffix', 'regex')
+
+    def __init__(self, pattern: str, negate: bool, dir_only: bool, anchored: bool):
+        self.pattern = pattern
+        self.negate = negate
+        self.dir_only = dir_only
+        self.anchored = anchored
+        # fast paths for the common 'name' and '*.ext' rules
+        self.literal = None
+        self.suffix = None
+        self.regex = None
+        if not anchored and not GLOB_CHARS.search(pattern):
+            self.literal = pattern.lower()
+        elif not anchored and pattern.startswith('*') and not GLOB_CHARS.search(pattern[1:]):
+            self.suffix = pattern[1:].lower()
+        else:
+            self.regex = re.compile(translate_glob(pattern), re.IGNORECASE)
+
+    @classmethod
+    def parse( cls, line: str ):
+        """
+        Parse a line, returning None for blank lines and comments.
+        """
+        line = line.rstrip('\n')
+        if not line.endswith('\\ '):
+            line = line.rstrip()
+        if not line or line.startswith('#'):
+            return None
+        negate = False
+        if line.startswith('!'):
+            negate = True
+            line = line[1:]
+        elif line.startswith('\\#') or line.startswith('\\!'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+        # a slash anywhere but the end anchors the rule to the root
+        anchored = '/' in line
+        line = line.lstrip('/')
+        return cls(line, negate, dir_only, anchored)
+
+    def matches( self, rel: str, name: str, is_dir: bool ) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.literal is not None:
+            return name.lower() == self.literal
+        if self.suffix is not None:
+            return name.lower().endswith(self.suffix)
+        return self.regex.fullmatch(rel if self.anchored else name) is not None
+
+class IgnoreMatcher:
+    """
+    Matches '/'-separated paths, relative to the root being walked, against
+    a list of .gitignore-style rules. Everything is compiled up front so
+    that matching a path does no regex compilation.
+    """
+    def __init__(self, lines: T.Iterable[str]):
+        self.rules = [ r for r in (IgnoreRule.parse(l) for l in lines) if r is not None ]
+        self.ordered = any(r.negate for r in self.rules)
+        if not self.ordered:
+            # without negation the order of the rules does not matter, so
+            # collapse them into set lookups and one regex per kind of rule
+            self.names: T.Dict[bool, T.Set[str]] = { False: set(), True: set() }
+            suffixes: T.Dict[bool, T.List[str]] = { False: [], True: [] }
+            name_res: T.Dict[bool, T.List[str]] = { False: [], True: [] }
+            path_res: T.Dict[bool, T.List[str]] = { False: [], True: [] }
+            for r in self.rules:
+                if r.literal is not None:
+                    self.names[r.dir_only].add(r.literal)
+                elif r.suffix is not None:
+                    suffixes[r.dir_only].append(r.suffix)
+                elif r.anchored:
+                    path_res[r.dir_only].append(r.regex.pattern)
+                else:
+                    name_res[r.dir_only].append(r.regex.pattern)
+            self.suffixes = { k: tuple(v) for k, v in suffixes.items() }
+            self.name_re = { k: self._combine(v) for k, v in name_res.items() }
+            self.path_re = { k: self._combine(v) for k, v in path_res.items() }
+
+    def _combine( self, patterns: T.List[str] ):
+        if not patterns:
+            return None
+        return re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE)
+
+    def __bool__( self ) -> bool:
+        return bool(self.rules)
+
+    def match( self, rel: str, is_dir: bool = False ) -> bool:
+        """
+        Return True if the path itself is ignored. Parent directories are not
+        considered; see match_path().
+        """
+        name = rel.rpartition('/')[2]
+        if self.ordered:
+            # the last matching rule wins
+            for r in reversed(self.rules):
+                if r.matches(rel, name, is_dir):
+                    return not r.negate
+            return False
+        lname = name.lower()
+        kinds = (False, True) if is_dir else (False,)
+        for k in kinds:
+            if lname in self.names[k] or (self.suffixes[k] and lname.endswith(self.suffixes[k])):
+                return True
+            if self.name_re[k] is not None and self.name_re[k].fullmatch(name):
+                return True
+            if self.path_re[k] is not None and self.path_re[k].fullmatch(rel):
+                return True
+        return False
+
+    def match_path( self, rel: str, is_dir: bool = False ) -> bool:
+        """
+        Return True if the path or any of its parent directories is ignored.
+        """
+        parts = rel.split('/')
+        for i in range(1, len(parts)):
+            if self.match('/'.join(parts[:i]), is_dir=True):
+                return True
+        return self.match(rel, is_dir)
 
 class dotignore:
-    
+
     def __init__(self, filename):
         self.rules = []
+        self.matcher = None
+        self.root = None
         self.dotignore_filename = filename
 
     def read_dotignore( self ):
         """
-        This will be throwing something most likely in an error. How do we handle that?
+        Read and compile the ignore rules, once. A missing ignore file means
+        nothing is ignored.
         """
+        if self.matcher is not None:
+            return self.rules
         logging.debug(f'Opening {self.dotignore_filename}')
-        with open(self.dotignore_filename) as file:
-            lines = file.readlines()
-            for line in lines:
-                line = line.rstrip()
-                logging.debug(f'line: {line}')
-                self.rules.append( line )
+        try:
+            with open(self.dotignore_filename) as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            logging.debug(f'{self.dotignore_filename} not found, not ignoring any files')
+            lines = []
+        for line in lines:
+            line = line.rstrip('\n')
+            logging.debug(f'line: {line}')
+            self.rules.append( line )
+        self.matcher = IgnoreMatcher( self.rules )
         return self.rules
 
-    def ignore_file( self, filename ):
-        m = re.match( r'^(.+)\/([^\/]+)$', str(filename) )
-        path = m.group(1)
-        fn = m.group(2)
-        logging.debug(f'path={path}, file={fn}')
-        for rule in self.rules:
-            rule = str(rule)
-            logging.debug(f'Checking {fn} against {rule}')
-            if re.search( rf"{rule}", str(filename), re.IGNORECASE ):
-                logging.debug(f'Ignoring {fn}')
-                return True
-        return False
-        
+    def relative( self, filename ) -> str:
+        p = Path(filename)
+        if self.root is not None:
+            try:
+                return p.relative_to(self.root).as_posix()
+            except ValueError:
+                pass
+        return p.as_posix().lstrip('/')
+
+    def ignore_file( self, filename, is_dir: bool = False ):
+        """
+        Return True if the file, or a directory it is in, matches the ignore
+        rules. Paths are matched relative to the root being walked.
+        """
+        self.read_dotignore()
+        ignored = self.matcher.match_path( self.relative(filename), is_dir )
+        if ignored:
+            logging.debug(f'Ignoring {filename}')
+        return ignored
+
+    def filter_files(self, files: T.Iterable[Path], root: Path = None) -> T.Iterable[Path]:
+        """
+        yield the files that are not excluded by the ignore rules.
+        """
+        self.read_dotignore()
+        if root is not None:
+            self.root = Path(root).expanduser().resolve()
+        for p in files:
+            if not self.ignore_file( p ):
+                yield p
+
     def get_files(self, path: Path, recurse: bool = False) -> T.Iterable[Path]:
         """
         yield files in path with suffix ext. Optionally, recurse directories.
+        Ignored directories are never descended into.
         """
         self.read_dotignore()
         path = Path(path).expanduser().resolve()
         if path.is_dir():
-            for p in path.iterdir():
-                if p.is_file():
-                    if self.ignore_file( p ):
-                        continue
-                    else:
-                        yield p
-                elif p.is_dir():
-                    if recurse:
-                        yield from self.get_files(p, recurse)
+            self.root = path
+            yield from self._walk( path, '', recurse )
         elif path.is_file():
             logging.debug(f'Adding file to be checked: {path}')
             yield path
         else:
             raise FileNotFoundError(path)
 
+    def walk_files(self, path: Path, recurse: bool = False) -> T.Iterable[T.Tuple[Path, str]]:
+        """
+        Like get_files(), but yield (directory, name) pairs, where every file
+        in a directory shares the same directory Path.
+        """
+        self.read_dotignore()
+        path = Path(path).expanduser().resolve()
+        if path.is_dir():
+            self.root = path
+            directory = directory_path = None
+            for dir_path, name, full_path in self._walk_entries( path, '', recurse ):
+                # the files of a directory are yielded one after the other
+                if dir_path != directory_path:
+                    directory, directory_path = Path(dir_path), dir_path
+                yield directory, name
+        elif path.is_file():
+            logging.debug(f'Adding file to be checked: {path}')
+            yield path.parent, path.name
+        else:
+            raise FileNotFoundError(path)
+
+    def _walk(self, path: Path, rel: str, recurse: bool) -> T.Iterable[Path]:
+        for dir_path, name, full_path in self._walk_entries( path, rel, recurse ):
+            yield Path(full_path)
+
+    def _walk_entries(self, path: Path, rel: str, recurse: bool) -> T.Iterable[T.Tuple[str, str, str]]:
+        """
+        Walk the tree iteratively with os.scandir, relying on the type
+        information cached in each DirEntry instead of stat'ing every path
+        again, and yield the (directory, name, path) strings of each file
+        that is not ignored. Entries are visited in name order so runs are
+        reproducible. Symlinked directories are followed, but each directory
+        is only walked once, so a link back up the tree cannot loop forever.
+        """
+        stack = [ (str(path), rel) ]
+        seen = set()
+        while stack:
+            dir_path, dir_rel = stack.pop()
+            try:
+                st = os.stat( dir_path )
+            except OSError as e:
+                logging.debug(f'Could not read {dir_path}: {e}')
+                continue
+            if (st.st_dev, st.st_ino) in seen:
+                logging.debug(f'Not walking {dir_path} again')
+                continue
+            seen.add( (st.st_dev, st.st_ino) )
+            subdirs = []
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as e:
+                logging.debug(f'Could not read {dir_path}: {e}')
+                continue
+            for entry in entries:
+                e_rel = f'{dir_rel}/{entry.name}' if dir_rel else entry.name
+                try:
+                    is_file = entry.is_file()
+                    is_dir = not is_file and entry.is_dir()
+                except OSError:
+                    continue
+                if is_file:
+                    if self.matcher.match( e_rel ):
+                        logging.debug(f'Ignoring {entry.path}')
+                        continue
+                    yield dir_path, entry.name, entry.path
+                elif is_dir and recurse:
+                    if self.matcher.match( e_rel, is_dir=True ):
+                        logging.debug(f'Not descending into ignored directory {entry.path}')
+                        continue
+                    subdirs.append( (entry.path, e_rel) )
+            # pushed in reverse so that directories are walked in name order
+            stack.extend( reversed(subdirs) )
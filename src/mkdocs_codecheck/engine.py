@@ -0,0 +1,226 @@
+"""
+The asyncio execution core that handlers run their commands on.
+
+Every syntax and runtime check runs as an asyncio subprocess in its own
+process group, with a timeout chosen per stage, per language or per
+sample. When a check times out, or is cancelled, the whole process group
+is killed, so a sample that hangs on the network costs no more than its
+timeout. Many samples are checked at once on a single event loop, under a
+global concurrency limit; runtime checks can additionally be paced and
+retried by a ratelimit.RuntimeScheduler, and run in a sandbox.Sandbox.
+"""
+from itertools import islice
+import typing as T
+import threading
+import asyncio
+import queue
+import re
+
+from .capture import Capturer
+
+# seconds; None means no timeout
+DEFAULT_TIMEOUTS = { 'syntax': 120.0, 'runtime': 10.0 }
+# runtime timeouts of languages whose run step also builds the sample
+DEFAULT_LANGUAGE_TIMEOUTS = { 'csharp': 120.0 }
+# a sample can ask for its own runtime timeout in a comment near the top,
+# e.g. `# codecheck-timeout: 30`
+TIMEOUT_PRAGMA = re.compile(rb'codecheck-timeout:\s*([0-9.]+)')
+PRAGMA_BYTES = 2048
+
+def run_sync( coro ):
+    """
+    Run a coroutine to completion from synchronous code.
+    """
+    return asyncio.run( coro )
+
+async def run_in_thread( func, *args ):
+    """
+    Run a blocking function in the default executor.
+    """
+    return await asyncio.get_event_loop().run_in_executor( None, func, *args )
+
+def sample_timeout( path ) -> T.Optional[float]:
+    """
+    Return the timeout a sample asks for with a codecheck-timeout comment.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            m = TIMEOUT_PRAGMA.search( fh.read(PRAGMA_BYTES) )
+    except OSError:
+        return None
+    return float(m.group(1)) if m else None
+
+class Engine:
+    """
+    Runs commands for handlers. concurrency is the number of samples that
+    are checked at once by map(); timeouts holds the default timeout of each
+    stage and language_timeouts the runtime timeout of each language. If
+    scheduler is given, runtime checks go through it (see check_runtime),
+    and if sandbox is given, the commands of runtime checks run in it.
+    """
+    def __init__( self, capturer: Capturer = None, concurrency: int = 1, timeouts: dict = None,
+                  language_timeouts: dict = None, scheduler = None, sandbox = None ):
+        self.capturer = capturer or Capturer()
+        self.concurrency = max(1, concurrency)
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.language_timeouts = dict(DEFAULT_LANGUAGE_TIMEOUTS, **(language_timeouts or {}))
+        self.scheduler = scheduler
+        self.sandbox = sandbox
+
+    def timeout_for( self, handler, f, stage: str ) -> T.Optional[float]:
+        if stage == 'runtime':
+            timeout = sample_timeout( f['fn'] )
+            if timeout is not None:
+                return timeout
+            if handler.language in self.language_timeouts:
+                return self.language_timeouts[handler.language]
+        return self.timeouts.get(stage)
+
+    async def run( self, handler, f, argv: T.List[str], stage: str = 'runtime', cwd = None, env: dict = None ):
+        """
+        Run a command for handler's sample f, returning a CapturedProcess.
+        Raises subprocess.TimeoutExpired after the stage's timeout.
+        """
+        if stage == 'runtime' and self.sandbox is not None:
+            return await self.sandbox.run_async( self.capturer, argv, name=handler.sample_name( f ), stage=stage,
+                                                 timeout=self.timeout_for( handler, f, stage ), cwd=cwd, env=env,
+                                                 memory_rlimit=handler.memory_rlimit )
+        return await self.capturer.run_async( argv, name=handler.sample_name( f ), stage=stage,
+                                              timeout=self.timeout_for( handler, f, stage ), cwd=cwd, env=env )
+
+    async def check_runtime( self, handler, f, environment = None, warm_pool = None ) -> tuple:
+        """
+        Run the runtime check of handler's sample f, through the scheduler
+        if there is one. Returns (result, retries, rate_limited); see
+        ratelimit.RuntimeScheduler.run().
+        """
+        def check():
+            return handler.check_runtime_async( f, engine=self, environment=environment, warm_pool=warm_pool )
+        if self.scheduler is None:
+            return await check(), 0, False
+        return await self.scheduler.run( handler, f, check )
+
+    def map( self, func, items: T.Iterable, ordered: bool = True ) -> T.Generator:
+        """
+        Like map(), but func is a coroutine function and up to concurrency
+        calls run at once. See ordered_map_async().
+        """
+        return ordered_map_async( func, items, limit=self.concurrency, ordered=ordered )
+
+def ordered_map_async( func, items: T.Iterable, limit: int = 1, ordered: bool = True ) -> T.Generator:
+    """
+    Await func(item) for each item on an event loop in a background thread,
+    running up to `limit` at once, and yield the results in the order of
+    items, or as they complete if ordered is False. items may be a lazy
+    generator; it is consumed off the event loop, and only a bounded window
+    of results is held: a call's slot in the window is only given back once
+    its result has been taken from the iterator. Closing the iterator early cancels the calls that
+    are still running.
+    """
+    results: queue.Queue = queue.Queue()
+    done = object()
+    control = {}
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        running = asyncio.Semaphore(limit)
+        window = asyncio.Semaphore(limit * 2)
+        control['window'] = window
+        pending = asyncio.Queue()
+        it = iter(items)
+
+        async def call( item ):
+            async with running:
+                return await func( item )
+
+        async def deliver():
+            while True:
+                task = await pending.get()
+                if task is None:
+                    return
+                try:
+                    results.put( (True, await task) )
+                except Exception as e:
+                    # hand the error to the consumer and stop the producer,
+                    # which may be waiting for room in the window
+                    results.put( (False, e) )
+                    control['task'].cancel()
+                    return
+
+        def finished( task ):
+            # delivers the results of unordered calls as they complete
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                results.put( (False, task.exception()) )
+                control['task'].cancel()
+                return
+            results.put( (True, task.result()) )
+
+        deliverer = asyncio.ensure_future( deliver() )
+        tasks = []
+        try:
+            while True:
+                # pull items in small chunks off the loop, so a slow
+                # directory walk does not stall the running checks
+                chunk = await loop.run_in_executor( None, lambda: list(islice(it, 64)) )
+                if not chunk:
+                    break
+                for item in chunk:
+                    await window.acquire()
+                    task = asyncio.ensure_future( call( item ) )
+                    tasks.append( task )
+                    if ordered:
+                        await pending.put( task )
+                    else:
+                        task.add_done_callback( finished )
+                tasks = [ t for t in tasks if not t.done() ]
+            await pending.put( None )
+            await deliverer
+            if not ordered:
+                await asyncio.gather( *tasks, return_exceptions=True )
+        finally:
+            for task in tasks + [ deliverer ]:
+                task.cancel()
+            await asyncio.gather( *tasks, deliverer, return_exceptions=True )
+
+    def thread():
+        loop = asyncio.new_event_loop()
+        control['loop'] = loop
+        try:
+            control['task'] = loop.create_task( main() )
+            loop.run_until_complete( control['task'] )
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            results.put( (False, e) )
+        finally:
+            loop.run_until_complete( loop.shutdown_asyncgens() )
+            loop.close()
+            results.put( (True, done) )
+
+    worker = threading.Thread( target=thread, name='codecheck-engine', daemon=True )
+    worker.start()
+    try:
+        while True:
+            ok, value = results.get()
+            if value is done:
+                break
+            if not ok:
+                raise value
+            # the result is out of the queue: make room for another call
+            try:
+                control['loop'].call_soon_threadsafe( control['window'].release )
+            except RuntimeError:
+                # the loop already finished
+                pass
+            yield value
+    finally:
+        if worker.is_alive() and 'task' in control:
+            loop = control['loop']
+            try:
+                loop.call_soon_threadsafe( control['task'].cancel )
+            except RuntimeError:
+                # the loop already finished
+                pass
+        worker.join()
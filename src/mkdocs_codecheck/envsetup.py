@@ -0,0 +1,308 @@
+"""
+Installing the dependencies of code samples before they run.
+
+Samples often need the packages of a package.json, composer.json, Gemfile
+or requirements.txt. The manifest nearest to a sample (in its directory or
+the closest parent under the root being checked) is installed once, into a
+shared cache directory keyed by a hash of the manifest and its lockfile,
+and every sample that uses the same manifest runs against that
+environment: through NODE_PATH for node, include_path and an autoloader
+for php, BUNDLE_GEMFILE for ruby and a virtual environment for python.
+Nothing is installed next to the samples, and an environment whose
+manifest has not changed is reused by later runs.
+
+Setup starts as soon as a sample is dispatched, in a worker thread, so it
+overlaps the syntax checks of the other samples.
+"""
+from pathlib import Path
+import typing as T
+import abc
+import subprocess
+import threading
+import hashlib
+import logging
+import shutil
+import json
+import sys
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # no locking between processes on Windows
+    fcntl = None
+
+from .cache import default_cache_dir
+
+# marks an environment whose installation completed
+READY_FILE = '.codecheck-env.json'
+# seconds each install command may run for
+DEFAULT_INSTALL_TIMEOUT = 600.0
+
+class SetupError(Exception):
+    """Installing the dependencies of a manifest failed."""
+    pass
+
+class Installer( abc.ABC ):
+    """
+    Installs the dependencies of one kind of manifest into an environment
+    directory, and tells how to run a sample against it. manifests are the
+    file names that declare dependencies, lockfiles those that pin them.
+    """
+    language: T.Optional[str] = None
+    manifests: T.Tuple[str, ...] = ()
+    lockfiles: T.Tuple[str, ...] = ()
+    # files copied into the environment directory before installing
+    copy = True
+
+    def version( self ) -> str:
+        """
+        Anything besides the manifest that an environment depends on.
+        """
+        return ''
+
+    @abc.abstractmethod
+    def commands( self, manifest: Path, env_dir: Path ) -> T.List[T.List[str]]:
+        """
+        The commands that install manifest into env_dir, in order.
+        """
+
+    def install_env( self, env_dir: Path ) -> dict:
+        """
+        Variables to set while installing.
+        """
+        return {}
+
+    def variables( self, env_dir: Path, env: dict ) -> dict:
+        """
+        The variables to set, on top of env, to run a sample against env_dir.
+        """
+        return {}
+
+    def args( self, env_dir: Path ) -> T.List[str]:
+        """
+        Interpreter arguments to run a sample against env_dir with.
+        """
+        return []
+
+    def install( self, manifest: Path, env_dir: Path, timeout: float = None ) -> tuple:
+        """
+        Install manifest into env_dir, killing any command that runs for
+        longer than timeout seconds. Returns (returncode, output).
+        """
+        if self.copy:
+            for name in (manifest.name,) + tuple(self.lockfiles):
+                if (manifest.parent / name).is_file():
+                    shutil.copy2( manifest.parent / name, env_dir / name )
+        output = []
+        env = dict( os.environ, **self.install_env( env_dir ) )
+        for argv in self.commands( manifest, env_dir ):
+            logging.info(f'Installing {manifest}: {" ".join(argv)}')
+            try:
+                result = subprocess.run(argv, cwd=env_dir if self.copy else manifest.parent, env=env,
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, universal_newlines=True, timeout=timeout)
+            except subprocess.TimeoutExpired as e:
+                output.append( e.output or '' )
+                output.append( f'\n{" ".join(argv)} timed out after {timeout:g} seconds' )
+                return 124, ''.join(output)
+            except OSError as e:
+                return 127, f'Cannot run {argv[0]}: {e}'
+            output.append( result.stdout )
+            if result.returncode != 0:
+                return result.returncode, ''.join(output)
+        return 0, ''.join(output)
+
+def prepend_path( env: dict, name: str, directory: Path ) -> str:
+    current = env.get( name )
+    return f'{directory}{os.pathsep}{current}' if current else str(directory)
+
+class NpmInstaller( Installer ):
+    language = 'javascript'
+    manifests = ('package.json',)
+    lockfiles = ('package-lock.json', 'npm-shrinkwrap.json')
+    def commands( self, manifest, env_dir ):
+        if any( (env_dir / l).is_file() for l in self.lockfiles ):
+            return [ ['npm', 'ci', '--no-audit', '--no-fund'] ]
+        return [ ['npm', 'install', '--no-audit', '--no-fund'] ]
+    def variables( self, env_dir, env ):
+        # require() falls back to NODE_PATH; ES module imports do not
+        return { 'NODE_PATH': prepend_path( env, 'NODE_PATH', env_dir / 'node_modules' ),
+                 'PATH': prepend_path( env, 'PATH', env_dir / 'node_modules' / '.bin' ) }
+
+class ComposerInstaller( Installer ):
+    language = 'php'
+    manifests = ('composer.json',)
+    lockfiles = ('composer.lock',)
+    def commands( self, manifest, env_dir ):
+        return [ ['composer', 'install', '--no-interaction', '--no-progress'] ]
+    def args( self, env_dir ):
+        # `require 'vendor/autoload.php'` is found on the include_path, and
+        # samples that do not require it get the autoloader anyway
+        return [ '-d', f'include_path=.{os.pathsep}{env_dir}',
+                 '-d', f'auto_prepend_file={env_dir / "vendor" / "autoload.php"}' ]
+
+class BundlerInstaller( Installer ):
+    language = 'ruby'
+    manifests = ('Gemfile',)
+    lockfiles = ('Gemfile.lock',)
+    def install_env( self, env_dir ):
+        return { 'BUNDLE_GEMFILE': str(env_dir / 'Gemfile'), 'BUNDLE_PATH': str(env_dir / 'bundle') }
+    def commands( self, manifest, env_dir ):
+        return [ ['bundle', 'install'] ]
+    def variables( self, env_dir, env ):
+        variables = self.install_env( env_dir )
+        variables['RUBYOPT'] = f'-rbundler/setup {env.get("RUBYOPT", "")}'.strip()
+        return variables
+
+class PipInstaller( Installer ):
+    language = 'python'
+    manifests = ('requirements.txt',)
+    # the requirements may include other files next to them
+    copy = False
+    def version( self ):
+        return sys.version
+    def bin_dir( self, env_dir ):
+        return env_dir / 'venv' / ('Scripts' if os.name == 'nt' else 'bin')
+    def commands( self, manifest, env_dir ):
+        return [ [sys.executable, '-m', 'venv', str(env_dir / 'venv')],
+                 [str(self.bin_dir( env_dir ) / 'python'), '-m', 'pip', 'install', '--disable-pip-version-check',
+                  '-q', '-r', str(manifest)] ]
+    def variables( self, env_dir, env ):
+        # samples run through their `#!/usr/bin/env python3` shebang
+        return { 'VIRTUAL_ENV': str(env_dir / 'venv'), 'PATH': prepend_path( env, 'PATH', self.bin_dir( env_dir ) ) }
+
+INSTALLERS = { cls.language: cls() for cls in (NpmInstaller, ComposerInstaller, BundlerInstaller, PipInstaller) }
+
+class Environment:
+    """
+    An installed environment that samples run against.
+    """
+    def __init__( self, installer: Installer, manifest: Path, env_dir: Path ):
+        self.installer = installer
+        self.manifest = manifest
+        self.env_dir = env_dir
+
+    def env( self, env: dict = None ) -> dict:
+        env = dict( os.environ if env is None else env )
+        env.update( self.installer.variables( self.env_dir, env ) )
+        return env
+
+    def args( self ) -> T.List[str]:
+        return self.installer.args( self.env_dir )
+
+class EnvironmentStore:
+    """
+    The installed environments, under root (by default, in the result
+    cache directory). prepare() is safe to call from many threads and
+    processes at once; each environment is installed once. Each install
+    command may run for timeout seconds.
+    """
+    def __init__( self, root: Path = None, timeout: float = DEFAULT_INSTALL_TIMEOUT ):
+        self.root = Path(root or default_cache_dir() / 'envs').expanduser()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.locks: T.Dict[str, threading.Lock] = {}
+        # manifest digest -> Environment, or the SetupError it failed with
+        self.prepared: T.Dict[str, T.Union[Environment, SetupError]] = {}
+        # directory -> the manifest found for it, per language
+        self.manifests: T.Dict[tuple, T.Optional[Path]] = {}
+
+    def find_manifest( self, installer: Installer, directory: Path, root: Path ) -> T.Optional[Path]:
+        """
+        The manifest in directory or its closest parent, up to root.
+        """
+        key = ( installer.language, directory )
+        with self.lock:
+            if key in self.manifests:
+                return self.manifests[key]
+        found: T.Optional[Path] = None
+        for name in installer.manifests:
+            if (directory / name).is_file():
+                found = directory / name
+                break
+        else:
+            if directory != root and root in directory.parents:
+                found = self.find_manifest( installer, directory.parent, root )
+        with self.lock:
+            self.manifests[key] = found
+        return found
+
+    def digest( self, installer: Installer, manifest: Path ) -> str:
+        h = hashlib.sha256()
+        h.update( f'{installer.language}\0{installer.version()}'.encode() )
+        for name in (manifest.name,) + tuple(installer.lockfiles):
+            try:
+                h.update( b'\0' + (manifest.parent / name).read_bytes() )
+            except OSError:
+                h.update( b'\0' )
+        return h.hexdigest()[:24]
+
+    def locate( self, handler, f ) -> T.Optional[T.Tuple[Installer, Path]]:
+        """
+        The installer and manifest of handler's sample f, or None if it has no
+        dependencies to install.
+        """
+        installer = INSTALLERS.get( handler.language )
+        if installer is None:
+            return None
+        fn = Path( f['fn'] )
+        root = Path( f.get('path') or fn.parent )
+        if not root.is_dir():
+            root = root.parent
+        manifest = self.find_manifest( installer, fn.parent, root )
+        if manifest is None:
+            return None
+        return installer, manifest
+
+    def manifest_digest( self, handler, f ) -> str:
+        """
+        The digest of the manifest and lockfile handler's sample f runs
+        against, or an empty string if it has none.
+        """
+        located = self.locate( handler, f )
+        return self.digest( *located ) if located is not None else ''
+
+    def prepare( self, handler, f ) -> T.Optional[Environment]:
+        """
+        Install the dependencies of the manifest handler's sample f uses, if
+        any, returning the environment to run it against. Raises SetupError
+        if they cannot be installed.
+        """
+        located = self.locate( handler, f )
+        if located is None:
+            return None
+        installer, manifest = located
+        digest = self.digest( installer, manifest )
+        with self.lock:
+            lock = self.locks.setdefault( digest, threading.Lock() )
+        with lock:
+            if digest not in self.prepared:
+                try:
+                    self.prepared[digest] = self.install( installer, manifest, digest )
+                except SetupError as e:
+                    self.prepared[digest] = e
+        prepared = self.prepared[digest]
+        if isinstance( prepared, SetupError ):
+            raise prepared
+        return prepared
+
+    def install( self, installer: Installer, manifest: Path, digest: str ) -> Environment:
+        env_dir = self.root / f'{installer.language}-{digest}'
+        self.root.mkdir( parents=True, exist_ok=True )
+        with open( self.root / f'{env_dir.name}.lock', 'w' ) as lock_file:
+            # another process may be installing the same environment
+            if fcntl is not None:
+                fcntl.flock( lock_file, fcntl.LOCK_EX )
+            if (env_dir / READY_FILE).is_file():
+                logging.debug(f'Reusing the environment of {manifest} in {env_dir}')
+                return Environment( installer, manifest, env_dir )
+            shutil.rmtree( env_dir, ignore_errors=True )
+            env_dir.mkdir()
+            returncode, output = installer.install( manifest, env_dir, timeout=self.timeout )
+            if returncode != 0:
+                shutil.rmtree( env_dir, ignore_errors=True )
+                raise SetupError(f'Installing the dependencies of {manifest} failed:\n{output}')
+            with open( env_dir / READY_FILE, 'w' ) as fh:
+                json.dump( { 'manifest': str(manifest), 'language': installer.language }, fh )
+        return Environment( installer, manifest, env_dir )
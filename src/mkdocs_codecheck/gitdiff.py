@@ -0,0 +1,62 @@
+"""
+Find the files under a path that have changed since a git ref, so that
+only the code samples touched by a change need to be checked.
+"""
+from pathlib import Path
+import typing as T
+import logging
+import subprocess
+
+class GitError(Exception):
+    pass
+
+def _git( args: T.List[str], cwd: Path ) -> str:
+    try:
+        result = subprocess.run(['git'] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+    except OSError as e:
+        raise GitError(f'Could not run git: {e}')
+    if result.returncode != 0:
+        raise GitError(f'git {" ".join(args)} failed: {result.stderr.strip()}')
+    return result.stdout
+
+def git_root( path: Path ) -> Path:
+    path = Path(path).expanduser().resolve()
+    cwd = path if path.is_dir() else path.parent
+    return Path( _git(['rev-parse', '--show-toplevel'], cwd).strip() ).resolve()
+
+def changed_files( path: Path, ref: str, recurse: bool = True,
+                   expand_dependencies: bool = False ) -> T.List[Path]:
+    """
+    Return the files under path that were added, modified or renamed since
+    ref, including uncommitted and untracked (but not git-ignored) files.
+    If expand_dependencies is set, every file in the directory of a changed
+    file is returned as well, so that editing a shared helper re-checks the
+    samples next to it.
+    """
+    path = Path(path).expanduser().resolve()
+    root = git_root(path)
+    # -z keeps unusual file names intact; deleted files have nothing to check
+    diff = _git(['diff', '--name-only', '-z', '--diff-filter=d', ref, '--', str(path)], root)
+    untracked = _git(['ls-files', '--others', '--exclude-standard', '-z', '--', str(path)], root)
+    names = [ n for n in (diff + untracked).split('\0') if n ]
+    logging.debug(f'{len(names)} file(s) changed since {ref}')
+
+    files = set()
+    for name in names:
+        fn = root / name
+        if fn.is_file():
+            files.add(fn)
+    if expand_dependencies:
+        for d in { fn.parent for fn in files }:
+            for sibling in d.iterdir():
+                if sibling.is_file():
+                    files.add(sibling)
+
+    def wanted( fn ):
+        if path.is_file():
+            return fn == path
+        if recurse:
+            return path in fn.parents
+        return fn.parent == path
+    return sorted( fn for fn in files if wanted(fn) )
@@ -1,52 +1,122 @@
+from pathlib import Path
+import typing as T
 import logging
-import py_compile
 import subprocess
+import platform
+import threading
+import json
+import re
 import os
 
+from . import pysyntax
+from . import capture
+from .build import BUILDS, inputs_digest
+from .engine import Engine, run_sync, run_in_thread, DEFAULT_TIMEOUTS
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # Python < 3.8
+    entry_points = None
+
+# (enabled, version string) of each handler's toolchain, probed on first use
+_PROBES: T.Dict[type, tuple] = {}
+_PROBES_LOCK = threading.Lock()
+
+# entry point group third-party handlers register CodeHandler subclasses in
+ENTRY_POINT_GROUP = 'mkdocs_codecheck.handlers'
+
+# the number of files handed to a single batch syntax check
+BATCH_SIZE = 200
+
+# Scripts run by a single interpreter to syntax check a batch of files. Each
+# reads a JSON list of paths on stdin and writes a JSON object mapping every
+# path to an error message, or null if the file is fine.
+NODE_BATCH_SCRIPT = r"""
+const fs = require('fs'), vm = require('vm');
+const files = JSON.parse(fs.readFileSync(0, 'utf8'));
+const out = {};
+for (const f of files) {
+  try {
+    const src = fs.readFileSync(f, 'utf8');
+    if (f.endsWith('.json')) {
+      JSON.parse(src);
+    } else {
+      // compile with the same wrapper node uses for CommonJS modules
+      vm.compileFunction(src.replace(/^#!.*/, ''),
+        ['exports', 'require', 'module', '__filename', '__dirname'], { filename: f });
+    }
+    out[f] = null;
+  } catch (e) {
+    out[f] = f.endsWith('.json') ? `${f}: ${e.message}`
+                                 : String(e.stack || e).split('\n').slice(0, 5).join('\n');
+  }
+}
+process.stdout.write(JSON.stringify(out));
+"""
+RUBY_BATCH_SCRIPT = r"""
+require 'json'
+out = {}
+JSON.parse($stdin.read).each do |f|
+  begin
+    RubyVM::InstructionSequence.compile_file(f)
+    out[f] = nil
+  rescue SyntaxError => e
+    out[f] = e.message
+  end
+end
+print JSON.generate(out)
+"""
+PHP_BATCH_SCRIPT = r"""
+$out = [];
+foreach (json_decode(stream_get_contents(STDIN), true) as $f) {
+    try {
+        token_get_all(file_get_contents($f), TOKEN_PARSE);
+        $out[$f] = null;
+    } catch (\ParseError $e) {
+        $out[$f] = 'PHP Parse error: ' . $e->getMessage() . " in $f on line " . $e->getLine();
+    }
+}
+echo json_encode($out, JSON_FORCE_OBJECT);
+"""
+
+def run_batch_script( argv: T.List[str], files: list, timeout: float = DEFAULT_TIMEOUTS['syntax'] ) -> dict:
+    """
+    Run a batch syntax check script over files, returning a dict mapping
+    each file's Path to an error message or None. Returns None if the script
+    could not be run or did not report on every file. Raises
+    subprocess.TimeoutExpired, once the script is killed, if it runs for
+    longer than timeout seconds.
+    """
+    paths = [ str(f['fn']) for f in files ]
+    try:
+        result = subprocess.run(argv, input=json.dumps(paths), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, timeout=timeout)
+        reported = json.loads(result.stdout)
+    except (OSError, ValueError) as e:
+        logging.debug(f'Batch syntax check with {argv[0]} failed: {e}')
+        return None
+    if not isinstance(reported, dict) or any(p not in reported for p in paths):
+        logging.debug(f'Batch syntax check with {argv[0]} did not report every file: {result.stderr}')
+        return None
+    return { f['fn']: reported[str(f['fn'])] for f in files }
+
 def rchop(s, suffix):
     if suffix and s.endswith(suffix):
         return s[:-len(suffix)]
     return s
 
 def is_handler_enabled( language ) -> bool:
-    if language == 'python':
-        return PythonCodeHandler.is_enabled()
-    elif language == 'java':
-        return JavaCodeHandler.is_enabled()
-    elif language == 'php':
-        return PHPCodeHandler.is_enabled()
-    elif language == 'ruby':
-        return RubyCodeHandler.is_enabled()
-    elif language == 'javascript':
-        return JavaScriptCodeHandler.is_enabled()
-    elif language == 'c#':
-        return CSharpCodeHandler.is_enabled()
-    else:
-        raise UnknownLanguage(f'Unknown language {language}: cannot process.')
+    return registry().language_class( language ).is_enabled()
+
+def canonical_language( language ) -> str:
+    """
+    The name a language is reported as, e.g. 'csharp' for 'c#'.
+    """
+    return registry().language_class( language ).language
 
 def find_handler( f ):# -> CodeHandler:
     logging.debug(f'Finding handler for {f}')
-    if PythonCodeHandler.can_handle( f ):
-        #logging.info('Python file found')
-        return PythonCodeHandler( f )
-    elif PHPCodeHandler.can_handle( f ):
-        #logging.info('PHP file found')
-        return PHPCodeHandler( f )
-    elif JavaCodeHandler.can_handle( f ):
-        #logging.info('Java file found')
-        return JavaCodeHandler( f )
-    elif JavaScriptCodeHandler.can_handle( f ):
-        #logging.info('JavaScript file found')
-        return JavaScriptCodeHandler( f )
-    elif RubyCodeHandler.can_handle( f ):
-        #logging.info('Ruby file found')
-        return RubyCodeHandler( f )
-    elif CSharpCodeHandler.can_handle( f ):
-        #logging.info('Ruby file found')
-        return CSharpCodeHandler( f )
-    else:
-        #logging.info(f"Could not find handler for {f['fn']}")
-        raise NoCodeHandler(f'Could not find handler for {f}')
+    return registry().find_handler( f )
 
 class CodeHandlerException(Exception):
     """Base class for other exceptions"""
@@ -65,221 +135,537 @@ class TimedOutError(CodeHandlerException):
     pass
 
 class CodeHandler:
-    language = None
-    code_file = None
-    def __init__(self, l, f):
-        self.data = []
-        self.language = l
-        self.code_file = f
-    def can_handle( f ) -> bool:
-        #logging.info(f'Don\'t know how to detect files for {self.language}')
-        pass
-    def is_enabled() -> bool:
-        #logging.info(f'Don\'t know how to detect files for {self.language}')
-        pass
-    def check_syntax( self ):
+    """
+    Checks the samples of one language. Handlers hold no state about the
+    sample being checked: the registry makes one of each, and it is handed
+    every sample of its language in turn, along with the engine to run
+    commands on and, for runtime checks, the environment and warm pool the
+    sample runs with.
+    """
+    language: T.Optional[str] = None
+    # other names the language can be selected by
+    aliases: T.Tuple[str, ...] = ()
+    # file suffixes (e.g. '.py') and exact file names (e.g. 'Program.cs')
+    # the handler checks; see HandlerRegistry
+    extensions: T.Tuple[str, ...] = ()
+    filenames: T.Tuple[str, ...] = ()
+    # the engine.Engine that runs commands, with timeouts and bounded
+    # output, when a check is not given one
+    engine = Engine()
+    # command whose output identifies the interpreter/toolchain version
+    version_command: T.Optional[T.List[str]] = None
+    # commands that must all be runnable for the handler to be enabled
+    # (default: the version command)
+    probe_commands: T.Optional[T.List[T.List[str]]] = None
+    # the rlimit a sandbox enforces its memory cap with
+    memory_rlimit = 'RLIMIT_AS'
+    @classmethod
+    def probe( cls ) -> tuple:
+        """
+        Probe the toolchain, returning whether it is installed and the
+        version string it reports. Toolchains are only probed the first time
+        this is called; the result is memoized.
+        """
+        with _PROBES_LOCK:
+            if cls not in _PROBES:
+                _PROBES[cls] = cls._probe()
+            return _PROBES[cls]
+    @classmethod
+    def _probe( cls ) -> tuple:
+        commands = cls.probe_commands or ([ cls.version_command ] if cls.version_command else [])
+        version = ''
+        for command in commands:
+            try:
+                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True)
+            except OSError:
+                logging.debug(f'{cls.__name__} is not enabled: cannot run {command[0]}')
+                return False, ''
+            if command == cls.version_command:
+                version = result.stdout.strip()
+        return True, version
+    @classmethod
+    def toolchain_version( cls ) -> str:
+        """
+        Return the version string reported by the toolchain, or an empty
+        string if it cannot be determined.
+        """
+        return cls.probe()[1]
+    def inputs( self, f ) -> list:
+        """
+        The files whose contents determine the result of checking sample f.
+        """
+        return [ f['fn'] ]
+    def sample_name( self, f ) -> str:
+        """
+        The path of sample f relative to the root being checked.
+        """
+        fn = f['fn']
+        root = f.get('path')
+        try:
+            return fn.relative_to(root).as_posix() if root is not None else fn.name
+        except ValueError:
+            return str(fn)
+    async def execute( self, f, argv: T.List[str], stage: str = 'runtime', cwd = None, env: dict = None,
+                       engine: Engine = None, environment = None ) -> capture.CapturedProcess:
+        """
+        Run a command for sample f on engine, with the timeout of the stage
+        and bounded output capture. Failures to start the command and
+        timeouts are raised as handler exceptions. Runtime commands run
+        against environment, the envsetup.Environment with the sample's
+        dependencies, if it has one.
+        """
+        if stage == 'runtime' and environment is not None:
+            env = environment.env( env )
+        try:
+            return await (engine or self.engine).run( self, f, argv, stage=stage, cwd=cwd, env=env )
+        except subprocess.TimeoutExpired as e:
+            raise TimedOutError(f'Timed out after {e.timeout:g} seconds.')
+        except PermissionError as e:
+            raise PermissionsError(e)
+        except OSError as e:
+            raise RuntimeError(e)
+    def run( self, f, argv: T.List[str], stage: str = 'runtime', cwd = None ) -> capture.CapturedProcess:
+        """
+        Synchronous version of execute().
+        """
+        return run_sync( self.execute( f, argv, stage=stage, cwd=cwd ) )
+    @classmethod
+    def can_handle( cls, f ) -> bool:
+        fn = f["fn"]
+        return fn.name in cls.filenames or fn.suffix in cls.extensions
+    @classmethod
+    def is_enabled( cls ) -> bool:
+        return cls.probe()[0]
+    def check_syntax( self, f ):
+        return run_sync( self.check_syntax_async( f ) )
+    async def check_syntax_async( self, f, engine: Engine = None ):
         #logging.info(f'Don\'t know how to check syntax for {self.language}')
         pass
-    def check_runtime( self ):
+    def check_syntax_batch( self, files: list ) -> dict:
+        """
+        Check the syntax of many files at once, returning a dict that maps the
+        Path of each file to a syntax error message, or None if it is fine.
+        Handlers override this to check a whole batch with one process; by
+        default each file is checked on its own.
+        """
+        results: T.Dict[Path, T.Optional[str]] = {}
+        for f in files:
+            try:
+                self.check_syntax( f )
+                results[f['fn']] = None
+            except SyntaxError as e:
+                results[f['fn']] = str(e)
+        return results
+    def check_runtime( self, f ):
+        return run_sync( self.check_runtime_async( f ) )
+    async def check_runtime_async( self, f, engine: Engine = None, environment = None, warm_pool = None ):
         #logging.info(f'Don\'t know how to check run time for {self.language}')
         pass
 
 class PythonCodeHandler( CodeHandler ):
-    def __init__(self, f):
-        super().__init__( 'python', f )
-        self.data = []
-    def can_handle( f ):
-        if f["fn"].name.endswith('.py'):
-            return True
-        return False
-    def is_enabled():
-        return True
-    def check_syntax(self):
-        # TODO - capture STDOUT and save full stacktrace to SUMMARY
-        super().check_syntax()
-        full_path = self.code_file['fn']
+    language = 'python'
+    extensions = ('.py',)
+    # worker processes used to syntax check large batches
+    syntax_processes = 1
+    @classmethod
+    def _probe( cls ) -> tuple:
+        # samples run with the interpreter running mkdocs-codecheck
+        return True, f'Python {platform.python_version()}'
+    async def check_syntax_async(self, f, engine: Engine = None):
+        full_path = f['fn']
+        # compiled in memory; py_compile would write a .pyc next to the sample
         try:
-            result = py_compile.compile( full_path, doraise=True )
-        except (py_compile.PyCompileError) as e:
+            error = await run_in_thread( pysyntax.check_file, full_path )
+        except OSError as e:
             raise SyntaxError(e)
-        else:
-            return result
-    def check_runtime(self):
-        # TODO - capture STDOUT and do not output to terminal
-        super().check_runtime()
-        full_path = self.code_file['fn']
+        if error:
+            raise SyntaxError(error)
+        return None
+    def check_syntax_batch( self, files: list ) -> dict:
+        paths = [ f['fn'] for f in files ]
+        return pysyntax.check_files( paths, processes=self.syntax_processes )
+    async def check_runtime_async(self, f, engine: Engine = None, environment = None, warm_pool = None):
+        full_path = f['fn']
         #logging.info(f'Processing Python file: {full_path}')
+        if warm_pool is not None:
+            return await self.check_runtime_warm( f, warm_pool, engine or self.engine )
+        return await self.execute( f, [full_path], engine=engine, environment=environment )
+    async def check_runtime_warm(self, f, warm_pool, engine: Engine):
+        full_path = f['fn']
+        # the pool runs the script itself, so check what the shebang would need
+        if not os.access(full_path, os.X_OK):
+            raise PermissionsError(f'{full_path} is not executable')
+        capturer = engine.capturer
         try:
-            result = subprocess.run(full_path,stdout=subprocess.PIPE,stderr=subprocess.PIPE,
-                                    universal_newlines=True,timeout=10,
-                                    check=False)
-        except (py_compile.PyCompileError) as e:
-            raise SyntaxError(e)
-        except OSError as e:
-            raise RuntimeError(e)
-        except PermissionError as e:
-            raise PermissionsError(e)
+            return await run_in_thread( lambda: warm_pool.run(
+                full_path, timeout=engine.timeout_for( self, f, 'runtime' ), limit=capturer.limit,
+                logs=capturer.log_paths( self.sample_name( f ), 'runtime' ) ) )
         except subprocess.TimeoutExpired as e:
-            raise TimedOutError(e, result)
-        except subprocess.CalledProcessError as e:
-            # This is a controlled failure, meaning the script exited with a status > 0
+            raise TimedOutError(f'Timed out after {e.timeout:g} seconds.')
+        except OSError as e:
             raise RuntimeError(e)
-        else:
-            #logging.info( f'Exiting check_runtime() successfully for {full_path}')
-            return result
 
 class PHPCodeHandler( CodeHandler ):
-    def __init__(self, f):
-        super().__init__( 'php', f )
-        self.data = []
-    def can_handle( f ):
-        if f["fn"].name.endswith('.php'):
-            return True
-        return False
-    def is_enabled():
-        try:
-            result = subprocess.run(['php','-v'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except:
-            return False
-    def check_syntax(self):
-        # TODO - capture STDOUT and save full stacktrace to SUMMARY
-        super().check_syntax()
-        full_path = self.code_file['fn']
-        result = subprocess.call(['php','-l',full_path])
-        if result != 0:
-            raise SyntaxError(f'Syntax error in: {full_path}', result)
+    language = 'php'
+    extensions = ('.php',)
+    version_command = ['php', '-v']
+    async def check_syntax_async(self, f, engine: Engine = None):
+        full_path = f['fn']
+        result = await self.execute( f, ['php','-l',full_path], stage='syntax', engine=engine )
+        if result.returncode != 0:
+            raise SyntaxError(capture.problem_output(result))
         return result
-    def check_runtime(self):
-        # TODO - capture STDOUT and do not output to terminal
-        super().check_runtime()
-        full_path = self.code_file['fn']
+    def check_syntax_batch( self, files: list ) -> dict:
+        # one php process tokenizes every file in the batch
+        try:
+            results = run_batch_script(['php', '-r', PHP_BATCH_SCRIPT], files)
+        except subprocess.TimeoutExpired:
+            # left to the checks of each sample, which time out on their own
+            logging.debug('Batch syntax check with php timed out')
+            return {}
+        if results is None:
+            return super().check_syntax_batch( files )
+        return results
+    async def check_runtime_async(self, f, engine: Engine = None, environment = None, warm_pool = None):
+        full_path = f['fn']
         #logging.info(f'Processing PHP file: {full_path}')
-        result = subprocess.call(['php',full_path])
-        if result != 0:
-            raise RuntimeError(r'Error running command: php {full_path}')
-        return result
+        args = environment.args() if environment is not None else []
+        return await self.execute( f, ['php'] + args + [full_path], engine=engine, environment=environment )
 
 class JavaScriptCodeHandler( CodeHandler ):
-    def __init__(self, f):
-        super().__init__( 'javascript', f )
-        self.data = []
-    def can_handle( f ):
-        if f["fn"].name.endswith('.js') or f["fn"].name.endswith('.json'):
-            return True
-        return False
-    def is_enabled():
+    language = 'javascript'
+    extensions = ('.js', '.json')
+    version_command = ['node', '-v']
+    # V8 reserves far more address space than it uses
+    memory_rlimit = 'RLIMIT_DATA'
+    async def check_syntax_async(self, f, engine: Engine = None):
+        full_path = f['fn']
+        # `node --check` cannot parse .json files, so use the batch checker
         try:
-            result = subprocess.run(['node','-v'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except:
-            return False
-    def check_syntax(self):
-        # TODO - capture STDOUT and save full stacktrace to SUMMARY
-        super().check_syntax()
-        full_path = self.code_file['fn']
-        result = subprocess.run(['node','--check',full_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return result
-    def check_runtime(self):
-        # TODO - capture STDOUT and do not output to terminal
-        super().check_runtime()
-        full_path = self.code_file['fn']
+            results = await run_in_thread( run_batch_script, ['node', '-e', NODE_BATCH_SCRIPT], [ f ],
+                                           (engine or self.engine).timeout_for( self, f, 'syntax' ) )
+        except subprocess.TimeoutExpired as e:
+            raise TimedOutError(f'Timed out after {e.timeout:g} seconds.')
+        if results is None:
+            result = await self.execute( f, ['node','--check',full_path], stage='syntax', engine=engine )
+            if result.returncode != 0:
+                raise SyntaxError(capture.problem_output(result))
+            return result
+        if results[full_path]:
+            raise SyntaxError(results[full_path])
+        return 0
+    def check_syntax_batch( self, files: list ) -> dict:
+        # one node process compiles every file in the batch with the vm module
+        try:
+            results = run_batch_script(['node', '-e', NODE_BATCH_SCRIPT], files)
+        except subprocess.TimeoutExpired:
+            # left to the checks of each sample, which time out on their own
+            logging.debug('Batch syntax check with node timed out')
+            return {}
+        if results is None:
+            return super().check_syntax_batch( files )
+        return results
+    async def check_runtime_async(self, f, engine: Engine = None, environment = None, warm_pool = None):
+        full_path = f['fn']
         #logging.info(f'Processing JavaScript file: {full_path}')
-        result = subprocess.run(['node',full_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return result
+        return await self.execute( f, ['node',full_path], engine=engine, environment=environment )
 
 class RubyCodeHandler( CodeHandler ):
-    def __init__(self, f):
-        super().__init__( 'ruby', f )
-        self.data = []
-    def can_handle( f ):
-        if f["fn"].name.endswith('.rb'):
-            return True
-        return False
-    def is_enabled():
-        try:
-            result = subprocess.run(['ruby','-v'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except:
-            return False
-    def check_syntax(self):
-        # TODO - capture STDOUT and save full stacktrace to SUMMARY
-        super().check_syntax()
-        full_path = self.code_file['fn']
-        result = subprocess.call(['ruby','-c',full_path])
-        if result != 0:
-            raise SyntaxError(f'Syntax error in: {full_path}', result)
-        return result
-    def check_runtime(self):
-        # TODO - capture STDOUT and do not output to terminal
-        super().check_runtime()
-        full_path = self.code_file['fn']
-        #logging.info(f'Processing JavaScript file: {full_path}')
-        result = subprocess.call(['ruby',full_path])
-        if result != 0:
-            raise RuntimeError(r'Error running command: ruby {full_path}')
+    language = 'ruby'
+    extensions = ('.rb',)
+    version_command = ['ruby', '-v']
+    async def check_syntax_async(self, f, engine: Engine = None):
+        full_path = f['fn']
+        result = await self.execute( f, ['ruby','-c',full_path], stage='syntax', engine=engine )
+        if result.returncode != 0:
+            raise SyntaxError(capture.problem_output(result))
         return result
+    def check_syntax_batch( self, files: list ) -> dict:
+        # one ruby process compiles every file in the batch
+        try:
+            results = run_batch_script(['ruby', '-e', RUBY_BATCH_SCRIPT], files)
+        except subprocess.TimeoutExpired:
+            # left to the checks of each sample, which time out on their own
+            logging.debug('Batch syntax check with ruby timed out')
+            return {}
+        if results is None:
+            return super().check_syntax_batch( files )
+        return results
+    async def check_runtime_async(self, f, engine: Engine = None, environment = None, warm_pool = None):
+        full_path = f['fn']
+        #logging.info(f'Processing Ruby file: {full_path}')
+        return await self.execute( f, ['ruby',full_path], engine=engine, environment=environment )
 
 class JavaCodeHandler( CodeHandler ):
-    def __init__(self, f):
-        super().__init__( 'java', f )
-        self.data = []
-    def can_handle( f ):
-        if f["fn"].name.endswith('.java'):
-            return True
-        return False
-    def is_enabled():
-        try:
-            result1 = subprocess.run(['java','--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            result2 = subprocess.run(['javac','--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except:
-            return False
-    def check_syntax(self):
-        # TODO - capture STDOUT and save full stacktrace to SUMMARY
-        super().check_syntax()
-        full_path = self.code_file['fn']
-        result = subprocess.call(['javac',full_path])
-        if result != 0:
-            raise SyntaxError(f'Syntax error in: {full_path}', result)
-        return result
-    def check_runtime(self):
-        # TODO - capture STDOUT and do not output to terminal
-        super().check_runtime()
-        full_path = self.code_file['fn']
+    language = 'java'
+    extensions = ('.java',)
+    version_command = ['javac', '--version']
+    probe_commands = [ ['javac', '--version'], ['java', '--version'] ]
+    # the JVM reserves its whole maximum heap up front
+    memory_rlimit = 'RLIMIT_DATA'
+    def inputs( self, f ) -> list:
+        # samples are compiled together with the other sources next to them
+        return java_sources( f['fn'].parent )
+    async def build( self, f, engine: Engine = None ):
+        """
+        Compile sample f with the sources in its directory, once per run,
+        falling back to compiling it on its own if another file in the
+        directory does not compile. Raises SyntaxError if the sample itself
+        does not compile.
+        """
+        full_path = f['fn']
+        sources = self.inputs( f )
+        async def compile_sources( files ):
+            async def run( out_dir ):
+                result = await self.execute( f, ['javac', '-d', out_dir, '-proc:none'] + files, stage='syntax',
+                                             engine=engine )
+                return result.returncode, result.stdout + result.stderr
+            return await BUILDS.build( ('java', tuple(files)), inputs_digest(files), run )
+        build = await compile_sources( sources )
+        if not build.ok:
+            errors = javac_errors( build.output )
+            if str(full_path) in errors:
+                raise SyntaxError(errors[str(full_path)])
+            build = await compile_sources( [ full_path ] )
+            if not build.ok:
+                raise SyntaxError(build.output)
+        return build
+    async def check_syntax_async(self, f, engine: Engine = None):
+        return await self.build( f, engine )
+    def check_syntax_batch( self, files: list ) -> dict:
+        results = {}
+        # each directory is compiled with one javac invocation, into the
+        # same builds the runtime check uses
+        dirs: T.Dict[Path, list] = {}
+        for f in files:
+            dirs.setdefault( f['fn'].parent, [] ).append( f )
+        for parent, group in dirs.items():
+            try:
+                results.update( self.check_directory( parent, group ) )
+            except subprocess.TimeoutExpired:
+                # left to the checks of each sample, which time out on their own
+                logging.debug(f'Compiling {parent} timed out')
+        return results
+    def check_directory( self, parent, group: list ) -> dict:
+        sources = java_sources( parent )
+        build = BUILDS.build_sync( ('java', tuple(sources)), inputs_digest(sources),
+                                   lambda out_dir: javac( sources, out_dir ) )
+        if build.ok:
+            return { f['fn']: None for f in group }
+        results = {}
+        errors = javac_errors( build.output )
+        for f in group:
+            if str(f['fn']) in errors:
+                results[f['fn']] = errors[str(f['fn'])]
+            else:
+                # javac may stop before reporting on every file, so
+                # anything it did not blame is compiled on its own
+                build = BUILDS.build_sync( ('java', (f['fn'],)), inputs_digest([ f['fn'] ]),
+                                           lambda out_dir: javac( [ f['fn'] ], out_dir ) )
+                results[f['fn']] = build.output if not build.ok else None
+        return results
+    async def check_runtime_async(self, f, engine: Engine = None, environment = None, warm_pool = None):
+        full_path = f['fn']
         #logging.info(f'Processing Java file: {full_path}')
-        #return result
+        with open(full_path, encoding='utf-8', errors='replace') as fh:
+            source = fh.read()
+        if not JAVA_MAIN.search( source ):
+            # a helper class for the other samples, nothing to run
+            return None
+        m = JAVA_PACKAGE.search( source )
+        main_class = f'{m.group(1)}.{full_path.stem}' if m else full_path.stem
+        async with BUILDS.using( lambda: self.build( f, engine ) ) as build:
+            return await self.execute( f, ['java', '-cp', build.out_dir, main_class], engine=engine,
+                                       environment=environment )
+
+JAVA_PACKAGE = re.compile(r'^\s*package\s+([\w.]+)\s*;', re.MULTILINE)
+JAVA_MAIN = re.compile(r'\bvoid\s+main\s*\(')
+
+def java_sources( directory ) -> list:
+    return sorted( directory.glob('*.java') )
+
+def javac( files: list, out_dir, timeout: float = DEFAULT_TIMEOUTS['syntax'] ) -> tuple:
+    """
+    Compile files with a single javac invocation into out_dir. Returns the
+    exit code and the compiler output. Raises subprocess.TimeoutExpired,
+    once javac is killed, if it runs for longer than timeout seconds.
+    """
+    result = subprocess.run(['javac', '-d', str(out_dir), '-proc:none'] + [ str(f) for f in files ],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                            timeout=timeout)
+    return result.returncode, result.stdout
+
+JAVAC_ERROR = re.compile(r'^(.+\.java):\d+: error: ')
+
+def javac_errors( output: str ) -> dict:
+    """
+    Split javac output into the error messages for each file.
+    """
+    errors: T.Dict[str, T.List[str]] = {}
+    current = None
+    for line in output.splitlines():
+        m = JAVAC_ERROR.match( line )
+        if m:
+            current = m.group(1)
+            errors.setdefault( current, [] ).append( line )
+        elif re.match(r'^\d+ errors?$', line):
+            current = None
+        elif current is not None:
+            errors[current].append( line )
+    return { fn: '\n'.join(lines) for fn, lines in errors.items() }
 
 class CSharpCodeHandler( CodeHandler ):
-    def __init__(self, f):
-        super().__init__( 'csharp', f )
-        self.data = []
-    def can_handle( f ):
-        if f["fn"].name == 'Program.cs':
-            return True
-        return False
-    def is_enabled():
+    language = 'csharp'
+    aliases = ('c#', 'cs')
+    filenames = ('Program.cs',)
+    version_command = ['dotnet', '--version']
+    # the .NET GC reserves hundreds of gigabytes of address space
+    memory_rlimit = 'RLIMIT_DATA'
+    def inputs( self, f ) -> list:
+        # the project file(s) and other sources next to Program.cs affect the build as well
+        prj_dir = f['fn'].parent
+        return sorted( prj_dir.glob('*.cs') ) + sorted( prj_dir.glob('*.csproj') )
+    async def build( self, f, engine: Engine = None ):
+        """
+        Restore and build the project of sample f into a temporary output
+        directory, once per run. Packages come from the shared NuGet
+        package cache, so they are only downloaded once across projects.
+        """
+        prj_dir = f['fn'].parent
+        inputs = self.inputs( f )
+        async def run( out_dir ):
+            result = await self.execute( f, ['dotnet', 'restore', prj_dir], stage='syntax', env=dotnet_env(),
+                                         engine=engine )
+            if result.returncode == 0:
+                result = await self.execute( f, ['dotnet', 'build', '--no-restore', '-nologo', '-o', out_dir, prj_dir],
+                                             stage='syntax', env=dotnet_env(), engine=engine )
+            return result.returncode, capture.problem_output(result)
+        build = await BUILDS.build( ('csharp', prj_dir), inputs_digest(inputs), run )
+        if not build.ok:
+            raise SyntaxError(build.output)
+        return build
+    async def check_syntax_async(self, f, engine: Engine = None):
+        return await self.build( f, engine )
+    async def check_runtime_async(self, f, engine: Engine = None, environment = None, warm_pool = None):
+        # equivalent to `dotnet run --no-build`, but runs the build in the
+        # temporary output directory
+        async with BUILDS.using( lambda: self.build( f, engine ) ) as build:
+            return await self.execute( f, ['dotnet', build.out_dir / f'{assembly_name( f["fn"].parent )}.dll'],
+                                       env=dotnet_env(), engine=engine, environment=environment )
+
+def dotnet_env() -> dict:
+    """
+    The environment to run dotnet in: the current one, without the CLI's
+    first-run banner and telemetry.
+    """
+    return dict( os.environ, DOTNET_NOLOGO='1', DOTNET_CLI_TELEMETRY_OPTOUT='1',
+                 DOTNET_SKIP_FIRST_TIME_EXPERIENCE='1' )
+
+CSPROJ_ASSEMBLY_NAME = re.compile(r'<AssemblyName>\s*([^<]+?)\s*</AssemblyName>')
+
+def assembly_name( prj_dir ) -> str:
+    """
+    The name of the assembly a project builds: its <AssemblyName>, or the
+    name of the project file.
+    """
+    for csproj in sorted( prj_dir.glob('*.csproj') ):
+        with open(csproj, encoding='utf-8', errors='replace') as fh:
+            m = CSPROJ_ASSEMBLY_NAME.search( fh.read() )
+        return m.group(1) if m else csproj.stem
+    return prj_dir.name
+
+BUILTIN_HANDLERS = [ PythonCodeHandler, PHPCodeHandler, JavaCodeHandler, JavaScriptCodeHandler,
+                     RubyCodeHandler, CSharpCodeHandler ]
+
+class HandlerRegistry:
+    """
+    Maps file names, file extensions and language names to handler classes,
+    so finding the handler for a file takes a couple of dict lookups however
+    many languages are registered. Handlers that declare no extensions or
+    file names are asked with can_handle(), in registration order, for files
+    nothing else claims. The first handler registered for an extension,
+    file name or language keeps it, so third-party handlers cannot shadow
+    the built-in ones. Each handler class is instantiated once, and that
+    handler checks every sample of its language.
+    """
+    def __init__( self, classes: T.Iterable[T.Type[CodeHandler]] = () ):
+        self.by_extension: T.Dict[str, T.Type[CodeHandler]] = {}
+        self.by_filename: T.Dict[str, T.Type[CodeHandler]] = {}
+        self.by_language: T.Dict[str, T.Type[CodeHandler]] = {}
+        self.fallback: T.List[T.Type[CodeHandler]] = []
+        self.handlers: T.Dict[T.Type[CodeHandler], CodeHandler] = {}
+        for cls in classes:
+            self.register( cls )
+
+    def register( self, cls ):
+        if not cls.language:
+            raise CodeHandlerException(f'{cls.__name__} does not name its language')
+        self.handlers.setdefault( cls, cls() )
+        for ext in cls.extensions:
+            self.by_extension.setdefault( ext, cls )
+        for name in cls.filenames:
+            self.by_filename.setdefault( name, cls )
+        if not cls.extensions and not cls.filenames:
+            self.fallback.append( cls )
+        for name in (cls.language,) + tuple(cls.aliases):
+            self.by_language.setdefault( name.lower(), cls )
+        return cls
+
+    def load_entry_points( self, group: str = ENTRY_POINT_GROUP ):
+        """
+        Register the handler classes installed packages advertise in the
+        entry point group, e.g. in setup.cfg:
+
+            [options.entry_points]
+            mkdocs_codecheck.handlers =
+                go = mkdocs_codecheck_go:GoCodeHandler
+        """
+        if entry_points is None:
+            return
+        eps: T.Any = entry_points()
+        eps = eps.select(group=group) if hasattr(eps, 'select') else eps.get(group, [])
+        for ep in eps:
+            try:
+                self.register( ep.load() )
+            except Exception as e:
+                logging.warning(f'Could not load code handler {ep.name}: {e}')
+
+    def handler_class( self, f ):
+        fn = f["fn"]
+        cls = self.by_filename.get( fn.name ) or self.by_extension.get( fn.suffix )
+        if cls is None:
+            for c in self.fallback:
+                if c.can_handle( f ):
+                    return c
+        return cls
+
+    def find_handler( self, f ) -> CodeHandler:
+        cls = self.handler_class( f )
+        if cls is None:
+            raise NoCodeHandler(f'Could not find handler for {f}')
+        return self.handlers[cls]
+
+    def language_class( self, language: str ):
         try:
-            result1 = subprocess.run(['dotnet','--info'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return True
-        except:
-            return False
-    def check_syntax(self):
-        # TODO - capture STDOUT and save full stacktrace to SUMMARY
-        super().check_syntax()
-        full_path = self.code_file['fn']
-        prj_dir = rchop(str(full_path), 'Program.cs')
-        result = subprocess.call(['dotnet','build',prj_dir])
-        if result != 0:
-            raise SyntaxError(f'Syntax error in: {full_path}', result)
-        return result
-    def check_runtime(self):
-        # TODO - capture STDOUT and do not output to terminal
-        super().check_runtime()
-        full_path = self.code_file['fn']
-        prj_dir = rchop(str(full_path), 'Program.cs')
-        result = subprocess.call(['dotnet','run',prj_dir])
-        if result != 0:
-            raise RuntimeError(f'Error running project: {prj_dir}', result)
-        return result
+            return self.by_language[ language.lower() ]
+        except KeyError:
+            raise UnknownLanguage(f'Unknown language {language}: cannot process.')
+
+    def languages( self ) -> list:
+        return sorted( set( cls.language for cls in self.by_language.values() ) )
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
 
+def registry() -> HandlerRegistry:
+    """
+    The registry of the built-in handlers and those registered through entry
+    points, built the first time it is needed.
+    """
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = HandlerRegistry( BUILTIN_HANDLERS )
+            _REGISTRY.load_entry_points()
+        return _REGISTRY
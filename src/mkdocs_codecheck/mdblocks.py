@@ -0,0 +1,228 @@
+"""
+Code samples found in Markdown pages.
+
+Pages are read a line at a time. Fenced code blocks whose info string names
+a language a handler checks (```python, ```php, ```js, ...) become virtual
+samples, and mdx_include directives ({! file !}, {!> file ln:10- !}) are
+resolved the way mdx_include resolves them, so a directive that points at
+a missing file or at lines the file does not have is reported as a
+problem of the page. Each distinct block is written to a temporary file
+once, so the existing handlers can check it; identical blocks repeated
+across pages are only checked once.
+"""
+from pathlib import Path
+import typing as T
+import threading
+import tempfile
+import hashlib
+import logging
+import atexit
+import shutil
+import re
+
+from . import handlers
+from . import dotignore
+
+FENCE = re.compile(r'^(?P<indent>[ \t]*)(?P<fence>`{3,}|~{3,})\s*(?P<info>[^`]*)$')
+INCLUDE = re.compile(r'\{!>?\s*(?P<path>[^|!\s]+)(?:\s*\|\s*[\w-]+)?(?:\s+ln:(?P<lines>[0-9,\s-]+?))?\s*!\}')
+JAVA_CLASS = re.compile(r'^\s*public\s+(?:(?:abstract|final|sealed)\s+)*(?:class|interface|enum|record)\s+(\w+)',
+                        re.MULTILINE)
+
+class IncludeError( Exception ):
+    pass
+
+def block_language( info: str ) -> str:
+    """
+    The language named by a fence's info string, e.g. 'python' for
+    `python title="hello.py"` or `{ .python linenums="1" }`.
+    """
+    info = info.strip().lstrip('{').strip()
+    word = info.split(None, 1)[0] if info else ''
+    return word.lstrip('.').lower()
+
+def sample_extension( language: str ) -> T.Optional[str]:
+    """
+    The file extension to check a block of the given language as, or None
+    if no handler checks single files of that language.
+    """
+    if not language:
+        return None
+    registry = handlers.registry()
+    if f'.{language}' in registry.by_extension:
+        return f'.{language}'
+    try:
+        cls = registry.language_class( language )
+    except handlers.UnknownLanguage:
+        return None
+    return cls.extensions[0] if cls.extensions else None
+
+def line_ranges( spec: str, count: int ) -> T.List[range]:
+    """
+    Parse an mdx_include line spec such as '10-', '-5', '3' or '1-4,8-9'
+    into 0-based ranges, checking them against a file of count lines.
+    """
+    ranges = []
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        start, dash, end = part.partition('-')
+        start = int(start) if start else 1
+        end = (int(end) if end else count) if dash else start
+        if start < 1 or start > end or end > count:
+            raise IncludeError(f'lines {part} are out of range, the file has {count} lines')
+        ranges.append( range(start - 1, end) )
+    return ranges
+
+def include_target( m, page: Path, base_path: Path ) -> Path:
+    """
+    Return the file an include directive refers to. Paths are relative to
+    the base path, as in mdx_include, falling back to the page's directory.
+    """
+    target = m.group('path')
+    if re.match(r'^[a-z]+://', target):
+        raise IncludeError(f'remote includes are not checked: {target}')
+    for base in (base_path, page.parent):
+        fn = (base / target).resolve()
+        if fn.is_file():
+            return fn
+    raise IncludeError(f'included file {target} does not exist')
+
+def resolve_include( m, page: Path, base_path: Path ) -> str:
+    """
+    Return the text an include directive inserts.
+    """
+    fn = include_target( m, page, base_path )
+    with open(fn, encoding='utf-8', errors='replace') as fh:
+        lines = fh.read().splitlines(keepends=True)
+    if not m.group('lines'):
+        return ''.join(lines)
+    return ''.join( line for r in line_ranges( m.group('lines'), len(lines) ) for line in lines[r.start:r.stop] )
+
+def expand_includes( text: str, page: Path, base_path: Path ) -> str:
+    return INCLUDE.sub( lambda m: resolve_include( m, page, base_path ), text )
+
+def iter_blocks( lines: T.Iterable[str] ) -> T.Iterator[dict]:
+    """
+    Yield the fenced code blocks of a page, and the lines outside of them
+    with include directives, as dicts with the 'line' the block starts on,
+    its 'language' (None for the lines outside of blocks) and its 'text'.
+    """
+    fence: T.Optional[T.Dict[str, T.Any]] = None
+    for n, line in enumerate(lines, start=1):
+        if fence is None:
+            m = FENCE.match( line.rstrip('\n') )
+            if m:
+                fence = { 'line': n, 'fence': m.group('fence'), 'indent': len(m.group('indent')),
+                          'language': block_language( m.group('info') ), 'lines': [] }
+            elif '{!' in line and INCLUDE.search( line ):
+                yield { 'line': n, 'language': None, 'text': line }
+            continue
+        stripped = line.strip()
+        if stripped.startswith(fence['fence'][0] * len(fence['fence'])) and not stripped.strip(fence['fence'][0]):
+            yield { 'line': fence['line'], 'language': fence['language'], 'text': ''.join(fence['lines']) }
+            fence = None
+            continue
+        # content lines lose the indentation of the fence
+        indent = len(line) - len(line.lstrip(' \t'))
+        fence['lines'].append( line[min(indent, fence['indent']):] )
+    if fence is not None:
+        yield { 'line': fence['line'], 'language': fence['language'], 'text': ''.join(fence['lines']) }
+
+class SampleDirectory:
+    """
+    The temporary files virtual samples are written to, one directory per
+    distinct block, removed when the process exits.
+    """
+    def __init__( self ):
+        self._root = None
+        self.lock = threading.Lock()
+
+    @property
+    def root( self ) -> Path:
+        with self.lock:
+            if self._root is None:
+                self._root = Path( tempfile.mkdtemp(prefix='codecheck-md-') )
+            return self._root
+
+    def write( self, digest: str, name: str, text: str ) -> Path:
+        fn = self.root / digest[:16] / name
+        if not fn.exists():
+            fn.parent.mkdir(parents=True, exist_ok=True)
+            fn.write_text( text, encoding='utf-8' )
+        return fn
+
+    def close( self ):
+        with self.lock:
+            root, self._root = self._root, None
+        if root is not None:
+            shutil.rmtree( root, ignore_errors=True )
+
+SAMPLES = SampleDirectory()
+atexit.register( SAMPLES.close )
+
+def sample_file_name( ext: str, text: str ) -> str:
+    if ext == '.java':
+        # javac requires a public class to be in a file of the same name
+        m = JAVA_CLASS.search( text )
+        return f'{m.group(1) if m else "Main"}.java'
+    return f'sample{ext}'
+
+def find_markdown_samples( docs_dir: Path, base_path: Path = None, seen: set = None,
+                           files: T.Iterable[Path] = None, included_files: bool = False ) -> T.Iterator[dict]:
+    """
+    Yield the code samples in the Markdown pages under docs_dir (or in
+    files, if given), in the form find_code_samples() yields them. Each
+    virtual sample also has a 'label' of the form '<page>:<line>' that
+    results are reported under, and is only syntax checked. With
+    included_files, a block that only includes files yields the files
+    themselves, to be checked like any other sample, rather than the text
+    they insert. Blocks whose digest, and files whose path, is in seen
+    (by default a new set) are not yielded again.
+    """
+    docs_dir = Path(docs_dir).expanduser().resolve()
+    base_path = Path(base_path or '.').expanduser().resolve()
+    if seen is None:
+        seen = set()
+    if files is None:
+        di = dotignore.dotignore('.codecheck-ignore')
+        files = ( fn for fn in di.get_files( docs_dir, recurse=True ) if fn.suffix in ('.md', '.markdown') )
+    for page in files:
+        page = Path(page)
+        with open(page, encoding='utf-8', errors='replace') as fh:
+            yield from page_samples( page, fh, docs_dir, base_path, seen, included_files )
+
+def page_samples( page: Path, lines: T.Iterable[str], docs_dir: Path, base_path: Path, seen: set,
+                  included_files: bool = False ) -> T.Iterator[dict]:
+    for block in iter_blocks( lines ):
+        label = f'{page}:{block["line"]}'
+        ext = sample_extension( block['language'] )
+        if ext is None and block['language'] is not None:
+            continue
+        if included_files and not INCLUDE.sub( '', block['text'] ).strip():
+            for m in INCLUDE.finditer( block['text'] ):
+                try:
+                    fn = include_target( m, page, base_path )
+                    if m.group('lines'):
+                        resolve_include( m, page, base_path )
+                except IncludeError as e:
+                    yield { 'fn': page, 'path': docs_dir, 'label': label, 'problem': str(e) }
+                    continue
+                if fn not in seen and handlers.registry().handler_class( { 'fn': fn } ) is not None:
+                    seen.add( fn )
+                    yield { 'fn': fn, 'path': base_path }
+            continue
+        try:
+            text = expand_includes( block['text'], page, base_path )
+        except IncludeError as e:
+            yield { 'fn': page, 'path': docs_dir, 'label': label, 'problem': str(e) }
+            continue
+        if ext is None:
+            # include directives outside of code blocks are only resolved
+            continue
+        digest = hashlib.sha256( f'{ext}\0{text}'.encode() ).hexdigest()
+        if digest in seen:
+            logging.debug(f'{label}: same code block as one already checked')
+            continue
+        seen.add( digest )
+        fn = SAMPLES.write( digest, sample_file_name( ext, text ), text )
+        yield { 'fn': fn, 'path': SAMPLES.root, 'label': label, 'syntax_only': True }
@@ -0,0 +1,124 @@
+"""
+Syntax-first scheduling of a run.
+
+Syntax checks are cheap and runtime checks are not. With syntax_first,
+iter_results() checks the syntax of every sample, many at once, before it
+runs any of them, and then hands the samples to the runtime stage in order
+of priority: those whose syntax check just failed (they need no more work
+and are reported straight away), those that failed in the previous run,
+then the rest, longest first by the durations the previous run recorded.
+A run that is going to fail does so early, and the slowest samples no
+longer start last and hold up the end of the run. With max_failures, the
+run stops as soon as that many samples have failed.
+"""
+from pathlib import Path
+import typing as T
+import logging
+import json
+
+from . import handlers
+from .engine import ordered_map_async, run_in_thread
+from .results import FAILURES, sample_label
+from .timing import span
+from .shard import relative
+
+class History:
+    """
+    What a previous run recorded about its samples, keyed by their path
+    relative to the root that was checked: how long each took, and which
+    of them failed.
+    """
+    def __init__( self, durations: T.Dict[str, float] = None, failures: T.Iterable[str] = () ):
+        self.durations = durations or {}
+        self.failures = set( failures )
+
+    def __bool__( self ):
+        return bool( self.durations or self.failures )
+
+def load_history( paths: T.Iterable[Path] ) -> History:
+    """
+    Read the history of previous runs from their --timings reports (see
+    Timings.write). Later reports take precedence over earlier ones.
+    Samples a report has no status for, e.g. those a run that stopped early
+    only syntax checked, are not part of the history.
+    """
+    history = History()
+    for path in paths:
+        with open(path) as fh:
+            report = json.load(fh)
+        for rel, sample in report.get('samples', {}).items():
+            if sample.get('status') is None:
+                continue
+            history.durations[rel] = sample.get('total', 0.0)
+            if sample.get('status') in FAILURES:
+                history.failures.add( rel )
+            else:
+                history.failures.discard( rel )
+    return history
+
+def check_syntax_first( code_files: list, languages: T.List[str] = None, cache = None, engine = None,
+                        jobs: int = 1, timings = None ) -> dict:
+    """
+    Check the syntax of code_files, up to `jobs` at once on engine's event
+    loop. Returns a dict like check_syntax_batches(): each checked file
+    mapped to an error message or None. Files whose check did not complete
+    (e.g. it timed out) are left out, so the runtime stage checks and
+    reports them itself.
+    """
+    async def check( f ):
+        if 'problem' in f:
+            return f, None, None
+        try:
+            handler = handlers.find_handler( f )
+        except handlers.NoCodeHandler:
+            return f, None, None
+        if languages != None and str(handler.language) not in languages:
+            return f, None, None
+        if not await run_in_thread( handler.is_enabled ):
+            return f, None, None
+        if cache is not None and cache.lookup( await run_in_thread( cache.key, handler, f ), syntax_only=True ):
+            return f, None, None
+        spans = {}
+        try:
+            with span( spans, 'syntax' ):
+                await handler.check_syntax_async( f, engine )
+        except handlers.SyntaxError as e:
+            return f, handler, ( str(e), spans )
+        except handlers.CodeHandlerException as e:
+            logging.debug(f'Syntax check of {f["fn"]} did not complete: {e}')
+            return f, None, None
+        return f, handler, ( None, spans )
+    results = {}
+    for f, handler, checked in ordered_map_async( check, code_files, limit=jobs, ordered=False ):
+        if checked is None:
+            continue
+        error, spans = checked
+        results[f['fn']] = error
+        if timings is not None:
+            timings.add_sample( sample_label( f ), handler.language, None, spans )
+    return results
+
+def prioritize( code_files: list, syntax_results: dict = None, history: History = None,
+                root: Path = None ) -> list:
+    """
+    code_files in the order their runtime checks should start: samples that
+    failed their syntax check, then those that failed in history, then the
+    rest; each group longest first by the durations in history. Samples
+    without a recorded duration count as taking the mean of the known ones.
+    Ties keep their discovery order.
+    """
+    syntax_results = syntax_results or {}
+    history = history or History()
+    durations = history.durations
+    default = sum(durations.values()) / len(durations) if durations else 0.0
+    def key( item ):
+        n, f = item
+        rel = relative( sample_label(f), root ) if root is not None else str(sample_label(f))
+        if syntax_results.get( f['fn'] ):
+            group = 0
+        elif rel in history.failures:
+            group = 1
+        else:
+            group = 2
+        return ( group, -durations.get( rel, default ), n )
+    return [ f for n, f in sorted( enumerate(code_files), key=key ) ]
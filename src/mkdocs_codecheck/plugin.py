@@ -0,0 +1,182 @@
+"""
+A MkDocs plugin that checks the code samples pages include while the site
+is built.
+
+    plugins:
+      - search
+      - codecheck:
+          languages: [python, php]
+
+Only the samples the pages actually use are checked: the files their
+include directives insert and, with code_blocks, their fenced code blocks.
+Checks run in a background pool as each page's Markdown is read, and the
+results are reported once the site has been built. Under `mkdocs serve`
+the plugin outlives each rebuild and only re-checks the samples whose
+files changed since the last one.
+"""
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+import logging
+import os
+
+from mkdocs.config import base, config_options as c
+from mkdocs.exceptions import PluginError
+from mkdocs.plugins import BasePlugin
+
+from . import handlers
+from .base import check_file
+from .build import inputs_digest
+from .cache import ResultCache
+from .envsetup import EnvironmentStore
+from .engine import Engine, DEFAULT_TIMEOUTS
+from .ratelimit import RuntimeScheduler, RetryPolicy, DEFAULT_RETRIES
+from .mdblocks import page_samples
+from .results import RunState, FAILURES, sample_label
+
+log = logging.getLogger('mkdocs.plugins.codecheck')
+
+class CodeCheckConfig( base.Config ):
+    enabled = c.Type(bool, default=True)
+    # the languages to check; by default every language
+    languages = c.Optional(c.ListOfItems(c.Type(str)))
+    syntax_only = c.Type(bool, default=False)
+    # skip, rather than fail, the samples of languages whose toolchain is not installed
+    skip_missing_toolchains = c.Type(bool, default=False)
+    # also syntax check the fenced code blocks of each page
+    code_blocks = c.Type(bool, default=True)
+    # the directory include directives are relative to, like mdx_include's
+    # base_path; relative to the directory of mkdocs.yml
+    include_base = c.Type(str, default='.')
+    # the number of samples checked at once; 0 means one per CPU
+    jobs = c.Type(int, default=0)
+    timeout = c.Type((int, float), default=DEFAULT_TIMEOUTS['runtime'])
+    cache = c.Type(bool, default=True)
+    # install the dependencies of the manifests near the samples; see envsetup.py
+    install_deps = c.Type(bool, default=False)
+    # pacing of samples that call a rate-limited API; see ratelimit.py
+    rate_limit = c.Optional(c.Type((int, float)))
+    host_concurrency = c.Optional(c.Type(int))
+    retries = c.Type(int, default=DEFAULT_RETRIES)
+    # fail the build if a sample fails, even without --strict
+    fail_on_error = c.Type(bool, default=False)
+
+class CodeCheckPlugin( BasePlugin[CodeCheckConfig] ):
+
+    def __init__( self ):
+        # sample -> (fingerprint of its inputs, outcome), kept across the
+        # rebuilds of `mkdocs serve`
+        self.outcomes = {}
+        self.pending = {}
+        self.pool = None
+        self.seen = set()
+
+    def on_startup( self, *, command, dirty ):
+        # defining on_startup keeps this instance, and what it has
+        # checked, alive across the rebuilds of `mkdocs serve`
+        pass
+
+    def on_config( self, config ):
+        if not self.config.enabled:
+            return
+        self.docs_dir = Path(config.docs_dir).resolve()
+        config_dir = Path(config.config_file_path or '.').resolve().parent
+        self.include_base = (config_dir / self.config.include_base).resolve()
+        self.languages = None
+        if self.config.languages is not None:
+            try:
+                self.languages = [ handlers.canonical_language( l ) for l in self.config.languages ]
+            except handlers.UnknownLanguage as e:
+                raise PluginError(f'codecheck: {e}')
+        self.environments = EnvironmentStore() if self.config.install_deps else None
+        self.cache = ResultCache( environments=self.environments ) if self.config.cache else None
+        scheduler = None
+        if self.config.rate_limit or self.config.host_concurrency or self.config.retries > 0:
+            scheduler = RuntimeScheduler( rate=self.config.rate_limit, per_host=self.config.host_concurrency,
+                                          policy=RetryPolicy( retries=self.config.retries ) )
+        self.engine = Engine( timeouts={ 'runtime': self.config.timeout }, scheduler=scheduler )
+
+    def on_pre_build( self, config ):
+        if not self.config.enabled:
+            return
+        jobs = self.config.jobs or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor( max_workers=jobs, thread_name_prefix='codecheck' )
+        self.pending = {}
+        self.seen = set()
+
+    def on_page_markdown( self, markdown, page, config, files ):
+        if not self.config.enabled:
+            return markdown
+        src = page.file.abs_src_path
+        if src and os.path.isfile(src):
+            with open(src, encoding='utf-8', errors='replace') as fh:
+                lines = fh.readlines()
+        else:
+            lines = markdown.splitlines(keepends=True)
+        for f in page_samples( Path(src or page.file.src_uri), lines, self.docs_dir, self.include_base,
+                               self.seen, included_files=True ):
+            if 'label' in f and 'problem' not in f and not self.config.code_blocks:
+                continue
+            self.submit( f )
+        return markdown
+
+    def fingerprint( self, f: dict ) -> tuple:
+        try:
+            inputs = handlers.find_handler( f ).inputs( f )
+        except handlers.NoCodeHandler:
+            inputs = [ f['fn'] ]
+        return inputs_digest( inputs )
+
+    def submit( self, f: dict ):
+        """
+        Start checking a sample in the background, unless it was already
+        checked and its files have not changed since.
+        """
+        key = str( sample_label( f ) )
+        if key in self.pending:
+            return
+        fingerprint = self.fingerprint( f )
+        previous = self.outcomes.get( key )
+        if previous is not None and previous[0] == fingerprint and 'problem' not in f:
+            done: Future = Future()
+            done.set_result( previous[1] )
+            self.pending[key] = ( fingerprint, done )
+            return
+        self.pending[key] = ( fingerprint, self.pool.submit( self.check, f ) )
+
+    def check( self, f: dict ) -> dict:
+        return check_file( f, languages=self.languages, syntax_only=self.config.syntax_only,
+                           cache=self.cache, engine=self.engine, environments=self.environments,
+                           skip_missing_toolchains=self.config.skip_missing_toolchains )
+
+    def on_post_build( self, config ):
+        if not self.config.enabled or self.pool is None:
+            return
+        state = RunState( self.docs_dir )
+        try:
+            for key, (fingerprint, future) in self.pending.items():
+                outcome = future.result()
+                self.outcomes[key] = ( fingerprint, outcome )
+                if outcome['status'] == 'ignored':
+                    continue
+                state.record( outcome )
+                if outcome['status'] in FAILURES:
+                    log.warning(f'{os.path.relpath(key)}: {outcome["msg"]}')
+                elif outcome['status'] == 'flaky':
+                    log.info(f'{os.path.relpath(key)}: {outcome["msg"]}')
+        finally:
+            self.pool.shutdown()
+            self.pool = None
+        # forget the samples no page uses any more
+        for key in set(self.outcomes) - set(self.pending):
+            del self.outcomes[key]
+        summary = state.summary
+        log.info(f'codecheck: {summary["total"]} code samples, '
+                 f'{summary["errors_syntax"] + summary["errors_runtime"]} failed, {summary["cached"]} cached')
+        if self.cache is not None:
+            self.cache.evict()
+        if state.failed and self.config.fail_on_error:
+            raise PluginError('codecheck: errors were discovered in your code samples')
+
+    def on_shutdown( self ):
+        if self.pool is not None:
+            self.pool.shutdown( wait=False )
@@ -0,0 +1,57 @@
+"""
+Check the syntax of Python code in memory.
+
+Unlike py_compile, nothing is written to disk: no __pycache__ directories
+and no .pyc files appear next to the samples, so checking works on
+read-only checkouts.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import typing as T
+import traceback
+
+# below this many files, starting worker processes costs more than it saves
+MIN_FILES_PER_PROCESS = 50
+
+def format_error( e: BaseException, filename: str ) -> str:
+    """
+    Describe a syntax error as 'file:line:column: message', followed by the
+    offending line and a caret as Python itself prints it.
+    """
+    if isinstance(e, SyntaxError):
+        lineno = e.lineno or 0
+        offset = e.offset or 0
+        detail = ''.join(traceback.format_exception_only(type(e), e)).rstrip()
+        return f'{filename}:{lineno}:{offset}: {type(e).__name__}: {e.msg}\n{detail}'
+    # e.g. ValueError for source code containing null bytes
+    return f'{filename}:0:0: {type(e).__name__}: {e}'
+
+def check_source( source: T.Union[bytes, str], filename: str ) -> T.Optional[str]:
+    """
+    Compile source without running it, returning an error message or None.
+    Byte strings are decoded following their PEP 263 coding declaration.
+    """
+    try:
+        compile(source, filename, 'exec', dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        return format_error(e, filename)
+    return None
+
+def check_file( path ) -> T.Optional[str]:
+    with open(path, 'rb') as fh:
+        source = fh.read()
+    return check_source(source, str(path))
+
+def check_files( paths: T.Iterable, processes: int = 1 ) -> T.Dict[Path, T.Optional[str]]:
+    """
+    Check many files, reading each once, and return a dict mapping every
+    path to an error message or None. With processes > 1 large batches are
+    spread across that many worker processes, as compiling holds the GIL.
+    """
+    paths = list(paths)
+    processes = min(processes or 1, len(paths) // MIN_FILES_PER_PROCESS)
+    if processes <= 1:
+        return { p: check_file(p) for p in paths }
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        chunksize = max(1, len(paths) // (processes * 4))
+        return dict( zip(paths, pool.map(check_file, paths, chunksize=chunksize)) )
@@ -0,0 +1,207 @@
+"""
+A pool of pre-warmed Python interpreters for running Python samples.
+
+Starting an interpreter and importing a heavy SDK often costs more than
+running the sample itself. Each worker in the pool starts once, imports a
+configurable list of modules, and then forks a fresh child for every
+sample it is asked to run. The child inherits the warm imports but nothing
+else from previous samples, its exit code and output are captured, and it
+is killed along with any processes it started if it runs past its timeout.
+
+This relies on os.fork() and is only available on POSIX systems.
+"""
+from pathlib import Path
+import typing as T
+import subprocess
+import threading
+import logging
+import queue
+import json
+import sys
+import os
+
+from . import capture
+
+WORKER_SCRIPT = r'''
+import importlib, json, os, runpy, shutil, signal, sys, tempfile, time, traceback
+
+# keep the real stdout for the protocol; anything printed while importing
+# the preloaded modules goes to stderr instead
+proto = os.fdopen(os.dup(1), 'w')
+os.dup2(2, 1)
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except Exception:
+        traceback.print_exc()
+
+def read_bounded(fh, limit, log):
+    # keep only the head and tail of the output, and never decode the rest
+    size = fh.seek(0, 2)
+    if log:
+        fh.seek(0)
+        with open(log, 'wb') as dst:
+            shutil.copyfileobj(fh, dst)
+    fh.seek(0)
+    if not limit or size <= limit:
+        return fh.read().decode('utf-8', 'replace'), False
+    half = limit // 2
+    head = fh.read(half)
+    fh.seek(size - (limit - half))
+    tail = fh.read()
+    omitted = size - len(head) - len(tail)
+    return (head.decode('utf-8', 'replace') + '\n... [%d bytes omitted] ...\n' % omitted
+            + tail.decode('utf-8', 'replace')), True
+
+def exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def run(path):
+    code = 0
+    try:
+        sys.argv = [path]
+        sys.path[0] = os.path.dirname(path)
+        runpy.run_path(path, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    return code
+
+for line in sys.stdin:
+    req = json.loads(line)
+    out = tempfile.TemporaryFile()
+    err = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.setsid()
+            null = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null, 0)
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            sys.stdin = open(os.devnull)
+            code = run(req['path'])
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code & 0xff)
+    deadline = time.monotonic() + req['timeout'] if req.get('timeout') else None
+    timed_out = False
+    delay = 0.0005
+    while True:
+        wpid, status = os.waitpid(pid, os.WNOHANG)
+        if wpid:
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            wpid, status = os.waitpid(pid, 0)
+            timed_out = True
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
+    res = {'returncode': exit_code(status), 'timed_out': timed_out, 'truncated': False}
+    for name, fh, log in (('stdout', out, req['logs'][0]), ('stderr', err, req['logs'][1])):
+        res[name], truncated = read_bounded(fh, req.get('limit'), log)
+        res['truncated'] = res['truncated'] or truncated
+        fh.close()
+    proto.write(json.dumps(res) + '\n')
+    proto.flush()
+'''
+
+def available() -> bool:
+    return hasattr(os, 'fork')
+
+class WarmPool:
+
+    def __init__( self, size: int = 1, modules: T.Iterable[str] = (), python: str = None ):
+        if not available():
+            raise OSError('A warm interpreter pool requires os.fork()')
+        self.size = max(1, size)
+        self.modules = [ m for m in modules if m ]
+        self.python = python or sys.executable
+        self.idle: queue.LifoQueue = queue.LifoQueue()
+        self.workers: T.List[subprocess.Popen] = []
+        self.lock = threading.Lock()
+
+    def _start( self ) -> subprocess.Popen:
+        logging.debug(f'Starting warm {self.python} preloading {self.modules}')
+        return subprocess.Popen([self.python, '-c', WORKER_SCRIPT] + self.modules,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                universal_newlines=True, bufsize=1)
+
+    def _acquire( self ) -> subprocess.Popen:
+        with self.lock:
+            if self.idle.empty() and len(self.workers) < self.size:
+                worker = self._start()
+                self.workers.append( worker )
+                return worker
+        return self.idle.get()
+
+    def _replace( self, worker: subprocess.Popen ) -> subprocess.Popen:
+        with self.lock:
+            self.workers.remove( worker )
+            new = self._start()
+            self.workers.append( new )
+        return new
+
+    def run( self, path, timeout: float = None, limit: int = capture.DEFAULT_LIMIT,
+             logs: tuple = (None, None) ) -> capture.CapturedProcess:
+        """
+        Run a Python script in a child of a warm worker, like
+        subprocess.run([path], stdout=PIPE, stderr=PIPE). As with
+        capture.Capturer, only the head and tail of each stream up to limit
+        bytes are kept, and the complete output is written to logs if given.
+        Raises subprocess.TimeoutExpired if it does not finish within timeout.
+        """
+        path = str(Path(path).resolve())
+        request = { 'path': path, 'timeout': timeout, 'limit': limit,
+                    'logs': [ str(l) if l is not None else None for l in logs ] }
+        worker = self._acquire()
+        try:
+            worker.stdin.write(json.dumps(request) + '\n')
+            line = worker.stdout.readline()
+        except OSError:
+            line = ''
+        if not line:
+            # the worker itself died; start a new one for the next sample
+            worker = self._replace( worker )
+            self.idle.put( worker )
+            raise OSError(f'Warm Python worker exited while running {path}')
+        self.idle.put( worker )
+        res = json.loads(line)
+        if res['timed_out']:
+            raise subprocess.TimeoutExpired([path], timeout, output=res['stdout'], stderr=res['stderr'])
+        return capture.CapturedProcess([path], res['returncode'], res['stdout'], res['stderr'],
+                                       stdout_log=logs[0], stderr_log=logs[1], truncated=res['truncated'])
+
+    def close( self ):
+        with self.lock:
+            for worker in self.workers:
+                try:
+                    worker.stdin.close()
+                    worker.wait(timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    worker.kill()
+            self.workers = []
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *exc ):
+        self.close()
@@ -0,0 +1,212 @@
+"""
+Scheduling of runtime checks against rate-limited APIs.
+
+Samples that call a live REST API fail with '429 Client Error' when too
+many of them run at once. The scheduler spaces out the start of runtime
+checks with a token bucket, caps how many samples talk to the same host at
+once, and retries a sample whose failure looks like a rate limit (by its
+output or exit code) with exponential backoff and full jitter. Samples that
+only passed on a retry are reported as flaky rather than as failures.
+
+The scheduler is shared by every event loop of a process (the MkDocs
+plugin checks samples from several threads), so it is built on a
+threading lock rather than on asyncio primitives tied to one loop.
+"""
+from collections import deque
+import typing as T
+import threading
+import asyncio
+import logging
+import random
+import time
+import re
+
+# output that means the API refused the request, not that the sample is wrong
+DEFAULT_PATTERNS = ( r'429 Client Error', r'Too Many Requests', r'rate limit(ed)? exceeded' )
+# retries are opt-in: a sample that is rate limited by default fails the run
+DEFAULT_RETRIES = 0
+# seconds
+DEFAULT_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+# a server's request to wait, e.g. 'Retry-After: 20'
+RETRY_AFTER = re.compile(r'Retry-After:\s*([0-9.]+)', re.IGNORECASE)
+
+# the hosts a sample talks to: URLs in its source, or a comment such as
+# `# codecheck-host: api.example.com` for samples that read the URL from
+# the environment
+HOST_PRAGMA = re.compile(rb'codecheck-host:\s*([A-Za-z0-9.-]+)')
+URL = re.compile(rb'https?://([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)')
+HOST_BYTES = 64 * 1024
+
+def sample_hosts( path ) -> T.List[str]:
+    """
+    The hosts a sample asks for with codecheck-host comments or, without
+    one, the hosts of the URLs in its source.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            source = fh.read(HOST_BYTES)
+    except OSError:
+        return []
+    hosts = HOST_PRAGMA.findall( source ) or URL.findall( source )
+    return sorted( set( h.decode('ascii').lower() for h in hosts ) )
+
+class RetryPolicy:
+    """
+    Which failures to retry, and how long to wait before each retry.
+    patterns are regular expressions searched for in a failed sample's
+    stderr and stdout; exit_codes are exit codes that always mean the
+    sample was rate limited.
+    """
+    def __init__( self, patterns: T.Iterable[str] = DEFAULT_PATTERNS, exit_codes: T.Iterable[int] = (),
+                  retries: int = DEFAULT_RETRIES, delay: float = DEFAULT_DELAY,
+                  max_delay: float = DEFAULT_MAX_DELAY, seed: int = None ):
+        self.patterns = [ re.compile(p, re.IGNORECASE) for p in patterns ]
+        self.exit_codes = set( exit_codes )
+        self.retries = max(0, retries)
+        self.delay = delay
+        self.max_delay = max_delay
+        self.random = random.Random( seed )
+
+    def is_rate_limited( self, result ) -> bool:
+        if result is None or result.returncode == 0:
+            return False
+        if result.returncode in self.exit_codes:
+            return True
+        output = f'{result.stderr or ""}\n{result.stdout or ""}'
+        return any( p.search( output ) for p in self.patterns )
+
+    def backoff( self, attempt: int, result = None ) -> float:
+        """
+        The seconds to wait before retry number attempt (from 1): a random
+        time up to delay * 2^(attempt-1), capped at max_delay, or longer if
+        the output asked for a longer wait with Retry-After.
+        """
+        delay = self.random.uniform( 0, min( self.max_delay, self.delay * 2 ** (attempt - 1) ) )
+        m = RETRY_AFTER.search( f'{result.stderr or ""}\n{result.stdout or ""}' ) if result is not None else None
+        if m:
+            delay = max( delay, min( self.max_delay, float(m.group(1)) ) )
+        return delay
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average, and bursts of up to
+    `burst`. Acquisitions reserve their slot under a lock and then sleep on
+    their own event loop until it comes.
+    """
+    def __init__( self, rate: float, burst: int = 1 ):
+        self.interval = 1.0 / rate
+        self.capacity = max(1, burst) * self.interval
+        self.lock = threading.Lock()
+        # the time at which the bucket will be full again
+        self.full_at = time.monotonic()
+
+    def reserve( self ) -> float:
+        """
+        Take a token, returning how many seconds to wait before using it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.full_at = max( self.full_at, now ) + self.interval
+            return max( 0.0, self.full_at - now - self.capacity )
+
+    async def acquire( self ):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep( wait )
+
+class SharedSemaphore:
+    """
+    A semaphore that coroutines on different event loops can share.
+    """
+    def __init__( self, value: int ):
+        self.value = value
+        self.lock = threading.Lock()
+        self.waiters: T.Deque[asyncio.Future] = deque()
+
+    async def acquire( self ):
+        loop = asyncio.get_event_loop()
+        with self.lock:
+            if self.value > 0:
+                self.value -= 1
+                return
+            waiter = loop.create_future()
+            self.waiters.append( (loop, waiter) )
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we were cancelled
+                self.release()
+            raise
+
+    def release( self ):
+        with self.lock:
+            if not self.waiters:
+                self.value += 1
+                return
+            loop, waiter = self.waiters.popleft()
+        try:
+            loop.call_soon_threadsafe( self._grant, waiter )
+        except RuntimeError:
+            # the waiter's loop is closed; give the slot to the next one
+            self.release()
+
+    def _grant( self, waiter ):
+        if waiter.cancelled():
+            self.release()
+        else:
+            waiter.set_result( None )
+
+class RuntimeScheduler:
+    """
+    Runs runtime checks no faster than rate per second (None for no
+    limit), with at most per_host samples talking to the same host at once
+    (None for no cap), retrying rate-limited failures as policy says.
+    """
+    def __init__( self, rate: float = None, burst: int = 1, per_host: int = None, policy: RetryPolicy = None ):
+        self.bucket = TokenBucket( rate, burst ) if rate else None
+        self.per_host = per_host
+        self.policy = policy or RetryPolicy()
+        self.hosts: T.Dict[str, SharedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    def host_slots( self, host: str ) -> SharedSemaphore:
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = SharedSemaphore( self.per_host )
+            return self.hosts[host]
+
+    async def attempt( self, hosts: T.List[str], check ):
+        held = []
+        try:
+            # always in the same order, so two samples never wait on each other
+            for host in hosts:
+                slots = self.host_slots( host )
+                await slots.acquire()
+                held.append( slots )
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            return await check()
+        finally:
+            for slots in reversed( held ):
+                slots.release()
+
+    async def run( self, handler, f, check ) -> tuple:
+        """
+        Await check(), the runtime check of handler's sample f, retrying it
+        while it fails with a rate limit. Returns (result, retries,
+        rate_limited), where rate_limited is True if the last attempt was
+        still rate limited.
+        """
+        hosts = sample_hosts( f['fn'] ) if self.per_host else []
+        retries = 0
+        while True:
+            result = await self.attempt( hosts, check )
+            limited = self.policy.is_rate_limited( result )
+            if not limited or retries >= self.policy.retries:
+                return result, retries, limited
+            retries += 1
+            delay = self.policy.backoff( retries, result )
+            logging.info(f'{handler.sample_name( f )} was rate limited, retrying in {delay:.1f}s ({retries}/{self.policy.retries})')
+            await asyncio.sleep( delay )
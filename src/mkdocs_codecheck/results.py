@@ -0,0 +1,337 @@
+"""
+Per-run result state and the sinks results are reported to.
+
+Each run of process_code gets its own RunState, so the library can be
+called repeatedly from the same process. Results are handed to every sink
+as soon as they are available: the console summary, a streaming NDJSON
+file, or a JUnit XML report for CI dashboards. The NDJSON files of the
+shards of a run can be merged back into one summary.
+"""
+from pathlib import Path
+import typing as T
+import threading
+import json
+import sys
+import os
+import xml.etree.ElementTree as ET
+
+from .samples import SampleLike
+
+class bcolors:
+    HEADER    = '\033[95m'
+    OKBLUE    = '\033[94m'
+    OKGREEN   = '\033[92m'
+    WARNING   = '\033[93m'
+    FAIL      = '\033[91m'
+    BOLD      = '\033[1m'
+    UNDERLINE = '\033[4m'
+    ENDC      = '\033[0m'
+
+STATUS_LABELS = {
+    'passed':     '✓',
+    'flaky':      '~',
+    'permission': '✖',
+    'syntax':     '✖',
+    'skipped':    '/',
+    'error':      '⚠'
+}
+
+# statuses that make a run fail
+FAILURES = ('syntax', 'permission', 'error')
+
+def new_summary() -> dict:
+    return {
+        'total': 0,
+        'passed': 0,
+        'checked': 0,
+        'checked_syntax': 0,
+        'checked_runtime': 0,
+        'errors': 0,
+        'errors_syntax': 0,
+        'errors_runtime': 0,
+        'skipped': 0,
+        'cached': 0,
+        'flaky': 0,
+        'passed_syntax': 0,
+        'problems': {},
+        # samples that passed only after being retried for a rate limit
+        'flaky_samples': {},
+        'failure': False,
+        # the run stopped early, after --max-failures failures
+        'stopped': False
+        }
+
+def relative_path( root_path, file_path ) -> str:
+    root, file_path = str(root_path), str(file_path)
+    if not file_path.startswith( root ):
+        # e.g. a code block in a Markdown page outside of the checked tree
+        return os.path.relpath( file_path )
+    return f'./{root.rpartition("/")[2]}{file_path[len(root):]}'
+
+def print_summary( root_path, summary: dict, file: T.TextIO = None ):
+    passed_syntax = summary["checked_syntax"] - summary["errors_syntax"]
+    print(f'SUMMARY', file=file)
+    print(f'  Total files: {summary["total"]}', file=file)
+    if summary["cached"]:
+        print(f'       Cached: {summary["cached"]}', file=file)
+    print(f'SYNTAX CHECKS', file=file)
+    print(f'    Files: {summary["checked_syntax"]}', file=file)
+    print(f'   Passed: {passed_syntax}', file=file)
+    print(f' Failures: {summary["errors_syntax"]}', file=file)
+    print(f'RUNTIME TESTS', file=file)
+    print(f'    Files: {summary["checked_runtime"]}', file=file)
+    print(f'   Passed: {summary["passed"]}', file=file)
+    print(f' Failures: {summary["errors_runtime"]}', file=file)
+    if summary["flaky"]:
+        print(f'    Flaky: {summary["flaky"]}', file=file)
+    if summary.get("stopped"):
+        print(f'{bcolors.WARNING}Stopped early, the remaining files were not checked{bcolors.ENDC}', file=file)
+
+    for file_path in summary['problems']:
+        problem = summary['problems'][file_path]
+        rel_file_path = relative_path( root_path, file_path )
+        p_msg = problem['msg']
+        p_type = problem['type']
+        print(f'\n{bcolors.OKBLUE}{rel_file_path}{bcolors.ENDC}', file=file)
+        print(f'[{STATUS_LABELS[p_type]}] {p_msg}', file=file)
+
+    if summary['flaky_samples']:
+        print(f'\n{bcolors.WARNING}FLAKY (rate limited, passed on a retry){bcolors.ENDC}', file=file)
+        for file_path, msg in summary['flaky_samples'].items():
+            print(f'[{STATUS_LABELS["flaky"]}] {relative_path( root_path, file_path )}: {msg}', file=file)
+
+def sample_label( f: SampleLike ):
+    """
+    The name a sample is reported under: its path, or for a code block in a
+    Markdown page, '<page>:<line>'.
+    """
+    return f.get('label') or f['fn']
+
+def result_record( outcome: dict, root_path: Path = None ) -> dict:
+    """
+    A JSON-serializable record of the outcome of checking one file.
+    """
+    fn = Path( sample_label( outcome['f'] ) )
+    try:
+        rel = fn.relative_to(root_path).as_posix() if root_path is not None else str(fn)
+    except ValueError:
+        rel = str(fn)
+    return {
+        'file': rel,
+        'language': outcome['language'],
+        'status': outcome['status'],
+        'message': outcome['msg'],
+        'checked_syntax': outcome['checked_syntax'],
+        'checked_runtime': outcome['checked_runtime'],
+        'retries': outcome.get('retries', 0),
+        'usage': outcome.get('usage'),
+        'timings': outcome.get('timings', {})
+    }
+
+class RunState:
+    """
+    The counters and problems of a single run.
+    """
+    def __init__( self, root_path: Path = None ):
+        self.root_path = root_path
+        self.summary = new_summary()
+        # results are recorded from a single thread by process_code, but the
+        # lock keeps the counters consistent for callers that use several
+        self.lock = threading.RLock()
+
+    def add_problem( self, fn, msg, t ):
+        with self.lock:
+            self.summary['problems'][fn] = { 'msg': msg, 'type': t }
+
+    def record( self, outcome: dict ):
+        """
+        Fold the outcome of check_file() into the summary.
+        """
+        status = outcome['status']
+        summary = self.summary
+        with self.lock:
+            summary['total'] += 1
+            if outcome['checked_syntax']:
+                summary['checked_syntax'] += 1
+            if outcome['checked_runtime']:
+                summary['checked_runtime'] += 1
+            if status == 'skipped':
+                summary['skipped'] += 1
+            elif status == 'cached':
+                summary['cached'] += 1
+            elif status == 'passed':
+                summary['passed'] += 1
+            elif status == 'flaky':
+                # flaky samples did pass, but are listed on their own
+                summary['passed'] += 1
+                summary['flaky'] += 1
+                summary['flaky_samples'][sample_label( outcome['f'] )] = outcome['msg']
+            elif status == 'syntax':
+                self.add_problem( sample_label( outcome['f'] ), outcome['msg'], 'syntax' )
+                summary['errors_syntax'] += 1
+            elif status in ('error', 'permission'):
+                self.add_problem( sample_label( outcome['f'] ), outcome['msg'], status )
+                summary['errors'] += 1
+                summary['errors_runtime'] += 1
+            if status in FAILURES:
+                summary['failure'] = True
+            summary['passed_syntax'] = summary['checked_syntax'] - summary['errors_syntax']
+
+    def stop( self ):
+        """
+        Mark the run as stopped before every file was checked.
+        """
+        with self.lock:
+            self.summary['stopped'] = True
+
+    @property
+    def failed( self ) -> bool:
+        return self.summary['failure']
+
+class ResultSink:
+    """
+    Receives the results of a run as they complete. Subclasses override any
+    of the three hooks.
+    """
+    def start( self, state: RunState ):
+        pass
+    def result( self, outcome: dict, state: RunState ):
+        pass
+    def finish( self, state: RunState ):
+        pass
+
+class ConsoleSink( ResultSink ):
+    """
+    Prints the summary and the list of problems at the end of the run, to
+    file (default: stdout).
+    """
+    def __init__( self, file: T.TextIO = None ):
+        self.file = file
+
+    def finish( self, state: RunState ):
+        print_summary( state.root_path, state.summary, file=self.file )
+
+class NDJSONSink( ResultSink ):
+    """
+    Writes one JSON record per file as soon as it is checked, followed by a
+    final summary record. path may be '-' for stdout.
+    """
+    def __init__( self, path ):
+        self.path = path
+        self.stream = None
+
+    def start( self, state: RunState ):
+        self.stream = sys.stdout if self.path == '-' else open(self.path, 'w')
+
+    def _write( self, record: dict ):
+        self.stream.write( json.dumps(record) + '\n' )
+        self.stream.flush()
+
+    def result( self, outcome: dict, state: RunState ):
+        self._write( dict( type='result', **result_record(outcome, state.root_path) ) )
+
+    def finish( self, state: RunState ):
+        counts = { k: v for k, v in state.summary.items() if k not in ('problems', 'flaky_samples') }
+        self._write( dict( type='summary', **counts ) )
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+def merge_results( paths: T.Iterable[Path], root_path: Path = None ) -> RunState:
+    """
+    Combine the NDJSON files written by NDJSONSink, e.g. one per shard, into
+    the state of a single run. Raises ValueError if a file is incomplete or
+    a file was checked by more than one of them.
+    """
+    state = RunState( root_path )
+    counters = new_summary()
+    seen: T.Dict[str, Path] = {}
+    for path in paths:
+        summary = None
+        with open(path) as fh:
+            for n, line in enumerate(fh, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise ValueError(f'{path}:{n}: not a JSON record')
+                if record.get('type') == 'summary':
+                    summary = record
+                elif record.get('type') == 'result':
+                    if record['file'] in seen:
+                        raise ValueError(f'{record["file"]} was checked in both {seen[record["file"]]} and {path}')
+                    seen[record['file']] = path
+                    if record['status'] in FAILURES:
+                        state.add_problem( record['file'], record['message'], record['status'] )
+                    elif record['status'] == 'flaky':
+                        state.summary['flaky_samples'][record['file']] = record['message']
+        if summary is None:
+            raise ValueError(f'{path} has no summary record, did that run finish?')
+        for k, v in counters.items():
+            if k in ('failure', 'stopped'):
+                counters[k] = v or bool(summary.get(k))
+            elif isinstance(v, int):
+                counters[k] = v + summary.get(k, 0)
+    # files written before it was recorded have no passed_syntax
+    counters['passed_syntax'] = counters['checked_syntax'] - counters['errors_syntax']
+    counters['problems'] = state.summary['problems']
+    counters['flaky_samples'] = state.summary['flaky_samples']
+    state.summary = counters
+    return state
+
+class JUnitSink( ResultSink ):
+    """
+    Writes a JUnit XML report with one test case per checked file.
+    """
+    def __init__( self, path, suite_name: str = 'mkdocs-codecheck' ):
+        self.path = path
+        self.suite_name = suite_name
+        self.cases: T.List[tuple] = []
+
+    def result( self, outcome: dict, state: RunState ):
+        record = result_record( outcome, state.root_path )
+        seconds = sum( record['timings'].values() )
+        # only the messages of failures and skips are kept until the report is written
+        message = record['message'] if record['status'] in FAILURES + ('skipped',) else None
+        if record['status'] == 'flaky':
+            message = record['message']
+        self.cases.append( (record['file'], record['language'] or 'unknown', record['status'], seconds, message,
+                            record['usage']) )
+
+    def finish( self, state: RunState ):
+        suite = ET.Element('testsuite', name=self.suite_name)
+        failures = skipped = 0
+        total_time = 0.0
+        for name, language, status, seconds, message, usage in self.cases:
+            total_time += seconds
+            case = ET.SubElement(suite, 'testcase', classname=language, name=name, time=f'{seconds:.3f}')
+            props = None
+            if usage:
+                props = ET.SubElement(case, 'properties')
+                ET.SubElement(props, 'property', name='max_rss', value=str(usage['max_rss']))
+                ET.SubElement(props, 'property', name='cpu', value=f'{usage["cpu"]:.3f}')
+            if status in FAILURES:
+                failures += 1
+                text = message or ''
+                failure = ET.SubElement(case, 'failure', type=status, message=text.strip().split('\n')[0])
+                failure.text = text
+            elif status == 'skipped':
+                skipped += 1
+                ET.SubElement(case, 'skipped', message=message or 'No handler for this file')
+            elif status == 'cached':
+                if props is None:
+                    props = ET.SubElement(case, 'properties')
+                ET.SubElement(props, 'property', name='cached', value='true')
+            elif status == 'flaky':
+                if props is None:
+                    props = ET.SubElement(case, 'properties')
+                ET.SubElement(props, 'property', name='flaky', value='true')
+                ET.SubElement(case, 'system-out').text = message
+        suite.set('tests', str(len(self.cases)))
+        suite.set('failures', str(failures))
+        suite.set('errors', '0')
+        suite.set('skipped', str(skipped))
+        suite.set('time', f'{total_time:.3f}')
+        root = ET.Element('testsuites')
+        root.append(suite)
+        ET.ElementTree(root).write(self.path, encoding='utf-8', xml_declaration=True)
@@ -0,0 +1,59 @@
+"""
+Compact records of the code sample files of a tree.
+
+Samples are described by dicts like {'fn': Path, 'path': Path}, which is
+fine for the handful of code blocks of a page but adds up over a tree of
+hundreds of thousands of files: a dict, a Path and a reference to the root
+for every one of them, all kept alive by anything that holds on to the
+list. A Sample only holds its file name, the directory it is in, shared
+with every other sample found in that directory, and the root, shared by
+all of them; the Path of the file is built each time something asks for
+it, and not kept. It reads like the dicts, so handlers take either.
+"""
+from pathlib import Path
+import typing as T
+
+class Sample:
+    """
+    A code sample file: the directory it is in, its file name and the root
+    it was found under. sample['fn'] is the Path of the file and
+    sample['path'] the root, as for a sample dict.
+    """
+    __slots__ = ('dir', 'name', 'root')
+    KEYS = ('fn', 'path')
+
+    def __init__( self, dir: Path, name: str, root: Path ):
+        self.dir = dir
+        self.name = name
+        self.root = root
+
+    @classmethod
+    def from_path( cls, fn: T.Union[str, Path], root: Path ) -> 'Sample':
+        fn = Path(fn)
+        return cls( fn.parent, fn.name, root )
+
+    def __getitem__( self, key: str ):
+        if key == 'fn':
+            # built on demand, so it is not kept alive with the sample
+            return self.dir / self.name
+        if key == 'path':
+            return self.root
+        raise KeyError(key)
+
+    def get( self, key: str, default = None ):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__( self, key: str ) -> bool:
+        return key in self.KEYS
+
+    def keys( self ) -> T.Tuple[str, ...]:
+        return self.KEYS
+
+    def __repr__( self ) -> str:
+        return f'Sample({str(self["fn"])!r})'
+
+# what handlers and find_code_samples() take and yield as a sample
+SampleLike = T.Union[dict, Sample]
@@ -0,0 +1,176 @@
+"""
+Sandboxed execution of runtime checks.
+
+With a sandbox, each sample runs in a temporary working directory of its
+own, removed afterwards, so nothing it writes lands in the source tree or
+the directory mkdocs-codecheck was started from. It sees only the
+environment variables on an allowlist plus those of the --dotenv file, and
+it runs under resource limits (address space, CPU seconds, open files,
+processes), so one runaway sample cannot take the machine down with it.
+
+On POSIX systems the sample is started by a small launcher that applies
+the limits between fork and exec and waits for it with wait4(), which also
+gives the peak RSS and CPU time of each sample. Elsewhere only the working
+directory and environment are sandboxed.
+"""
+from fnmatch import fnmatchcase
+from pathlib import Path
+import typing as T
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# the variables samples see, besides those of the --dotenv file
+DEFAULT_ENV_ALLOWLIST = (
+    'PATH', 'HOME', 'USER', 'LOGNAME', 'SHELL', 'LANG', 'LANGUAGE', 'LC_*', 'TZ', 'TERM', 'TMPDIR',
+    'SYSTEMROOT', 'COMSPEC', 'PATHEXT', 'TEMP', 'TMP',
+    'HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY', 'http_proxy', 'https_proxy', 'no_proxy',
+    'SSL_CERT_FILE', 'SSL_CERT_DIR', 'REQUESTS_CA_BUNDLE',
+    'VIRTUAL_ENV', 'PYTHONPATH', 'PYTHONHOME', 'JAVA_HOME', 'CLASSPATH', 'NODE_PATH',
+    'GEM_HOME', 'GEM_PATH', 'BUNDLE_*', 'RUBYOPT', 'DOTNET_*', 'NUGET_PACKAGES',
+)
+
+# Run argv[3:] with the rlimits in argv[2], then write its resource usage
+# to the file named in argv[1] and exit the way it did. Started with -S -E,
+# so it only costs a bare interpreter start.
+LAUNCHER = r'''
+import json, os, resource, signal, sys
+usage_path, limits, argv = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3:]
+r, w = os.pipe()
+pid = os.fork()
+if pid == 0:
+    os.close(r)
+    try:
+        for name, value in limits.items():
+            which = getattr(resource, name)
+            soft, hard = resource.getrlimit(which)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(which, (value, value if name != 'RLIMIT_CPU' else value + 1))
+        os.execvp(argv[0], argv)
+    except OSError as e:
+        os.write(w, json.dumps([e.errno, e.strerror]).encode())
+    os._exit(127)
+os.close(w)
+failure = b''
+while True:
+    chunk = os.read(r, 4096)
+    if not chunk:
+        break
+    failure += chunk
+_, status, ru = os.wait4(pid, 0)
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+scale = 1 if sys.platform == 'darwin' else 1024
+usage = {'max_rss': ru.ru_maxrss * scale, 'cpu': ru.ru_utime + ru.ru_stime}
+if failure:
+    usage['exec_error'] = json.loads(failure)
+with open(usage_path, 'w') as fh:
+    json.dump(usage, fh)
+if os.WIFSIGNALED(status):
+    sig = os.WTERMSIG(status)
+    signal.signal(sig, signal.SIG_DFL)
+    os.kill(os.getpid(), sig)
+sys.exit(os.WEXITSTATUS(status))
+'''
+
+def available() -> bool:
+    """
+    Whether resource limits and usage reporting are supported here.
+    """
+    return resource is not None and hasattr(os, 'fork') and hasattr(os, 'wait4')
+
+class Sandbox:
+    """
+    How runtime checks are sandboxed. memory is the address space limit in
+    bytes, cpu the limit on CPU seconds, files the limit on open files and
+    processes the limit on the processes of the user running the checks
+    (RLIMIT_NPROC counts them all, not just the sample's); None means no
+    limit. env_allow holds the names, or fnmatch patterns, of the variables
+    samples inherit, and extra_env variables set on top of them, e.g. the
+    values of the --dotenv file.
+    """
+    def __init__( self, memory: int = None, cpu: int = None, files: int = None, processes: int = None,
+                  env_allow: T.Iterable[str] = DEFAULT_ENV_ALLOWLIST, extra_env: dict = None ):
+        self.memory = memory
+        self.cpu = cpu
+        self.files = files
+        self.processes = processes
+        self.env_allow = list( env_allow )
+        # dotenv_values() gives None for a bare name without a value
+        self.extra_env = { k: v for k, v in (extra_env or {}).items() if v is not None }
+
+    def allowed( self, name: str ) -> bool:
+        return any( fnmatchcase( name, pattern ) for pattern in self.env_allow )
+
+    def environment( self, env: dict = None ) -> dict:
+        """
+        The environment of a sample: the allowed variables of env (by default,
+        the current environment), then extra_env.
+        """
+        env = os.environ if env is None else env
+        sandboxed = { k: v for k, v in env.items() if self.allowed( k ) }
+        sandboxed.update( self.extra_env )
+        # no __pycache__ next to the modules a Python sample imports
+        sandboxed.setdefault( 'PYTHONDONTWRITEBYTECODE', '1' )
+        return sandboxed
+
+    def limits( self, memory_rlimit: str = 'RLIMIT_AS' ) -> dict:
+        """
+        The rlimits to apply, by name. memory_rlimit is the limit the memory
+        cap is enforced with, see CodeHandler.memory_rlimit.
+        """
+        limits = {}
+        if self.memory:
+            limits[memory_rlimit] = int(self.memory)
+        if self.cpu:
+            limits['RLIMIT_CPU'] = int(self.cpu)
+        if self.files:
+            limits['RLIMIT_NOFILE'] = int(self.files)
+        if self.processes:
+            limits['RLIMIT_NPROC'] = int(self.processes)
+        return limits
+
+    async def run_async( self, capturer, argv: T.List[str], name: str = None, stage: str = 'runtime',
+                         timeout: float = None, cwd = None, env: dict = None,
+                         memory_rlimit: str = 'RLIMIT_AS' ):
+        """
+        Run argv with capturer (see Capturer.run_async) in the sandbox. The
+        CapturedProcess returned has a `usage` dict with the sample's peak
+        RSS in bytes ('max_rss') and CPU seconds ('cpu'), or None if they
+        could not be measured. cwd defaults to a new temporary directory.
+        """
+        scratch = Path( tempfile.mkdtemp(prefix='codecheck-run-') )
+        try:
+            work_dir = scratch / 'cwd'
+            work_dir.mkdir()
+            usage_path = scratch / 'usage.json'
+            argv = [ str(a) for a in argv ]
+            launch = argv
+            if available():
+                launch = [ sys.executable, '-S', '-E', '-c', LAUNCHER, str(usage_path),
+                           json.dumps( self.limits( memory_rlimit ) ) ] + argv
+            result = await capturer.run_async( launch, name=name, stage=stage, timeout=timeout,
+                                               cwd=cwd or work_dir, env=self.environment( env ) )
+            result.args = argv
+            result.usage = None
+            try:
+                with open(usage_path) as fh:
+                    usage = json.load(fh)
+            except (OSError, ValueError):
+                return result
+            if 'exec_error' in usage:
+                # raised as PermissionError, FileNotFoundError... by errno
+                code, message = usage['exec_error']
+                raise OSError( code, message, argv[0] )
+            result.usage = usage
+            return result
+        finally:
+            shutil.rmtree( scratch, ignore_errors=True )
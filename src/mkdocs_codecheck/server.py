@@ -0,0 +1,275 @@
+"""
+A long-running check daemon for editors and pre-commit hooks.
+
+Every run of mkdocs-codecheck starts the same way: it loads the --dotenv
+file, probes the toolchains, reads the ignore rules and walks the tree.
+`mkdocs-codecheck serve` does that once, keeps the index of code samples
+up to date as files change (see watch.make_watcher), and answers requests
+to check paths over a Unix socket. Each request is one line of JSON:
+
+    {"command": "check", "paths": ["/docs/code-samples/hello.py"], "syntax_only": false}
+
+and the reply streams one {"type": "result", ...} record per sample as it
+completes, in the format of results.NDJSONSink, then a {"type": "summary",
+...} record. "syntax_only" is optional: a request can skip the runtime
+checks, but not turn them on for a daemon started with --syntax-only.
+{"command": "ping"} is answered with a 'pong' record and {"command":
+"shutdown"} stops the daemon. Paths may be samples, Markdown pages or
+directories; paths that are not code samples the daemon knows about are
+ignored. client.py is a client that only needs the standard library.
+"""
+from pathlib import Path
+import typing as T
+import socketserver
+import threading
+import logging
+import signal
+import socket
+import json
+import time
+import os
+
+from . import dotignore
+from .base import iter_results, find_code_samples, IGNORE_FILE
+from .client import default_socket
+from .mdblocks import find_markdown_samples
+from .results import RunState, result_record, sample_label
+from .samples import Sample, SampleLike
+from .watch import make_watcher, coalesce
+
+# seconds; the result cache is evicted at most this often
+EVICT_INTERVAL = 60 * 60
+
+def available() -> bool:
+    return hasattr(socket, 'AF_UNIX') and hasattr(socketserver, 'ThreadingUnixStreamServer')
+
+class SampleIndex:
+    """
+    The code samples under path, keyed by the name they are reported under,
+    kept up to date by a watcher thread once watch() is called.
+    """
+    def __init__( self, path: Path, recurse: bool = False, exclude: T.List[str] = None,
+                  docs_dir: Path = None, include_base: Path = None ):
+        self.path = Path(path).expanduser().resolve()
+        self.root = self.path if self.path.is_dir() else self.path.parent
+        self.recurse = recurse
+        self.exclude = exclude
+        self.docs_dir = Path(docs_dir).expanduser().resolve() if docs_dir else None
+        self.include_base = include_base
+        self.ignore_file = Path(IGNORE_FILE).resolve()
+        self.lock = threading.Lock()
+        self.samples: T.Dict[str, SampleLike] = {}
+        self.rebuild()
+
+    def rebuild( self ):
+        ignore = dotignore.dotignore( str(self.ignore_file) )
+        samples = { str(sample_label(f)): f
+                    for f in find_code_samples( self.path, self.recurse, exclude=self.exclude,
+                                                docs_dir=self.docs_dir, include_base=self.include_base,
+                                                ignore=ignore ) }
+        with self.lock:
+            self.ignore = ignore
+            self.samples = samples
+        logging.info(f'Indexed {len(samples)} code sample(s) under {self.path}')
+
+    def is_sample( self, p: Path ) -> bool:
+        try:
+            rel = p.relative_to( self.root )
+        except ValueError:
+            return False
+        if not self.recurse and len(rel.parts) > 1:
+            return False
+        return p.is_file() and not self.ignore.ignore_file( p )
+
+    def is_page( self, p: Path ) -> bool:
+        return self.docs_dir is not None and p.suffix in ('.md', '.markdown') and self.docs_dir in p.parents
+
+    def apply( self, changed: T.Optional[set] ):
+        """
+        Update the index for the changed paths. None means anything may
+        have changed.
+        """
+        if changed is None or self.ignore_file in changed:
+            self.rebuild()
+            return
+        for p in changed:
+            p = Path(p)
+            if self.is_page( p ):
+                blocks = []
+                if p.exists():
+                    blocks = list( find_markdown_samples( self.docs_dir, base_path=self.include_base, files=[ p ] ) )
+                with self.lock:
+                    for key in [ k for k in self.samples if k.startswith(f'{p}:') ]:
+                        del self.samples[key]
+                    self.samples.update( (str(sample_label(f)), f) for f in blocks )
+            elif not p.exists():
+                with self.lock:
+                    # a file, or a directory and everything in it
+                    for key in [ k for k in self.samples if k == str(p) or k.startswith(f'{p}{os.sep}') ]:
+                        del self.samples[key]
+            elif self.is_sample( p ):
+                with self.lock:
+                    self.samples.setdefault( str(p), Sample.from_path( p, self.path ) )
+
+    def select( self, paths: T.Iterable ) -> T.List[SampleLike]:
+        """
+        The samples to check for paths: samples, the code blocks of pages,
+        and everything under directories.
+        """
+        selected = {}
+        with self.lock:
+            for p in paths:
+                p = Path(p).expanduser().resolve()
+                if str(p) in self.samples:
+                    selected[str(p)] = self.samples[str(p)]
+                    continue
+                prefixes = ( f'{p}{os.sep}', f'{p}:' )
+                found = { k: f for k, f in self.samples.items() if k.startswith(prefixes) }
+                if not found and self.is_sample( p ) and not self.is_page( p ):
+                    # saved since the watcher last caught up
+                    found[str(p)] = Sample.from_path( p, self.path )
+                selected.update( found )
+        return [ selected[k] for k in sorted(selected) ]
+
+    def watch( self, interval: float = 0.5, debounce: float = 0.2 ):
+        """
+        Keep the index up to date from a daemon thread.
+        """
+        roots = [ self.root ] + ( [ self.docs_dir ] if self.docs_dir else [] )
+        watcher = make_watcher( roots, self.recurse, self.ignore, interval=interval, extra=[ self.ignore_file ] )
+        def run():
+            while True:
+                changed = coalesce( watcher, quiet=debounce )
+                try:
+                    self.apply( changed )
+                except OSError as e:
+                    logging.debug(f'Rebuilding the index: {e}')
+                    self.rebuild()
+                if changed is None or self.ignore_file in changed:
+                    # new directories are picked up as they are created
+                    watcher.ignore = self.ignore
+                    watcher.refresh()
+        threading.Thread( target=run, name='codecheck-index', daemon=True ).start()
+
+class Daemon:
+    """
+    Checks the samples of an index with the options of iter_results().
+    """
+    def __init__( self, index: SampleIndex, **options ):
+        self.index = index
+        self.options = options
+
+    def check( self, message: dict, write ):
+        samples = self.index.select( message.get('paths') or [ self.index.path ] )
+        options = dict( self.options )
+        # a request may skip the runtime checks, but not run the samples of
+        # a daemon started with --syntax-only
+        options['syntax_only'] = bool( options.get('syntax_only') ) or bool( message.get('syntax_only') )
+        state = RunState( self.index.path )
+        tic = time.monotonic()
+        outcomes = iter_results( self.index.path, samples=samples, state=state, **options )
+        try:
+            for outcome in outcomes:
+                write( dict( type='result', **result_record( outcome, self.index.path ) ) )
+        finally:
+            # cancels the checks still running if the client went away
+            outcomes.close()
+        summary = dict( state.summary )
+        summary['problems'] = { str(k): v for k, v in summary['problems'].items() }
+        summary['flaky_samples'] = { str(k): v for k, v in summary['flaky_samples'].items() }
+        write( dict( type='summary', root=str(self.index.path), seconds=time.monotonic() - tic, **summary ) )
+
+class RequestHandler( socketserver.StreamRequestHandler ):
+
+    def write( self, record: dict ):
+        self.wfile.write( (json.dumps(record) + '\n').encode() )
+
+    def handle( self ):
+        daemon = self.server.daemon
+        for line in self.rfile:
+            try:
+                message = json.loads( line )
+                command = message.get('command', 'check')
+            except (ValueError, AttributeError):
+                self.write( { 'type': 'error', 'message': 'not a JSON request' } )
+                continue
+            try:
+                if command == 'ping':
+                    with daemon.index.lock:
+                        count = len(daemon.index.samples)
+                    self.write( { 'type': 'pong', 'root': str(daemon.index.path), 'pid': os.getpid(),
+                                  'samples': count } )
+                elif command == 'shutdown':
+                    self.write( { 'type': 'bye' } )
+                    # shutdown() waits for serve_forever(), which runs in another thread
+                    threading.Thread( target=self.server.shutdown ).start()
+                    return
+                elif command == 'check':
+                    daemon.check( message, self.write )
+                else:
+                    self.write( { 'type': 'error', 'message': f'unknown command "{command}"' } )
+            except (BrokenPipeError, ConnectionResetError):
+                logging.debug('The client went away')
+                return
+
+class Server( socketserver.ThreadingUnixStreamServer ):
+    daemon_threads = True
+
+    def __init__( self, socket_path: Path, daemon: Daemon ):
+        self.daemon = daemon
+        super().__init__( str(socket_path), RequestHandler )
+
+    def server_bind( self ):
+        super().server_bind()
+        # only the user running the daemon may connect, since requests run
+        # code; set before listen(), so nobody can connect in between
+        os.chmod( self.server_address, 0o600 )
+
+def in_use( socket_path: Path ) -> bool:
+    """
+    Whether a daemon is listening on socket_path.
+    """
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    try:
+        sock.connect( str(socket_path) )
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def serve( path: Path, socket_path: Path = None, recurse: bool = False, exclude: T.List[str] = None,
+           docs_dir: Path = None, include_base: Path = None, interval: float = 0.5, debounce: float = 0.2,
+           **options ):
+    """
+    Index the samples under path and answer requests on socket_path (by
+    default, client.default_socket(path)) until shut down or interrupted.
+    Accepts the options of iter_results(). Raises OSError if another daemon
+    is listening on socket_path.
+    """
+    socket_path = Path( socket_path or default_socket( path ) )
+    if options.get('cache') is not None:
+        # not after every request: eviction walks the whole cache
+        options['cache'].evict_interval = EVICT_INTERVAL
+    if socket_path.exists():
+        if in_use( socket_path ):
+            raise OSError(f'a daemon is already listening on {socket_path}')
+        # left behind by a daemon that did not shut down cleanly
+        socket_path.unlink()
+    index = SampleIndex( path, recurse=recurse, exclude=exclude, docs_dir=docs_dir, include_base=include_base )
+    index.watch( interval=interval, debounce=debounce )
+    server = Server( socket_path, Daemon( index, **options ) )
+    def terminate( signum, frame ):
+        raise KeyboardInterrupt
+    signal.signal( signal.SIGTERM, terminate )
+    print(f'Serving {len(index.samples)} code sample(s) under {index.path} on {socket_path}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            socket_path.unlink()
+        except OSError:
+            pass
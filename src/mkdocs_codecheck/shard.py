@@ -0,0 +1,99 @@
+"""
+Splitting a run across several machines.
+
+Every shard discovers the same samples and keeps its own share of them, so
+no coordination is needed beyond passing each node --shard K/N. Samples
+that are built together (the Java sources of a directory, the files of a C#
+project) always land in the same shard, so no build is repeated. With the
+timing reports of a previous run, shards are balanced by how long their
+samples took rather than by how many there are.
+"""
+from pathlib import Path
+import typing as T
+import heapq
+import re
+
+from . import handlers
+from .results import sample_label
+from .samples import SampleLike
+from .timing import load_durations
+
+SHARD = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*$')
+
+def parse_shard( spec: str ) -> tuple:
+    """
+    Parse 'K/N', the K-th of N shards counting from 1, into (K, N).
+    """
+    m = SHARD.match( spec or '' )
+    if m is None:
+        raise ValueError(f'invalid shard "{spec}", expected K/N')
+    k, n = int(m.group(1)), int(m.group(2))
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError(f'invalid shard "{spec}", K must be between 1 and N')
+    return k, n
+
+def load_shard_durations( paths: T.Iterable[Path] ) -> T.Dict[str, float]:
+    """
+    The per-sample durations recorded in one or more timing reports, e.g.
+    the reports every shard of the previous run wrote.
+    """
+    durations = {}
+    for path in paths:
+        durations.update( load_durations( path ) )
+    return durations
+
+def relative( fn, root: Path ) -> str:
+    # the key samples are recorded under in a timing report
+    try:
+        return Path(fn).relative_to(root).as_posix()
+    except ValueError:
+        return str(fn)
+
+def build_unit( f: SampleLike ) -> tuple:
+    """
+    The files a sample is checked together with; samples with the same unit
+    share a build and are kept in the same shard.
+    """
+    if 'label' in f or 'problem' in f:
+        return ( str(sample_label(f)), )
+    try:
+        inputs = handlers.find_handler( f ).inputs( f )
+    except handlers.NoCodeHandler:
+        inputs = []
+    return tuple( sorted( str(p) for p in inputs ) ) or ( str(f['fn']), )
+
+def partition( samples: T.Iterable[SampleLike], n: int, durations: T.Dict[str, float] = None,
+               root: Path = None ) -> T.List[T.List[SampleLike]]:
+    """
+    Split samples into n lists of roughly equal cost. The cost of a sample
+    is its duration in durations, keyed relative to root; samples without
+    one cost the mean of the known durations, or 1 if there are none, so
+    without durations shards get about as many samples each. The result
+    only depends on the samples and durations, not on their order.
+    """
+    durations = durations or {}
+    default = sum(durations.values()) / len(durations) if durations else 1.0
+    units: T.Dict[tuple, list] = {}
+    for f in samples:
+        units.setdefault( build_unit(f), [] ).append( f )
+    def cost( f ):
+        return durations.get( relative( sample_label(f), root ) if root is not None else str(sample_label(f)), default )
+    # longest first, each to the shard with the least work so far
+    order = sorted( units.items(), key=lambda item: ( -sum( cost(f) for f in item[1] ), item[0] ) )
+    shards: T.List[list] = [ [] for _ in range(n) ]
+    loads = [ ( 0.0, i ) for i in range(n) ]
+    for unit, members in order:
+        load, i = heapq.heappop( loads )
+        shards[i].extend( members )
+        heapq.heappush( loads, ( load + sum( cost(f) for f in members ), i ) )
+    return shards
+
+def shard_samples( samples: T.Iterable[SampleLike], shard: tuple, durations: T.Dict[str, float] = None,
+                   root: Path = None ) -> T.List[SampleLike]:
+    """
+    The samples of shard (K, N) among samples, in their discovery order.
+    """
+    k, n = shard
+    samples = list( samples )
+    mine = { id(f) for f in partition( samples, n, durations, root )[k - 1] }
+    return [ f for f in samples if id(f) in mine ]
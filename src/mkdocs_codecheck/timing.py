@@ -0,0 +1,155 @@
+"""
+Timing instrumentation for a run of process_code.
+
+Every stage of checking a sample (handler lookup, syntax check, runtime
+check) is timed, as is file discovery, so a slow run can be traced back
+to a phase, a language or an individual sample. The report can be written
+as JSON and read back by later runs, e.g. to balance shards.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import typing as T
+import json
+import math
+import time
+
+REPORT_VERSION = 1
+PHASES = ('discovery', 'handler', 'syntax', 'setup', 'runtime')
+
+@contextmanager
+def span( spans: dict, name: str ):
+    """
+    Add the time spent in the with block to spans[name].
+    """
+    tic = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + time.perf_counter() - tic
+
+def timed_iter( items: T.Iterable, timings, phase: str ) -> T.Iterator:
+    """
+    Yield from items, adding the time spent producing each item to phase.
+    """
+    it = iter(items)
+    while True:
+        tic = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            timings.add_phase( phase, time.perf_counter() - tic )
+            return
+        timings.add_phase( phase, time.perf_counter() - tic )
+        yield item
+
+def percentile( values: T.List[float], pct: float ) -> float:
+    """
+    Nearest-rank percentile of values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class Timings:
+
+    def __init__( self, root: Path = None ):
+        self.root = Path(root).resolve() if root is not None else None
+        self.phases = { p: 0.0 for p in PHASES }
+        self.samples: T.Dict[str, dict] = {}
+        self.started = time.perf_counter()
+        self.wall = None
+
+    def relative( self, fn ) -> str:
+        if self.root is not None:
+            try:
+                return Path(fn).relative_to(self.root).as_posix()
+            except ValueError:
+                pass
+        return str(fn)
+
+    def add_phase( self, phase: str, seconds: float ):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_sample( self, fn, language: str, status: str, spans: dict, usage: dict = None ):
+        sample = self.samples.setdefault( self.relative(fn), { 'language': language } )
+        sample['status'] = status
+        if usage:
+            # peak RSS and CPU time of a sandboxed runtime check
+            sample['max_rss'] = usage['max_rss']
+            sample['cpu'] = usage['cpu']
+        for phase, seconds in spans.items():
+            sample[phase] = sample.get(phase, 0.0) + seconds
+            self.add_phase( phase, seconds )
+        sample['total'] = sum( sample.get(p, 0.0) for p in PHASES )
+
+    def add_batch( self, fns: list, language: str, phase: str, seconds: float ):
+        """
+        Spread the time of a batch check evenly over the files in it.
+        """
+        for fn in fns:
+            self.add_sample( fn, language, None, { phase: seconds / len(fns) } )
+
+    def finish( self ):
+        self.wall = time.perf_counter() - self.started
+
+    def languages( self ) -> dict:
+        by_language: T.Dict[str, T.List[float]] = {}
+        for sample in self.samples.values():
+            by_language.setdefault( str(sample['language']), [] ).append( sample['total'] )
+        return { language: {
+                    'count': len(totals),
+                    'total': sum(totals),
+                    'mean': sum(totals) / len(totals),
+                    'p50': percentile(totals, 50),
+                    'p90': percentile(totals, 90),
+                    'p99': percentile(totals, 99),
+                    'max': max(totals) }
+                 for language, totals in sorted(by_language.items()) }
+
+    def slowest( self, top: int = 10 ) -> list:
+        return sorted( self.samples.items(), key=lambda item: item[1]['total'], reverse=True )[:top]
+
+    def report( self ) -> dict:
+        if self.wall is None:
+            self.finish()
+        return {
+            'version': REPORT_VERSION,
+            'root': str(self.root) if self.root is not None else None,
+            'wall': self.wall,
+            'phases': self.phases,
+            'languages': self.languages(),
+            'samples': self.samples
+        }
+
+    def write( self, path ):
+        with open(path, 'w') as fh:
+            json.dump( self.report(), fh, indent=2 )
+
+    def print_profile( self, top: int = 10, file: T.TextIO = None ):
+        if self.wall is None:
+            self.finish()
+        print('PROFILE', file=file)
+        print(f'    Wall time: {self.wall:8.3f}s', file=file)
+        for phase in PHASES:
+            print(f'  {phase.capitalize():>11}: {self.phases.get(phase, 0.0):8.3f}s', file=file)
+        print('LANGUAGES', file=file)
+        for language, stats in self.languages().items():
+            print(f'  {language:<11} {stats["count"]:>5} files {stats["total"]:9.3f}s total '
+                  f'p50 {stats["p50"]:.3f}s p90 {stats["p90"]:.3f}s p99 {stats["p99"]:.3f}s max {stats["max"]:.3f}s', file=file)
+        print('SLOWEST SAMPLES', file=file)
+        for rel, sample in self.slowest(top):
+            usage = ''
+            if 'max_rss' in sample:
+                usage = f', {sample["max_rss"] / (1024 * 1024):.1f} MB peak RSS, {sample["cpu"]:.3f}s CPU'
+            print(f'  {sample["total"]:8.3f}s  {rel} ({sample["language"]}{usage})', file=file)
+
+def load_durations( path ) -> T.Dict[str, float]:
+    """
+    Read the per-sample durations from a report written by Timings.write(),
+    keyed by the sample's path relative to the root that was checked.
+    """
+    with open(path) as fh:
+        report = json.load(fh)
+    return { rel: sample.get('total', 0.0) for rel, sample in report.get('samples', {}).items() }
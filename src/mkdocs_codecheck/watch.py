@@ -0,0 +1,352 @@
+"""
+Watch mode: check every code sample once, then re-check only the samples
+that change.
+
+The handlers, the toolchain probes and the ignore rules stay in memory
+between passes, so a save costs one check instead of a new process and a
+walk of the whole tree. Changes are picked up with inotify on Linux, and by
+polling modification times elsewhere; a burst of saves is coalesced into
+one pass once the tree has been quiet for a moment.
+"""
+from pathlib import Path
+import typing as T
+import ctypes
+import ctypes.util
+import logging
+import select
+import struct
+import time
+import sys
+import os
+
+from . import dotignore
+from . import handlers
+from .base import iter_results, find_code_samples, IGNORE_FILE
+from .results import RunState, print_summary, sample_label
+from .mdblocks import find_markdown_samples
+from .samples import Sample, SampleLike
+
+# inotify(7) event masks
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW  = 0x00004000
+IN_ISDIR       = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT = struct.Struct('iIII')
+
+class Watcher:
+    """
+    Reports the paths that changed under a set of directories. wait()
+    returns a set of paths, an empty set if nothing changed before the
+    timeout, or None if anything may have changed (e.g. events were lost).
+    """
+    def __init__( self, roots: T.List[Path], recurse: bool, ignore: dotignore.dotignore, extra: T.Iterable[Path] = () ):
+        self.roots = [ Path(r) for r in roots ]
+        self.recurse = recurse
+        self.ignore = ignore
+        # single files watched on their own, like the ignore file
+        self.extra = [ Path(p) for p in extra ]
+
+    def directories( self, root: Path ) -> T.Iterator[Path]:
+        yield root
+        if not self.recurse:
+            return
+        for dir_path, dirs, files in os.walk( root ):
+            dirs[:] = sorted( d for d in dirs if not self.ignore.ignore_file( Path(dir_path) / d, is_dir=True ) )
+            for d in dirs:
+                yield Path(dir_path) / d
+
+    def refresh( self ):
+        pass
+
+    def wait( self, timeout: float = None ) -> T.Optional[set]:
+        raise NotImplementedError
+
+    def close( self ):
+        pass
+
+class InotifyWatcher( Watcher ):
+    def __init__( self, roots, recurse, ignore, extra = () ):
+        super().__init__( roots, recurse, ignore, extra )
+        self.libc = ctypes.CDLL( ctypes.util.find_library('c') or 'libc.so.6', use_errno=True )
+        if not hasattr( self.libc, 'inotify_init1' ):
+            raise OSError('inotify is not available')
+        self.fd = self.libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC )
+        if self.fd < 0:
+            raise OSError( ctypes.get_errno(), 'inotify_init1 failed' )
+        self.dirs = {}
+        self.refresh()
+
+    def add( self, directory: Path ):
+        wd = self.libc.inotify_add_watch( self.fd, os.fsencode(directory), WATCH_MASK )
+        if wd < 0:
+            logging.debug(f'Cannot watch {directory}: {os.strerror(ctypes.get_errno())}')
+            return
+        self.dirs[wd] = directory
+
+    def refresh( self ):
+        # adding a watch that exists already just updates it
+        for root in self.roots:
+            for directory in self.directories( root ):
+                self.add( directory )
+        for p in self.extra:
+            self.add( p.parent )
+
+    def wait( self, timeout: float = None ) -> T.Optional[set]:
+        ready, _, _ = select.select( [ self.fd ], [], [], timeout )
+        if not ready:
+            return set()
+        changed: T.Set[Path] = set()
+        try:
+            data = os.read( self.fd, 64 * 1024 )
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from( data, offset )
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self.dirs.get( wd )
+            if directory is None:
+                continue
+            if mask & IN_DELETE_SELF:
+                del self.dirs[wd]
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recurse:
+                    # files may be created in the directory before it is watched
+                    for d in self.directories( path ):
+                        self.add( d )
+                        try:
+                            changed.update( p for p in d.iterdir() if p.is_file() )
+                        except OSError:
+                            # removed again before it could be scanned
+                            continue
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    changed.add( path )
+                continue
+            changed.add( path )
+        return changed
+
+    def close( self ):
+        os.close( self.fd )
+
+class PollingWatcher( Watcher ):
+    def __init__( self, roots, recurse, ignore, extra = (), interval: float = 0.5 ):
+        super().__init__( roots, recurse, ignore, extra )
+        self.interval = interval
+        self.state = self.snapshot()
+
+    def snapshot( self ) -> dict:
+        state = {}
+        for root in self.roots:
+            for directory in self.directories( root ):
+                try:
+                    with os.scandir( directory ) as it:
+                        for entry in it:
+                            if entry.is_file():
+                                st = entry.stat()
+                                state[Path(entry.path)] = ( st.st_mtime_ns, st.st_size )
+                except OSError:
+                    continue
+        for p in self.extra:
+            try:
+                st = os.stat( p )
+                state[p] = ( st.st_mtime_ns, st.st_size )
+            except OSError:
+                pass
+        return state
+
+    def wait( self, timeout: float = None ) -> T.Optional[set]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.snapshot()
+            changed = { p for p in current.keys() | self.state.keys() if current.get(p) != self.state.get(p) }
+            self.state = current
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep( self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic())) )
+
+def make_watcher( roots, recurse: bool, ignore, interval: float = 0.5, extra = () ) -> Watcher:
+    """
+    An inotify watcher where inotify is available, and a polling one where
+    it is not.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher( roots, recurse, ignore, extra )
+        except OSError as e:
+            logging.debug(f'Falling back to polling: {e}')
+    return PollingWatcher( roots, recurse, ignore, extra, interval=interval )
+
+def coalesce( watcher: Watcher, quiet: float = 0.2, max_delay: float = 2.0 ) -> T.Optional[set]:
+    """
+    Wait for a change, then keep collecting changes until none arrive for
+    `quiet` seconds, or for at most max_delay seconds.
+    """
+    changed = watcher.wait()
+    deadline = time.monotonic() + max_delay
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return changed
+        more = watcher.wait( min(quiet, remaining) )
+        if more is not None and not more:
+            return changed
+        changed = None if more is None or changed is None else changed | more
+
+class WatchSession:
+    """
+    The samples of a watched tree and the latest outcome of each, keyed by
+    the name they are reported under.
+    """
+    def __init__( self, path: Path, recurse: bool = False, docs_dir: Path = None, include_base: Path = None,
+                  **options ):
+        self.path = Path(path).expanduser().resolve()
+        self.root = self.path if self.path.is_dir() else self.path.parent
+        self.recurse = recurse
+        self.docs_dir = Path(docs_dir).expanduser().resolve() if docs_dir else None
+        self.include_base = include_base
+        self.options = options
+        self.ignore_file = Path(IGNORE_FILE).resolve()
+        self.ignore = dotignore.dotignore( str(self.ignore_file) )
+        self.outcomes: T.Dict[str, dict] = {}
+        # input file -> the samples whose result depends on it
+        self.dependents: T.Dict[Path, T.Set[str]] = {}
+
+    def discover( self ) -> T.Iterator[SampleLike]:
+        self.ignore = dotignore.dotignore( str(self.ignore_file) )
+        return find_code_samples( self.path, self.recurse, docs_dir=self.docs_dir,
+                                  include_base=self.include_base, ignore=self.ignore )
+
+    def check( self, samples: T.Iterable[SampleLike] ):
+        for outcome in iter_results( self.path, samples=samples, **self.options ):
+            f = outcome['f']
+            self.outcomes[ str(sample_label(f)) ] = outcome
+            try:
+                inputs = handlers.find_handler( f ).inputs( f ) if 'label' not in f else [ f['fn'] ]
+            except handlers.NoCodeHandler:
+                continue
+            for p in inputs:
+                self.dependents.setdefault( Path(p), set() ).add( str(sample_label(f)) )
+
+    def full_pass( self ):
+        samples = list( self.discover() )
+        known = { str(sample_label(f)) for f in samples }
+        for key in set(self.outcomes) - known:
+            del self.outcomes[key]
+        self.check( f for f in samples if str(sample_label(f)) not in self.outcomes )
+
+    def is_sample( self, p: Path ) -> bool:
+        try:
+            rel = p.relative_to( self.root )
+        except ValueError:
+            return False
+        if not self.recurse and len(rel.parts) > 1:
+            return False
+        return p.is_file() and not self.ignore.ignore_file( p )
+
+    def apply( self, changed: T.Optional[set] ):
+        """
+        Re-check the samples affected by the changed paths. None means
+        anything may have changed.
+        """
+        if changed is None or self.ignore_file in changed:
+            # the ignore rules changed: see which samples now count
+            logging.debug('Re-reading the ignore rules')
+            self.full_pass()
+            if changed is None:
+                return
+        samples: T.Dict[str, SampleLike] = {}
+        for p in sorted( changed ):
+            p = Path(p)
+            if self.docs_dir is not None and p.suffix in ('.md', '.markdown'):
+                self.apply_page( p, samples )
+                continue
+            affected = set( self.dependents.get( p, () ) )
+            if not p.exists():
+                self.outcomes.pop( str(p), None )
+                affected.discard( str(p) )
+            elif self.is_sample( p ):
+                affected.add( str(p) )
+            for key in affected:
+                old = self.outcomes.get( key )
+                f = old['f'] if old is not None else Sample.from_path( key, self.path )
+                if Path(f['fn']).exists():
+                    samples[key] = f
+        if samples:
+            self.check( samples.values() )
+
+    def apply_page( self, page: Path, samples: dict ):
+        prefix = f'{page}:'
+        for key in [ k for k in self.outcomes if k.startswith(prefix) ]:
+            del self.outcomes[key]
+        if page.exists():
+            for f in find_markdown_samples( self.docs_dir, base_path=self.include_base, files=[ page ] ):
+                samples[ str(sample_label(f)) ] = f
+
+    def state( self ) -> RunState:
+        state = RunState( self.path )
+        for key in sorted( self.outcomes ):
+            if self.outcomes[key]['status'] != 'ignored':
+                state.record( self.outcomes[key] )
+        return state
+
+def show( session: WatchSession ) -> RunState:
+    """
+    Print the summary of the latest outcomes, over the previous one when
+    the output is a terminal.
+    """
+    state = session.state()
+    if sys.stdout.isatty():
+        print('\033[H\033[2J', end='')
+    print_summary( state.root_path, state.summary )
+    print(f'\n{time.strftime("%H:%M:%S")} Watching for changes, press Ctrl-C to stop.', flush=True)
+    return state
+
+def watch( path: Path, recurse: bool = False, interval: float = 0.5, debounce: float = 0.2,
+           docs_dir: Path = None, include_base: Path = None, **options ) -> bool:
+    """
+    Check the samples under path, then re-check them as they change until
+    interrupted. Accepts the options of iter_results(). Returns True if any
+    sample was failing when watching stopped.
+    """
+    session = WatchSession( path, recurse=recurse, docs_dir=docs_dir, include_base=include_base, **options )
+    session.full_pass()
+    state = show( session )
+    roots = [ session.root ] + ( [ session.docs_dir ] if session.docs_dir else [] )
+    watcher = make_watcher( roots, recurse, session.ignore, interval=interval, extra=[ session.ignore_file ] )
+    try:
+        while True:
+            changed = coalesce( watcher, quiet=debounce )
+            if changed is not None:
+                # only the files the walk would have picked up, and the ignore file
+                changed = { p for p in changed
+                            if p == session.ignore_file
+                            or (any( root in p.parents for root in roots ) and not session.ignore.ignore_file( p )) }
+                if not changed:
+                    continue
+            session.apply( changed )
+            if changed is None or session.ignore_file in changed:
+                # directories the old rules ignored may need watching; new
+                # directories are picked up as they are created
+                watcher.ignore = session.ignore
+                watcher.refresh()
+            state = show( session )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return state.failed
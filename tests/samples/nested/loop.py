@@ -0,0 +1,3 @@
+#!/usr/bin/env python3
+for n in range(3):
+    print(n)
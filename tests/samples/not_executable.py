@@ -0,0 +1,2 @@
+#!/usr/bin/env python3
+print("the file mode lacks the executable bit")
@@ -0,0 +1,63 @@
+from pathlib import Path
+import shutil
+
+import pytest
+
+from mkdocs_codecheck.base import iter_results, find_code_samples
+from mkdocs_codecheck.results import RunState
+
+@pytest.fixture
+def samples( tmp_path, monkeypatch ) -> Path:
+    """
+    A copy of the example samples, plus one that does not compile, which is
+    not kept in the tree so that the package still byte-compiles.
+    """
+    root = tmp_path / 'samples'
+    shutil.copytree( Path(__file__).parent / 'samples', root, ignore=shutil.ignore_patterns( '__pycache__' ) )
+    (root / 'syntax_error.py').write_text( '#!/usr/bin/env python3\nprint("missing a parenthesis"\n' )
+    (root / 'syntax_error.py').chmod( 0o755 )
+    # the ignore file is read from the current directory
+    monkeypatch.chdir( tmp_path )
+    return root
+
+def statuses( outcomes, root: Path ):
+    return { Path( o['f']['fn'] ).relative_to( root ).as_posix(): o['status'] for o in outcomes }
+
+def test_discovery( samples ):
+    found = sorted( Path( f['fn'] ).relative_to( samples ).as_posix()
+                    for f in find_code_samples( samples, recurse=True ) )
+    assert found == [ 'fails.py', 'hello.py', 'nested/loop.py', 'not_executable.py', 'notes.txt', 'syntax_error.py' ]
+
+def test_check_the_example_samples( samples ):
+    state = RunState( samples )
+    outcomes = list( iter_results( samples, recurse=True, jobs=4, state=state ) )
+    assert statuses( outcomes, samples ) == {
+        'fails.py': 'error',
+        'hello.py': 'passed',
+        'nested/loop.py': 'passed',
+        'not_executable.py': 'permission',
+        'notes.txt': 'skipped',
+        'syntax_error.py': 'syntax',
+    }
+    summary = state.summary
+    assert summary['total'] == 6
+    assert summary['passed'] == 2
+    assert summary['errors_syntax'] == 1
+    assert summary['errors_runtime'] == 2
+    assert state.failed
+
+def test_syntax_only_does_not_run_the_samples( samples ):
+    outcomes = list( iter_results( samples, recurse=True, syntax_only=True, languages=[ 'python' ] ) )
+    assert statuses( outcomes, samples ) == {
+        'fails.py': 'syntax_passed',
+        'hello.py': 'syntax_passed',
+        'nested/loop.py': 'syntax_passed',
+        'not_executable.py': 'syntax_passed',
+        'notes.txt': 'skipped',
+        'syntax_error.py': 'syntax',
+    }
+
+def test_batch_and_syntax_first_runs_agree( samples ):
+    plain = statuses( iter_results( samples, recurse=True ), samples )
+    assert statuses( iter_results( samples, recurse=True, batch_syntax=True ), samples ) == plain
+    assert statuses( iter_results( samples, recurse=True, syntax_first=True, jobs=2 ), samples ) == plain
@@ -0,0 +1,70 @@
+import os
+import time
+
+from mkdocs_codecheck import handlers
+from mkdocs_codecheck.cache import ResultCache
+from mkdocs_codecheck.samples import Sample
+
+def sample( root, name, source ):
+    (root / name).write_text( source )
+    f = Sample( root, name, root )
+    return handlers.find_handler( f ), f
+
+def test_the_key_follows_the_contents_of_the_sample( tmp_path ):
+    cache = ResultCache( tmp_path / 'cache' )
+    handler, f = sample( tmp_path, 'a.py', 'print(1)\n' )
+    key = cache.key( handler, f )
+    assert cache.key( handler, f ) == key
+    # the same contents under another name share the entry
+    handler, g = sample( tmp_path, 'b.py', 'print(1)\n' )
+    assert cache.key( handler, g ) == key
+    (tmp_path / 'a.py').write_text( 'print(2)\n' )
+    assert cache.key( handler, f ) != key
+
+def test_the_key_follows_the_dotenv_environment( tmp_path ):
+    handler, f = sample( tmp_path, 'a.py', 'print(1)\n' )
+    one = ResultCache( tmp_path / 'cache', env_digest='one' )
+    two = ResultCache( tmp_path / 'cache', env_digest='two' )
+    assert one.key( handler, f ) != two.key( handler, f )
+
+def test_a_syntax_pass_does_not_satisfy_a_runtime_lookup( tmp_path ):
+    cache = ResultCache( tmp_path / 'cache' )
+    handler, f = sample( tmp_path, 'a.py', 'print(1)\n' )
+    key = cache.key( handler, f )
+    assert not cache.lookup( key, syntax_only=True )
+    cache.store( key, runtime=False )
+    assert cache.lookup( key, syntax_only=True )
+    assert not cache.lookup( key )
+    cache.store( key, runtime=True )
+    assert cache.lookup( key )
+
+def test_old_entries_are_evicted( tmp_path ):
+    cache = ResultCache( tmp_path / 'cache', max_age=60 )
+    cache.store( 'a' * 64, runtime=True )
+    cache.store( 'b' * 64, runtime=True )
+    old = time.time() - 120
+    os.utime( cache._entry( 'a' * 64 ), ( old, old ) )
+    assert cache.evict() == 1
+    assert not cache.lookup( 'a' * 64 )
+    assert cache.lookup( 'b' * 64 )
+
+def test_the_least_recently_used_entries_go_first( tmp_path ):
+    keys = [ c * 64 for c in 'abcd' ]
+    cache = ResultCache( tmp_path / 'cache' )
+    for n, key in enumerate( keys ):
+        cache.store( key, runtime=True )
+        t = time.time() - 100 + n
+        os.utime( cache._entry( key ), ( t, t ) )
+    # using an entry makes it the most recently used
+    assert cache.lookup( keys[0] )
+    cache.max_size = sum( cache._entry( key ).stat().st_size for key in ( keys[0], keys[3] ) )
+    assert cache.evict() == 2
+    assert [ cache.lookup( key ) for key in keys ] == [ True, False, False, True ]
+
+def test_eviction_is_rate_limited( tmp_path ):
+    cache = ResultCache( tmp_path / 'cache', max_age=60, evict_interval=3600 )
+    cache.store( 'a' * 64, runtime=True )
+    assert cache.evict() == 0
+    old = time.time() - 120
+    os.utime( cache._entry( 'a' * 64 ), ( old, old ) )
+    assert cache.evict() == 0
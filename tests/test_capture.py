@@ -0,0 +1,33 @@
+import sys
+
+from mkdocs_codecheck.capture import RingBuffer, Capturer
+
+def test_output_under_the_limit_is_kept_whole():
+    buf = RingBuffer( limit=16 )
+    buf.write( b'hello ' )
+    buf.write( b'world' )
+    assert buf.omitted == 0
+    assert buf.getvalue() == 'hello world'
+
+def test_the_head_and_the_tail_are_kept():
+    buf = RingBuffer( limit=10 )
+    buf.write( b'0123456789abcdef' )
+    assert bytes(buf.head) == b'01234'
+    assert bytes(buf.tail) == b'bcdef'
+    assert buf.omitted == 6
+    assert buf.getvalue() == '01234\n... [6 bytes omitted] ...\nbcdef'
+
+def test_small_writes_keep_the_latest_tail():
+    buf = RingBuffer( limit=8 )
+    for c in b'abcdefghijklmnopqrstuvwxyz':
+        buf.write( bytes([c]) )
+    assert bytes(buf.head) == b'abcd'
+    assert bytes(buf.tail) == b'wxyz'
+    assert buf.total == 26
+    assert buf.omitted == 18
+
+def test_captured_output_is_bounded():
+    result = Capturer( limit=100 ).run( [ sys.executable, '-c', 'print("x" * 10000)' ] )
+    assert result.returncode == 0
+    assert len( result.stdout ) < 200
+    assert 'bytes omitted' in result.stdout
@@ -0,0 +1,62 @@
+from mkdocs_codecheck.dotignore import IgnoreMatcher, dotignore
+
+def test_names_and_suffixes_match_at_any_depth():
+    m = IgnoreMatcher( [ '__init__.py', '*.pyc', '# a comment', '' ] )
+    assert m.match( '__init__.py' )
+    assert m.match( 'a/b/__init__.py' )
+    assert m.match( 'a/b/module.PYC' )
+    assert not m.match( 'a/b/module.py' )
+    assert len( m.rules ) == 2
+
+def test_negation_reincludes_a_file():
+    m = IgnoreMatcher( [ '*.py', '!keep.py' ] )
+    assert m.match( 'a/drop.py' )
+    assert not m.match( 'a/keep.py' )
+
+def test_the_last_matching_rule_wins():
+    m = IgnoreMatcher( [ '!keep.py', '*.py' ] )
+    assert m.match( 'keep.py' )
+
+def test_a_leading_slash_anchors_to_the_root():
+    m = IgnoreMatcher( [ '/build' ] )
+    assert m.match( 'build', is_dir=True )
+    assert not m.match( 'src/build', is_dir=True )
+
+def test_a_middle_slash_anchors_to_the_root():
+    m = IgnoreMatcher( [ 'docs/*.md' ] )
+    assert m.match( 'docs/index.md' )
+    assert not m.match( 'site/docs/index.md' )
+    assert not m.match( 'docs/api/index.md' )
+
+def test_double_star_matches_any_number_of_directories():
+    m = IgnoreMatcher( [ 'docs/**/draft.md', '**/tmp' ] )
+    assert m.match( 'docs/draft.md' )
+    assert m.match( 'docs/a/b/draft.md' )
+    assert m.match( 'a/b/tmp' )
+
+def test_directory_patterns_only_match_directories():
+    m = IgnoreMatcher( [ 'node_modules/' ] )
+    assert m.match( 'node_modules', is_dir=True )
+    assert m.match( 'web/node_modules', is_dir=True )
+    assert not m.match( 'node_modules' )
+
+def test_match_path_honors_ignored_parents():
+    m = IgnoreMatcher( [ 'node_modules/' ] )
+    assert m.match_path( 'web/node_modules/lib/index.js' )
+    assert not m.match_path( 'web/src/index.js' )
+
+def test_negation_with_directory_patterns():
+    m = IgnoreMatcher( [ 'vendor/', '!vendor/' ] )
+    assert not m.match( 'vendor', is_dir=True )
+
+def test_walk_skips_ignored_directories( tmp_path ):
+    (tmp_path / 'node_modules').mkdir()
+    (tmp_path / 'node_modules' / 'dep.js').write_text( '' )
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'app.js').write_text( '' )
+    (tmp_path / 'src' / 'app.pyc').write_text( '' )
+    ignore_file = tmp_path / '.codecheck-ignore'
+    ignore_file.write_text( 'node_modules/\n*.pyc\n.codecheck-ignore\n' )
+    di = dotignore( str(ignore_file) )
+    found = sorted( p.relative_to(tmp_path).as_posix() for p in di.get_files( tmp_path, recurse=True ) )
+    assert found == [ 'src/app.js' ]
@@ -0,0 +1,75 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from mkdocs_codecheck.engine import ordered_map_async
+
+def test_results_come_in_the_order_of_the_items():
+    async def slow( n ):
+        await asyncio.sleep( random.random() / 100 )
+        return n * n
+    assert list( ordered_map_async( slow, range(50), limit=8 ) ) == [ n * n for n in range(50) ]
+
+def test_unordered_results_come_as_they_complete():
+    async def slow( n ):
+        await asyncio.sleep( 0.2 if n == 0 else 0 )
+        return n
+    results = list( ordered_map_async( slow, range(5), limit=5, ordered=False ) )
+    assert sorted( results ) == list( range(5) )
+    assert results[-1] == 0
+
+def test_at_most_limit_calls_run_at_once():
+    running = [ 0, 0 ]
+    async def track( n ):
+        running[0] += 1
+        running[1] = max( running[1], running[0] )
+        await asyncio.sleep( 0.01 )
+        running[0] -= 1
+        return n
+    assert len( list( ordered_map_async( track, range(30), limit=3 ) ) ) == 30
+    assert running[1] == 3
+
+def test_a_stalled_consumer_bounds_the_calls_started():
+    started = []
+    async def record( n ):
+        started.append( n )
+        return n
+    limit = 2
+    results = ordered_map_async( record, range(1000), limit=limit )
+    assert next( results ) == 0
+    time.sleep( 0.3 )
+    # every undelivered result holds a slot of the window of limit * 2
+    assert len( started ) <= limit * 2 + 1
+    results.close()
+
+def test_closing_early_cancels_the_running_calls():
+    cancelled = []
+    async def hang( n ):
+        if n == 0:
+            return n
+        try:
+            await asyncio.sleep( 10 )
+        except asyncio.CancelledError:
+            cancelled.append( n )
+            raise
+        return n
+    tic = time.monotonic()
+    results = ordered_map_async( hang, range(10), limit=4 )
+    assert next( results ) == 0
+    time.sleep( 0.1 )
+    results.close()
+    assert time.monotonic() - tic < 5
+    assert cancelled
+
+def test_an_error_is_raised_to_the_consumer():
+    async def fail( n ):
+        if n == 3:
+            raise ValueError('three')
+        return n
+    results = []
+    with pytest.raises( ValueError, match='three' ):
+        for r in ordered_map_async( fail, range(10), limit=2 ):
+            results.append( r )
+    assert results == [ 0, 1, 2 ]
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from mkdocs_codecheck.results import RunState, NDJSONSink, merge_results
+
+def outcome( path, status, msg = None, syntax = True, runtime = False ):
+    return { 'f': { 'fn': path }, 'status': status, 'msg': msg, 'language': 'python', 'timings': {},
+             'checked_syntax': syntax, 'checked_runtime': runtime, 'retries': 0, 'usage': None }
+
+def write_run( path, root, outcomes ):
+    state = RunState( root )
+    sink = NDJSONSink( path )
+    sink.start( state )
+    for o in outcomes:
+        state.record( o )
+        sink.result( o, state )
+    sink.finish( state )
+
+def test_merged_shards_add_up( tmp_path ):
+    write_run( tmp_path / 'one.ndjson', tmp_path, [
+        outcome( tmp_path / 'a.py', 'passed', runtime=True ),
+        outcome( tmp_path / 'b.py', 'syntax', 'Syntax error: b.py' ) ] )
+    write_run( tmp_path / 'two.ndjson', tmp_path, [
+        outcome( tmp_path / 'c.py', 'error', 'Error executing script', runtime=True ),
+        outcome( tmp_path / 'd.py', 'cached', syntax=False ) ] )
+    state = merge_results( [ tmp_path / 'one.ndjson', tmp_path / 'two.ndjson' ] )
+    summary = state.summary
+    assert summary['total'] == 4
+    assert summary['passed'] == 1
+    assert summary['cached'] == 1
+    assert summary['checked_syntax'] == 3
+    assert summary['errors_syntax'] == 1
+    assert summary['errors_runtime'] == 1
+    assert summary['passed_syntax'] == 2
+    assert state.failed
+    assert summary['problems'] == {
+        'b.py': { 'msg': 'Syntax error: b.py', 'type': 'syntax' },
+        'c.py': { 'msg': 'Error executing script', 'type': 'error' } }
+
+def test_a_passing_merge_has_not_failed( tmp_path ):
+    write_run( tmp_path / 'one.ndjson', tmp_path, [ outcome( tmp_path / 'a.py', 'passed', runtime=True ) ] )
+    write_run( tmp_path / 'two.ndjson', tmp_path, [] )
+    state = merge_results( [ tmp_path / 'one.ndjson', tmp_path / 'two.ndjson' ] )
+    assert state.summary['total'] == 1
+    assert not state.failed
+
+def test_a_file_checked_by_two_shards_is_an_error( tmp_path ):
+    for name in ( 'one', 'two' ):
+        write_run( tmp_path / f'{name}.ndjson', tmp_path, [ outcome( tmp_path / 'a.py', 'passed' ) ] )
+    with pytest.raises( ValueError, match='checked in both' ):
+        merge_results( [ tmp_path / 'one.ndjson', tmp_path / 'two.ndjson' ] )
+
+def test_an_unfinished_run_is_an_error( tmp_path ):
+    record = { 'type': 'result', 'file': 'a.py', 'status': 'passed', 'message': None }
+    (tmp_path / 'one.ndjson').write_text( json.dumps(record) + '\n' )
+    with pytest.raises( ValueError, match='no summary record' ):
+        merge_results( [ tmp_path / 'one.ndjson' ] )
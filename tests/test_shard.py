@@ -0,0 +1,49 @@
+import pytest
+
+from mkdocs_codecheck.samples import Sample
+from mkdocs_codecheck.shard import partition, shard_samples, parse_shard
+
+def samples( root, names ):
+    for name in names:
+        (root / name).write_text( '' )
+    return [ Sample( root, name, root ) for name in names ]
+
+def names( shard ):
+    return sorted( f.name for f in shard )
+
+def test_the_split_does_not_depend_on_the_order_of_the_samples( tmp_path ):
+    found = samples( tmp_path, [ f'sample{n}.py' for n in range(40) ] )
+    forward = partition( found, 3, root=tmp_path )
+    backward = partition( list(reversed(found)), 3, root=tmp_path )
+    assert [ names(s) for s in forward ] == [ names(s) for s in backward ]
+
+def test_every_sample_is_in_exactly_one_shard( tmp_path ):
+    found = samples( tmp_path, [ f'sample{n}.py' for n in range(25) ] )
+    shards = [ shard_samples( found, (k, 4), root=tmp_path ) for k in range(1, 5) ]
+    assert sorted( name for s in shards for name in names(s) ) == sorted( f.name for f in found )
+
+def test_without_durations_shards_get_as_many_samples( tmp_path ):
+    found = samples( tmp_path, [ f'sample{n}.py' for n in range(100) ] )
+    assert [ len(s) for s in partition( found, 4, root=tmp_path ) ] == [ 25, 25, 25, 25 ]
+
+def test_durations_balance_the_time_of_each_shard( tmp_path ):
+    found = samples( tmp_path, [ 'slow.py', 'a.py', 'b.py', 'c.py', 'd.py' ] )
+    durations = { 'slow.py': 40.0, 'a.py': 10.0, 'b.py': 10.0, 'c.py': 10.0, 'd.py': 10.0 }
+    shards = partition( found, 2, durations, root=tmp_path )
+    assert sorted( names(s) for s in shards ) == [ [ 'a.py', 'b.py', 'c.py', 'd.py' ], [ 'slow.py' ] ]
+
+def test_java_sources_of_a_directory_stay_together( tmp_path ):
+    for d in ( 'one', 'two' ):
+        (tmp_path / d).mkdir()
+    found = samples( tmp_path / 'one', [ 'Main.java', 'Helper.java' ] ) + samples( tmp_path / 'two', [ 'App.java' ] )
+    for s in partition( found, 3, root=tmp_path ):
+        dirs = { f.dir for f in s }
+        assert len(dirs) <= 1
+        if tmp_path / 'one' in dirs:
+            assert names(s) == [ 'Helper.java', 'Main.java' ]
+
+def test_parse_shard():
+    assert parse_shard( '2/8' ) == (2, 8)
+    for spec in ( '0/8', '9/8', '1/0', 'two/eight', '' ):
+        with pytest.raises( ValueError ):
+            parse_shard( spec )